@@ -0,0 +1,421 @@
+"""Host-side analysis of captured waveforms."""
+
+from typing import NamedTuple, Optional, Tuple
+
+import numpy as np
+from scipy.signal import hilbert
+
+
+def sample_interval(t: np.ndarray) -> float:
+    return float(t[1] - t[0]) if t.size > 1 else 1.0
+
+
+def dominant_frequency(t: np.ndarray, y: np.ndarray) -> Optional[float]:
+    """Frequency of the strongest spectral line, refined by parabolic interpolation."""
+    y = y - y.mean()
+    if y.size < 4 or not np.any(y):
+        return None
+    spectrum = np.abs(np.fft.rfft(y * np.hanning(y.size)))
+    spectrum[0] = 0.0
+    k = int(np.argmax(spectrum))
+    if 0 < k < spectrum.size - 1:
+        a, b, c = spectrum[k - 1 : k + 2]
+        denom = a - 2 * b + c
+        k = k + (0.5 * (a - c) / denom if denom else 0.0)
+    return k / (y.size * sample_interval(t))
+
+
+def _parabolic_peak(values: np.ndarray, index: int) -> float:
+    if 0 < index < values.size - 1:
+        a, b, c = values[index - 1 : index + 2]
+        denom = a - 2 * b + c
+        if denom:
+            return index + 0.5 * (a - c) / denom
+    return float(index)
+
+
+def cross_correlation_delay(
+    t: np.ndarray,
+    reference: np.ndarray,
+    signal: np.ndarray,
+    max_lag: Optional[float] = None,
+) -> float:
+    """Delay of `signal` relative to `reference` in seconds (positive = later).
+
+    The correlation is computed through the FFT, so its cost is O(n log n).
+    For periodic signals, pass `max_lag` (e.g. half a period) so that the
+    search does not lock onto a neighbouring cycle.
+    """
+    n = reference.size
+    a = reference - reference.mean()
+    b = signal - signal.mean()
+    size = 1 << int(2 * n - 1).bit_length()
+    corr = np.fft.irfft(np.fft.rfft(b, size) * np.conj(np.fft.rfft(a, size)), size)
+    # 重新排列为滞后 -(n-1) ... (n-1)
+    corr = np.concatenate((corr[-(n - 1) :], corr[:n]))
+    lags = np.arange(-(n - 1), n)
+    # 按重叠长度归一化，避免有限窗口使峰值偏向零滞后
+    corr /= n - np.abs(lags)
+    dt = sample_interval(t)
+    if max_lag is not None:
+        window = np.abs(lags) <= max(1, int(max_lag / dt))
+        corr = np.where(window, corr, -np.inf)
+    index = int(np.argmax(corr))
+    finite = np.where(np.isfinite(corr), corr, corr[index])
+    return (_parabolic_peak(finite, index) - (n - 1)) * dt
+
+
+def phase_difference(delay: float, frequency: float) -> float:
+    """Phase shift in degrees, wrapped to (-180, 180]."""
+    phase = (delay * frequency * 360.0) % 360.0
+    return phase - 360.0 if phase > 180.0 else phase
+
+
+# 电平直方图的分箱数，用于确定顶值和底值
+LEVEL_HISTOGRAM_BINS = 256
+
+
+class WaveformMetrics(NamedTuple):
+    """Measurements of one captured trace, in volts, seconds and hertz.
+
+    Edge-based items are None when the trace has no complete edge.
+    """
+
+    vpp: float
+    vmax: float
+    vmin: float
+    vavg: float
+    vrms: float
+    vtop: float
+    vbase: float
+    amplitude: float
+    rise_time: Optional[float]
+    fall_time: Optional[float]
+    frequency: Optional[float]
+    ripple_rms: float
+    slew_rate_rise: Optional[float]
+    slew_rate_fall: Optional[float]
+
+    def summary(self) -> str:
+        def fmt(value, unit, scale=1.0):
+            return f"{value * scale:.6g} {unit}" if value is not None else "无法测量"
+
+        return (
+            f"峰峰值: {fmt(self.vpp, 'V')}\n"
+            f"最大值: {fmt(self.vmax, 'V')}\n"
+            f"最小值: {fmt(self.vmin, 'V')}\n"
+            f"平均值: {fmt(self.vavg, 'V')}\n"
+            f"有效值: {fmt(self.vrms, 'V')}\n"
+            f"幅度(顶值-底值): {fmt(self.amplitude, 'V')}\n"
+            f"上升时间: {fmt(self.rise_time, 'ns', 1e9)}\n"
+            f"下降时间: {fmt(self.fall_time, 'ns', 1e9)}\n"
+            f"频率: {fmt(self.frequency, 'Hz')}\n"
+            f"纹波(交流有效值): {fmt(self.ripple_rms, 'mV', 1e3)}\n"
+            f"上升压摆率: {fmt(self.slew_rate_rise, 'V/us', 1e-6)}\n"
+            f"下降压摆率: {fmt(self.slew_rate_fall, 'V/us', 1e-6)}\n"
+        )
+
+
+def top_base(y: np.ndarray, bins: int = LEVEL_HISTOGRAM_BINS):
+    """Most frequent level in the upper and lower half of the trace.
+
+    Like the scope's VTOP/VBASe, this ignores overshoot on square waves; for
+    waveforms without flat levels it degrades to the maximum and minimum.
+    """
+    vmin, vmax = float(y.min()), float(y.max())
+    if vmax == vmin:
+        return vmax, vmin
+    counts, edges = np.histogram(y, bins=bins, range=(vmin, vmax))
+    centres = (edges[:-1] + edges[1:]) / 2
+    half = bins // 2
+    top = centres[half + int(np.argmax(counts[half:]))]
+    base = centres[int(np.argmax(counts[:half]))]
+    # 没有明显平台时（如正弦波），直方图峰值出现在极值附近的分箱
+    top = vmax if counts[half:].max() <= counts.mean() else top
+    base = vmin if counts[:half].max() <= counts.mean() else base
+    return float(top), float(base)
+
+
+def level_crossings(t: np.ndarray, y: np.ndarray, level: float, rising: bool) -> np.ndarray:
+    """Linearly interpolated times at which `y` crosses `level`."""
+    above = y >= level
+    index = np.flatnonzero(above[1:] & ~above[:-1] if rising else ~above[1:] & above[:-1])
+    y0, y1 = y[index], y[index + 1]
+    fraction = (level - y0) / (y1 - y0)
+    return t[index] + fraction * (t[index + 1] - t[index])
+
+
+def edge_delay(
+    t: np.ndarray,
+    reference: np.ndarray,
+    signal: np.ndarray,
+    max_lag: Optional[float] = None,
+) -> Optional[float]:
+    """Delay of `signal` relative to `reference` from their mid-level rising edges.
+
+    Each rising edge of the reference is paired with the nearest rising edge
+    of the signal; the median of the pairs within `max_lag` is returned, or
+    None if there is none. Unlike the cross-correlation this needs no
+    complete period, only one edge of each trace.
+    """
+    edges = []
+    for y in (reference, signal):
+        top, base = top_base(y)
+        edges.append(level_crossings(t, y, (top + base) / 2, rising=True))
+    ref, sig = edges
+    if not ref.size or not sig.size:
+        return None
+    lags = sig[None, :] - ref[:, None]
+    lags = lags[np.arange(ref.size), np.argmin(np.abs(lags), axis=1)]
+    if max_lag is not None:
+        lags = lags[np.abs(lags) <= max_lag]
+    return float(np.median(lags)) if lags.size else None
+
+
+def _edge_durations(starts: np.ndarray, ends: np.ndarray):
+    """Pair each end crossing with the last start crossing before it.
+
+    Noise around either threshold produces extra crossings; only the first
+    end crossing after a given start is kept, so each edge counts once.
+    Returns `(durations, edge_times)`.
+    """
+    index = np.searchsorted(starts, ends) - 1
+    valid = index >= 0
+    index, ends = index[valid], ends[valid]
+    index, first = np.unique(index, return_index=True)
+    ends = ends[first]
+    return ends - starts[index], (ends + starts[index]) / 2
+
+
+def waveform_metrics(t: np.ndarray, y: np.ndarray) -> WaveformMetrics:
+    """Compute the standard scope measurements from one capture.
+
+    Rise/fall times use the 10%/90% points between base and top. The
+    frequency is taken from the spacing of complete rising edges, and from
+    the spectrum when fewer than two edges are captured.
+    """
+    y = np.asarray(y, dtype=np.float64)
+    vmax, vmin = float(y.max()), float(y.min())
+    vavg = float(y.mean())
+    vrms = float(np.sqrt(np.mean(y * y)))
+    vtop, vbase = top_base(y)
+    amplitude = vtop - vbase
+
+    rise_time = fall_time = frequency = None
+    slew_rise = slew_fall = None
+    if amplitude > 0:
+        low = vbase + 0.1 * amplitude
+        high = vbase + 0.9 * amplitude
+        rises, rise_edges = _edge_durations(
+            level_crossings(t, y, low, True), level_crossings(t, y, high, True)
+        )
+        falls, _ = _edge_durations(
+            level_crossings(t, y, high, False), level_crossings(t, y, low, False)
+        )
+        if rises.size:
+            rise_time = float(np.median(rises))
+            slew_rise = 0.8 * amplitude / rise_time if rise_time > 0 else None
+        if falls.size:
+            fall_time = float(np.median(falls))
+            slew_fall = 0.8 * amplitude / fall_time if fall_time > 0 else None
+        if rise_edges.size >= 2:
+            frequency = 1.0 / float(np.median(np.diff(rise_edges)))
+    if frequency is None:
+        frequency = dominant_frequency(t, y)
+
+    return WaveformMetrics(
+        vpp=vmax - vmin,
+        vmax=vmax,
+        vmin=vmin,
+        vavg=vavg,
+        vrms=vrms,
+        vtop=vtop,
+        vbase=vbase,
+        amplitude=amplitude,
+        rise_time=rise_time,
+        fall_time=fall_time,
+        frequency=frequency,
+        ripple_rms=float(y.std()),
+        slew_rate_rise=slew_rise,
+        slew_rate_fall=slew_fall,
+    )
+
+
+# 幅频特性曲线的默认频点数
+RESPONSE_POINTS = 200
+
+
+def sweep_frequency(
+    elapsed: np.ndarray,
+    f_start: float,
+    f_stop: float,
+    sweep_time: float,
+    sweep_type: str = "LINe",
+) -> np.ndarray:
+    """Instantaneous frequency of the AWG sweep `elapsed` seconds after it started."""
+    fraction = np.clip(elapsed / sweep_time, 0.0, 1.0)
+    if sweep_type.upper().startswith("LOG"):
+        return f_start * (f_stop / f_start) ** fraction
+    return f_start + (f_stop - f_start) * fraction
+
+
+def envelope(y: np.ndarray) -> np.ndarray:
+    """Amplitude envelope from the analytic signal of the AC component."""
+    return np.abs(hilbert(y - y.mean()))
+
+
+def _bin_index(frequency: np.ndarray, edges: np.ndarray) -> np.ndarray:
+    return np.clip(np.searchsorted(edges, frequency, side="right") - 1, 0, edges.size - 2)
+
+
+def _crossing(f: np.ndarray, gain: np.ndarray, i: int, j: int, level: float, log: bool) -> float:
+    """Interpolate the frequency where the gain passes `level` between bins i and j."""
+    x = np.log10(f[[i, j]]) if log else f[[i, j]]
+    g0, g1 = gain[i], gain[j]
+    x0 = x[0] + (level - g0) * (x[1] - x[0]) / (g1 - g0) if g1 != g0 else x[0]
+    return float(10**x0) if log else float(x0)
+
+
+def bandwidth_3db(
+    frequency: np.ndarray, gain_db: np.ndarray, log: bool = False
+) -> Tuple[Optional[float], Optional[float]]:
+    """Lower and upper -3 dB corners around the gain peak (None if not reached)."""
+    peak = int(np.nanargmax(gain_db))
+    level = gain_db[peak] - 3.0
+    below = gain_db < level
+    low = high = None
+    lower = np.flatnonzero(below[:peak])
+    if lower.size:
+        i = int(lower[-1])
+        low = _crossing(frequency, gain_db, i, i + 1, level, log)
+    upper = np.flatnonzero(below[peak:])
+    if upper.size:
+        j = peak + int(upper[0])
+        high = _crossing(frequency, gain_db, j - 1, j, level, log)
+    return low, high
+
+
+class FrequencyResponse(NamedTuple):
+    """Magnitude response measured from a swept-sine capture."""
+
+    frequency: np.ndarray
+    magnitude: np.ndarray
+    gain_db: np.ndarray
+    peak_frequency: float
+    peak_gain_db: float
+    f_low: Optional[float]
+    f_high: Optional[float]
+    log: bool
+
+    def summary(self) -> str:
+        def fmt(value):
+            return f"{value:.6g} Hz" if value is not None else "未出现在扫频范围内"
+
+        if self.f_high is not None:
+            bandwidth = self.f_high - (self.f_low or 0.0)
+            bandwidth_text = f"{bandwidth:.6g} Hz"
+        else:
+            bandwidth_text = "超出扫频范围"
+        return (
+            f"扫频范围: {self.frequency[0]:.6g} Hz - {self.frequency[-1]:.6g} Hz\n"
+            f"峰值增益频率: {self.peak_frequency:.6g} Hz\n"
+            f"峰值增益: {self.peak_gain_db:.4g} dB\n"
+            f"下限截止频率(-3 dB): {fmt(self.f_low)}\n"
+            f"上限截止频率(-3 dB): {fmt(self.f_high)}\n"
+            f"-3 dB 带宽: {bandwidth_text}\n"
+        )
+
+
+def frequency_response(
+    t: np.ndarray,
+    y: np.ndarray,
+    f_start: float,
+    f_stop: float,
+    sweep_time: float,
+    sweep_type: str = "LINe",
+    sweep_origin: float = 0.0,
+    reference: Optional[float] = None,
+    points: int = RESPONSE_POINTS,
+) -> FrequencyResponse:
+    """Turn one capture of a swept sine into a magnitude-vs-frequency curve.
+
+    Each sample is mapped to the sweep frequency at its time (`sweep_origin`
+    is the time the sweep started on the capture's axis) and grouped into
+    `points` bins spaced like the sweep. When the capture resolves the
+    carrier the envelope comes from the Hilbert transform; otherwise, e.g.
+    with peak-detect acquisition, half the min-to-max span of each bin is
+    used. Gain is relative to the `reference` amplitude (volts) if given,
+    else to the largest magnitude.
+    """
+    y = np.asarray(y, dtype=np.float64)
+    log = sweep_type.upper().startswith("LOG")
+    elapsed = t - sweep_origin
+    inside = (elapsed >= 0) & (elapsed <= sweep_time)
+    elapsed, y = elapsed[inside], y[inside]
+    if y.size < 2:
+        raise ValueError("Capture does not overlap the sweep")
+    frequency = sweep_frequency(elapsed, f_start, f_stop, sweep_time, sweep_type)
+
+    if log:
+        edges = np.geomspace(f_start, f_stop, points + 1)
+    else:
+        edges = np.linspace(f_start, f_stop, points + 1)
+    index = _bin_index(frequency, edges)
+    counts = np.bincount(index, minlength=points)
+
+    sample_rate = 1.0 / sample_interval(t)
+    if max(f_start, f_stop) < 0.25 * sample_rate:
+        magnitude = np.bincount(index, envelope(y), minlength=points)
+        magnitude = magnitude / np.maximum(counts, 1)
+    else:
+        order = np.argsort(index, kind="stable")
+        starts = np.searchsorted(index[order], np.arange(points))
+        nonempty = counts > 0
+        highs = np.full(points, np.nan)
+        lows = np.full(points, np.nan)
+        highs[nonempty] = np.maximum.reduceat(y[order], starts[nonempty])
+        lows[nonempty] = np.minimum.reduceat(y[order], starts[nonempty])
+        magnitude = (highs - lows) / 2
+
+    valid = (counts > 0) & np.isfinite(magnitude)
+    centres = np.sqrt(edges[:-1] * edges[1:]) if log else (edges[:-1] + edges[1:]) / 2
+    return response_from_points(centres[valid], magnitude[valid], reference, log)
+
+
+def relative_gain_db(magnitude: np.ndarray, reference: Optional[float] = None) -> np.ndarray:
+    scale = reference if reference else np.max(magnitude)
+    return 20 * np.log10(np.maximum(magnitude, 1e-12) / scale)
+
+
+def response_from_points(
+    frequency: np.ndarray,
+    magnitude: np.ndarray,
+    reference: Optional[float] = None,
+    log: bool = False,
+) -> FrequencyResponse:
+    """Build a `FrequencyResponse` from magnitudes at ascending frequencies."""
+    gain = relative_gain_db(magnitude, reference)
+    peak = int(np.argmax(gain))
+    f_low, f_high = bandwidth_3db(frequency, gain, log)
+    return FrequencyResponse(
+        frequency=frequency,
+        magnitude=magnitude,
+        gain_db=gain,
+        peak_frequency=float(frequency[peak]),
+        peak_gain_db=float(gain[peak]),
+        f_low=f_low,
+        f_high=f_high,
+        log=log,
+    )
+
+
+def tone_amplitude(t: np.ndarray, y: np.ndarray, frequency: float) -> float:
+    """Peak amplitude of the component of `y` at a known frequency.
+
+    A least-squares fit of a sine, a cosine and an offset, so it does not
+    need an integer number of periods in the capture.
+    """
+    phase = 2 * np.pi * frequency * (t - t[0])
+    basis = np.column_stack((np.cos(phase), np.sin(phase), np.ones_like(phase)))
+    (a, b, _), *_ = np.linalg.lstsq(basis, np.asarray(y, dtype=np.float64), rcond=None)
+    return float(np.hypot(a, b))
@@ -0,0 +1,63 @@
+"""Per-call cost of token counting: tiktoken lookup on every call vs the encoding registry.
+
+    python benchmark_tokens.py [model ...]
+
+Without arguments the model in API_MODEL (or a custom model name) and
+gpt-4 are measured.
+"""
+
+import os
+import sys
+import timeit
+
+import tiktoken
+from tiktoken.model import encoding_name_for_model
+
+from core.encodings import DEFAULT_ENCODING, _resolve, encoding_for_model
+
+TEXT = "Action: observe_channel_wave\nAction Input: channel=CHAN1, scale=0.5\n" * 4
+NUMBER = 20000
+
+
+def legacy_resolve(model):
+    # 改动前各调用点的写法：未知模型每次都抛一次 KeyError
+    try:
+        return encoding_name_for_model(model)
+    except KeyError:
+        return DEFAULT_ENCODING
+
+
+def legacy_count(model):
+    try:
+        encoding = tiktoken.encoding_for_model(model)
+    except KeyError:
+        encoding = tiktoken.get_encoding(DEFAULT_ENCODING)
+    return len(encoding.encode(TEXT))
+
+
+def registry_count(model):
+    return len(encoding_for_model(model)[1].encode(TEXT))
+
+
+def per_call_us(func, model):
+    func(model)  # 首次调用（加载编码）不计入
+    return timeit.timeit(lambda: func(model), number=NUMBER) / NUMBER * 1e6
+
+
+def main(models):
+    print(f"{'model':<24}{'step':<14}{'legacy/us':>12}{'registry/us':>14}")
+    for model in models:
+        legacy = per_call_us(legacy_resolve, model)
+        cached = per_call_us(lambda m: _resolve(m)[1], model)
+        print(f"{model:<24}{'resolve':<14}{legacy:>12.2f}{cached:>14.2f}")
+        try:
+            legacy = per_call_us(legacy_count, model)
+            cached = per_call_us(registry_count, model)
+        except Exception as e:
+            print(f"{model:<24}{'count':<14}  编码加载失败，跳过: {e}")
+            continue
+        print(f"{model:<24}{'count':<14}{legacy:>12.2f}{cached:>14.2f}")
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:] or [os.getenv("API_MODEL") or "qwen-72b-chat", "gpt-4"])
@@ -1,3 +1,5 @@
+import functools
+import os
 import pickle
 from operator import itemgetter
 from langchain_core.output_parsers import StrOutputParser
@@ -12,6 +14,8 @@ from util import LimitedHistoryMemory
 
 from tools import *
 from fb_planning import *
+from speculation import SpeculativeConnector
+from core.encodings import warm_up_in_background
 import importlib.util
 import sys
 
@@ -19,6 +23,9 @@ import sys
 from llm_core import *
 ##
 
+# react: 文本 ReAct 提示词；tools: 模型原生的工具调用
+AGENT_MODE = os.getenv("AGENT_MODE", "react")
+
 
 question_template = """
 你现在扮演一名电子测量工程师，用户的需求是：“{input}”。
@@ -50,6 +57,7 @@ def exception_handler(func):
             # sys.exit(1)
     return wrapper
 
+@functools.lru_cache(maxsize=None)
 @exception_handler
 def load_templates(file_path):
     with open(file_path, 'rb') as file:
@@ -78,20 +86,34 @@ def _handle_error(error) -> str:
     
     return str(error)
 
-@exception_handler
-def main():
+@functools.lru_cache(maxsize=None)
+def build_chain():
+    """规划链和 Agent 执行器只构建一次，之后的请求直接复用"""
     templates = load_templates('templates_data22.pkl')
     llm = LLM()
-    memory = LimitedHistoryMemory(memory_key="chat_history", return_messages=True, max_history_length=10)
     output_parser = StrOutputParser()
     prompt_process = ChatPromptTemplate.from_template(question_template)
     prompt_agent = ChatPromptTemplate.from_template(templates)
     process_chain = prompt_process | llm | output_parser | {"process": RunnablePassthrough()}
-    agent = create_react_agent(llm, tools, prompt=prompt_agent)
-    agent_executor = AgentExecutor(agent=agent, tools=tools, verbose=True, handle_parsing_errors=_handle_error,max_execution_time=30)
+    if AGENT_MODE == "tools":
+        agent = create_tool_calling_agent(llm, tools)
+    else:
+        # 模型输出工具名后即在后台连接该工具用到的仪器
+        connector = SpeculativeConnector(registry, tools)
+        agent = create_react_agent(
+            llm, tools, prompt=prompt_agent, multi_action=True, connector=connector
+        )
+    agent_executor = ParallelAgentExecutor(agent=agent, tools=tools, verbose=True, handle_parsing_errors=_handle_error,max_execution_time=30)
+    return process_chain | agent_executor
 
 
-    total_chain = process_chain | agent_executor
+@exception_handler
+def main():
+    # tiktoken 编码在后台预加载，首次 token 计数时不再等待加载/下载
+    warm_up_in_background([os.getenv("API_MODEL")])
+    setup_bench()
+    memory = LimitedHistoryMemory(memory_key="chat_history", return_messages=True, max_history_length=10)
+    total_chain = build_chain()
     print(total_chain.get_graph().print_ascii())
     response1 = total_chain.invoke({"input": "帮我测试一下这个运算放大器的压摆率"})
     print(str(response1))
@@ -0,0 +1,2 @@
+# test_parser.py 是交互式脚本（导入时即调用 input()），不作为测试收集
+collect_ignore = ["test_parser.py"]
@@ -6,6 +6,7 @@ import json
 import logging
 import os
 import sys
+from contextvars import ContextVar
 from operator import itemgetter
 from typing import (
     Any,
@@ -70,7 +71,12 @@ from langchain_core.output_parsers.openai_tools import (
 )
 from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
 from langchain_core.pydantic_v1 import BaseModel, Field, SecretStr, root_validator
-from langchain_core.runnables import Runnable, RunnableMap, RunnablePassthrough
+from langchain_core.runnables import (
+    Runnable,
+    RunnableConfig,
+    RunnableMap,
+    RunnablePassthrough,
+)
 from langchain_core.tools import BaseTool
 from langchain_core.utils import (
     convert_to_secret_str,
@@ -83,6 +89,9 @@ from langchain_core.utils.function_calling import (
 )
 from langchain_core.utils.utils import build_extra_kwargs
 
+from core.encodings import count_message_tokens, encoding_for_model
+from core.http_clients import shared_async_http_client, shared_http_client
+
 logger = logging.getLogger(__name__)
 
 
@@ -276,6 +285,44 @@ def _convert_delta_to_message_chunk(
         return default_class(content=content, id=id_)  # type: ignore
 
 
+def _cut_at_stop_condition(
+    stop_condition: Callable[[str], Optional[int]], text: str, chunk: ChatGenerationChunk
+) -> Tuple[str, ChatGenerationChunk, bool]:
+    """Append `chunk` to `text` and apply `stop_condition` to the result.
+
+    `stop_condition` returns the end of the output within the text so far,
+    or None to keep streaming. Returns the new text, the chunk (cut at that
+    end and given finish_reason "stop" once it is reached) and whether the
+    stream is finished.
+    """
+    text += chunk.text
+    end = stop_condition(text)
+    if end is None:
+        return text, chunk, False
+    keep = max(len(chunk.text) - (len(text) - end), 0)
+    message = AIMessageChunk(
+        content=chunk.text[:keep],
+        additional_kwargs=chunk.message.additional_kwargs,
+        response_metadata=chunk.message.response_metadata,
+        id=chunk.message.id,
+        tool_call_chunks=getattr(chunk.message, "tool_call_chunks", []),
+    )
+    generation_info = {**(chunk.generation_info or {}), "finish_reason": "stop"}
+    return (
+        text[:end],
+        ChatGenerationChunk(message=message, generation_info=generation_info),
+        True,
+    )
+
+
+# stream()/astream() 把 stop_condition 放在这里交给 _stream/_astream，而不是作为
+# 调用参数传下去：BaseChatModel.stream 会把调用参数原样放进 on_chat_model_start 的
+# options，回调和 tracer 里就会出现这个函数对象
+_stop_condition: ContextVar[Optional[Callable[[str], Optional[int]]]] = ContextVar(
+    "stop_condition", default=None
+)
+
+
 class _FunctionCall(TypedDict):
     name: str
 
@@ -402,29 +449,15 @@ class BaseChatOpenAI(BaseChatModel):
 
         pro = values["pro"]
         if not values.get("client"):
-            if pro and not values["http_client"]:
-                try:
-                    import httpx
-                except ImportError as e:
-                    raise ImportError(
-                        "Could not import httpx python package. "
-                        "Please install it with `pip install httpx`."
-                    ) from e
-                values["http_client"] = httpx.Client(proxy=pro)
+            if not values["http_client"]:
+                values["http_client"] = shared_http_client(pro)
             sync_specific = {"http_client": values["http_client"]}
             values["client"] = openai.OpenAI(
                 **client_params, **sync_specific
             ).chat.completions
         if not values.get("async_client"):
-            if pro and not values["http_async_client"]:
-                try:
-                    import httpx
-                except ImportError as e:
-                    raise ImportError(
-                        "Could not import httpx python package. "
-                        "Please install it with `pip install httpx`."
-                    ) from e
-                values["http_async_client"] = httpx.AsyncClient(proxy=pro)
+            if not values["http_async_client"]:
+                values["http_async_client"] = shared_async_http_client(pro)
             async_specific = {"http_client": values["http_async_client"]}
             values["async_client"] = openai.AsyncOpenAI(
                 **client_params, **async_specific
@@ -466,6 +499,52 @@ class BaseChatOpenAI(BaseChatModel):
             combined["system_fingerprint"] = system_fingerprint
         return combined
 
+    def stream(
+        self,
+        input: LanguageModelInput,
+        config: Optional[RunnableConfig] = None,
+        *,
+        stop: Optional[List[str]] = None,
+        **kwargs: Any,
+    ) -> Iterator[BaseMessageChunk]:
+        stop_condition = kwargs.pop("stop_condition", None)
+        chunks = super().stream(input, config, stop=stop, **kwargs)
+        try:
+            while True:
+                token = _stop_condition.set(stop_condition)
+                try:
+                    chunk = next(chunks)
+                except StopIteration:
+                    return
+                finally:
+                    _stop_condition.reset(token)
+                yield chunk
+        finally:
+            chunks.close()
+
+    async def astream(
+        self,
+        input: LanguageModelInput,
+        config: Optional[RunnableConfig] = None,
+        *,
+        stop: Optional[List[str]] = None,
+        **kwargs: Any,
+    ) -> AsyncIterator[BaseMessageChunk]:
+        stop_condition = kwargs.pop("stop_condition", None)
+        chunks = super().astream(input, config, stop=stop, **kwargs)
+        try:
+            while True:
+                token = _stop_condition.set(stop_condition)
+                try:
+                    chunk = await chunks.__anext__()
+                except StopAsyncIteration:
+                    return
+                finally:
+                    _stop_condition.reset(token)
+                yield chunk
+        finally:
+            await chunks.aclose()
+
     def _stream(
         self,
         messages: List[BaseMessage],
@@ -473,9 +552,12 @@ class BaseChatOpenAI(BaseChatModel):
         run_manager: Optional[CallbackManagerForLLMRun] = None,
         **kwargs: Any,
     ) -> Iterator[ChatGenerationChunk]:
+        # stop_condition 在本地判断输出是否已经结束，结束后关闭响应，不发送给接口
+        stop_condition = kwargs.pop("stop_condition", None) or _stop_condition.get()
         message_dicts, params = self._create_message_dicts(messages, stop)
         params = {**params, **kwargs, "stream": True}
 
+        text, finished = "", False
         default_chunk_class = AIMessageChunk
         with self.client.create(messages=message_dicts, **params) as response:
             for chunk in response:
@@ -499,11 +581,17 @@ class BaseChatOpenAI(BaseChatModel):
                 chunk = ChatGenerationChunk(
                     message=chunk, generation_info=generation_info or None
                 )
+                if stop_condition is not None:
+                    text, chunk, finished = _cut_at_stop_condition(
+                        stop_condition, text, chunk
+                    )
                 if run_manager:
                     run_manager.on_llm_new_token(
                         chunk.text, chunk=chunk, logprobs=logprobs
                     )
                 yield chunk
+                if finished:
+                    return
 
     def _generate(
         self,
@@ -572,9 +660,12 @@ class BaseChatOpenAI(BaseChatModel):
         run_manager: Optional[AsyncCallbackManagerForLLMRun] = None,
         **kwargs: Any,
     ) -> AsyncIterator[ChatGenerationChunk]:
+        # stop_condition 在本地判断输出是否已经结束，结束后关闭响应，不发送给接口
+        stop_condition = kwargs.pop("stop_condition", None) or _stop_condition.get()
         message_dicts, params = self._create_message_dicts(messages, stop)
         params = {**params, **kwargs, "stream": True}
 
+        text, finished = "", False
         default_chunk_class = AIMessageChunk
         response = await self.async_client.create(messages=message_dicts, **params)
         async with response:
@@ -599,11 +690,17 @@ class BaseChatOpenAI(BaseChatModel):
                 chunk = ChatGenerationChunk(
                     message=chunk, generation_info=generation_info or None
                 )
+                if stop_condition is not None:
+                    text, chunk, finished = _cut_at_stop_condition(
+                        stop_condition, text, chunk
+                    )
                 if run_manager:
                     await run_manager.on_llm_new_token(
                         token=chunk.text, chunk=chunk, logprobs=logprobs
                     )
                 yield chunk
+                if finished:
+                    return
 
     async def _agenerate(
         self,
@@ -636,7 +733,7 @@ class BaseChatOpenAI(BaseChatModel):
             "model": self.mod.get_secret_value(),
             **super()._get_invocation_params(stop=stop),
             **self._default_params,
-            **kwargs,
+            **{k: v for k, v in kwargs.items() if k != "stop_condition"},
         }
 
     @property
@@ -644,17 +741,13 @@ class BaseChatOpenAI(BaseChatModel):
         """Return type of chat model."""
         return "openai-chat"
 
-    def _get_encoding_model(self) -> Tuple[str, tiktoken.Encoding]:
+    def _tiktoken_model_name(self) -> str:
         if self.tiktoken_mod is not None:
-            model = self.tiktoken_mod
-        else:
-            model = self.mod.get_secret_value()
-        try:
-            encoding = tiktoken.encoding_for_model(model)
-        except KeyError:
-            model = "cl100k_base"
-            encoding = tiktoken.get_encoding(model)
-        return model, encoding
+            return self.tiktoken_mod
+        return self.mod.get_secret_value()
+
+    def _get_encoding_model(self) -> Tuple[str, tiktoken.Encoding]:
+        return encoding_for_model(self._tiktoken_model_name())
 
     def get_token_ids(self, text: str) -> List[int]:
         """Get the tokens present in the text with tiktoken package."""
@@ -667,41 +760,21 @@ class BaseChatOpenAI(BaseChatModel):
         return encoding_model.encode(text)
 
     def get_num_tokens_from_messages(self, messages: List[BaseMessage]) -> int:
-        """Calculate num tokens for gpt-3.5-turbo and gpt-4 with tiktoken package.
+        """Calculate num tokens with tiktoken package, using the model's tokenizer profile.
+
+        Models without a registered profile (see
+        `core.encodings.register_tokenizer_profile`) are counted with the
+        gpt-4 message overheads. Per-message counts are cached by content
+        hash, so only new messages are tokenized.
 
         Official documentation: https://github.com/openai/openai-cookbook/blob/
         main/examples/How_to_format_inputs_to_ChatGPT_models.ipynb"""
         if sys.version_info[1] <= 7:
             return super().get_num_tokens_from_messages(messages)
-        model, encoding = self._get_encoding_model()
-        if model.startswith("gpt-3.5-turbo-0301"):
-            # every message follows <im_start>{role/name}\n{content}<im_end>\n
-            tokens_per_message = 4
-            # if there's a name, the role is omitted
-            tokens_per_name = -1
-        elif model.startswith("gpt-3.5-turbo") or model.startswith("gpt-4"):
-            tokens_per_message = 3
-            tokens_per_name = 1
-        else:
-            raise NotImplementedError(
-                f"get_num_tokens_from_messages() is not presently implemented "
-                f"for model {model}. See "
-                "https://platform.openai.com/docs/guides/text-generation/managing-tokens"
-                " for information on how messages are converted to tokens."
-            )
-        num_tokens = 0
-        messages_dict = [_convert_message_to_dict(m) for m in messages]
-        for message in messages_dict:
-            num_tokens += tokens_per_message
-            for key, value in message.items():
-                # Cast str(value) in case the message value is not a string
-                # This occurs with function messages
-                num_tokens += len(encoding.encode(str(value)))
-                if key == "name":
-                    num_tokens += tokens_per_name
-        # every reply is primed with <im_start>assistant
-        num_tokens += 3
-        return num_tokens
+        return count_message_tokens(
+            self._tiktoken_model_name(),
+            [_convert_message_to_dict(m) for m in messages],
+        )
 
     def bind_functions(
         self,
@@ -19,7 +19,6 @@ from typing import (
 )
 
 import openai
-import tiktoken
 from langchain_core.embeddings import Embeddings
 from langchain_core.pydantic_v1 import (
     BaseModel,
@@ -34,6 +33,9 @@ from langchain_core.utils import (
     get_pydantic_field_names,
 )
 
+from core.encodings import encoding_for_model
+from core.http_clients import shared_async_http_client, shared_http_client
+
 logger = logging.getLogger(__name__)
 
 
@@ -228,11 +230,15 @@ class OpenAIEmbeddings(BaseModel, Embeddings):
             "default_query": values["default_query"],
         }
         if not values.get("client"):
+            if not values["http_client"]:
+                values["http_client"] = shared_http_client(values["pro"])
             sync_specific = {"http_client": values["http_client"]}
             values["client"] = openai.OpenAI(
                 **client_params, **sync_specific
             ).embeddings
         if not values.get("async_client"):
+            if not values["http_async_client"]:
+                values["http_async_client"] = shared_async_http_client(values["pro"])
             async_specific = {"http_client": values["http_async_client"]}
             values["async_client"] = openai.AsyncOpenAI(
                 **client_params, **async_specific
@@ -280,10 +286,7 @@ class OpenAIEmbeddings(BaseModel, Embeddings):
                     tokens.append(chunk_text)
                     indices.append(i)
         else:
-            try:
-                encoding = tiktoken.encoding_for_model(mod)
-            except KeyError:
-                encoding = tiktoken.get_encoding("cl100k_base")
+            _, encoding = encoding_for_model(mod)
             encoder_kwargs: Dict[str, Any] = {
                 k: v
                 for k, v in {
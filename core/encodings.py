@@ -0,0 +1,183 @@
+"""Process-wide registry of tiktoken encodings and chat tokenizer profiles."""
+
+from __future__ import annotations
+
+import functools
+import hashlib
+import json
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, NamedTuple, Optional, Tuple
+
+import tiktoken
+from tiktoken.model import encoding_name_for_model
+
+DEFAULT_ENCODING = "cl100k_base"
+
+
+@functools.lru_cache(maxsize=None)
+def _resolve(model: str) -> Tuple[str, str]:
+    # 自定义模型名（OpenAI 兼容接口）在 tiktoken 中查不到，回退结果同样缓存，
+    # 避免每次 token 计数都抛一次 KeyError
+    try:
+        return model, encoding_name_for_model(model)
+    except KeyError:
+        return DEFAULT_ENCODING, DEFAULT_ENCODING
+
+
+@functools.lru_cache(maxsize=None)
+def get_encoding(name: str) -> tiktoken.Encoding:
+    return tiktoken.get_encoding(name)
+
+
+def encoding_for_model(model: str) -> Tuple[str, tiktoken.Encoding]:
+    """`(model, encoding)` for a model name, memoized.
+
+    Unknown model names resolve to `("cl100k_base", <cl100k_base>)`, the
+    same result the call sites used to compute through `KeyError`.
+    """
+    model, name = _resolve(model)
+    return model, get_encoding(name)
+
+
+def warm_up(models: Iterable[Optional[str]] = ()) -> None:
+    """Resolve and load the encodings of `models` ahead of the first call.
+
+    Loading an encoding the first time may download its BPE file; failures
+    are reported and left for the first real call to retry.
+    """
+    for model in [m for m in models if m] or [DEFAULT_ENCODING]:
+        try:
+            encoding_for_model(model)
+        except Exception as e:
+            print(f"tiktoken 编码预加载失败 ({model}): {e}")
+
+
+def warm_up_in_background(models: Iterable[Optional[str]] = ()) -> threading.Thread:
+    """Run `warm_up` on a daemon thread so startup is not blocked."""
+    thread = threading.Thread(
+        target=warm_up, args=(list(models),), name="tiktoken-warm-up", daemon=True
+    )
+    thread.start()
+    return thread
+
+
+class TokenizerProfile(NamedTuple):
+    """How a chat model turns messages into tokens.
+
+    `encoding` is a tiktoken encoding name; None uses the encoding tiktoken
+    knows for the model, or cl100k_base for unknown models.
+    """
+
+    tokens_per_message: int = 3
+    tokens_per_name: int = 1
+    encoding: Optional[str] = None
+    tokens_per_reply: int = 3
+
+
+DEFAULT_PROFILE = TokenizerProfile()
+
+# 按模型名前缀匹配，最长前缀优先；未匹配的模型（如 OpenAI 兼容接口上的自定义模型）
+# 使用 DEFAULT_PROFILE 的估算
+_profiles: Dict[str, TokenizerProfile] = {
+    # every message follows <im_start>{role/name}\n{content}<im_end>\n;
+    # if there's a name, the role is omitted
+    "gpt-3.5-turbo-0301": TokenizerProfile(tokens_per_message=4, tokens_per_name=-1),
+    "gpt-3.5-turbo": TokenizerProfile(),
+    "gpt-4": TokenizerProfile(),
+}
+_profiles_lock = threading.Lock()
+
+
+def register_tokenizer_profile(prefix: str, profile: TokenizerProfile) -> None:
+    """Use `profile` for every model whose name starts with `prefix`."""
+    with _profiles_lock:
+        _profiles[prefix] = profile
+        tokenizer_profile.cache_clear()
+
+
+@functools.lru_cache(maxsize=None)
+def tokenizer_profile(model: str) -> TokenizerProfile:
+    with _profiles_lock:
+        matches = [prefix for prefix in _profiles if model.startswith(prefix)]
+        return _profiles[max(matches, key=len)] if matches else DEFAULT_PROFILE
+
+
+def profile_encoding(model: str, profile: TokenizerProfile) -> Tuple[str, tiktoken.Encoding]:
+    if profile.encoding is not None:
+        return profile.encoding, get_encoding(profile.encoding)
+    return _resolve(model)[1], encoding_for_model(model)[1]
+
+
+MESSAGE_TOKEN_CACHE_SIZE = 4096
+
+
+def message_digest(message: Dict[str, Any]) -> str:
+    payload = json.dumps(message, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+class MessageTokenCache:
+    """Token counts of single messages, keyed by encoding, profile and content hash.
+
+    A ReAct conversation resends every earlier message on each step; with
+    the cache only the messages added since the last call are tokenized.
+    """
+
+    def __init__(self, maxsize: int = MESSAGE_TOKEN_CACHE_SIZE):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._counts: "OrderedDict[tuple, int]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def count(
+        self,
+        message: Dict[str, Any],
+        profile: TokenizerProfile,
+        encoding_name: str,
+        encoding: tiktoken.Encoding,
+    ) -> int:
+        key = (
+            encoding_name,
+            profile.tokens_per_message,
+            profile.tokens_per_name,
+            message_digest(message),
+        )
+        with self._lock:
+            cached = self._counts.get(key)
+            if cached is not None:
+                self._counts.move_to_end(key)
+                self.hits += 1
+                return cached
+        num_tokens = profile.tokens_per_message
+        for key_name, value in message.items():
+            # Cast str(value) in case the message value is not a string
+            # This occurs with function messages
+            num_tokens += len(encoding.encode(str(value)))
+            if key_name == "name":
+                num_tokens += profile.tokens_per_name
+        with self._lock:
+            self.misses += 1
+            self._counts[key] = num_tokens
+            while len(self._counts) > self.maxsize:
+                self._counts.popitem(last=False)
+        return num_tokens
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {"size": len(self._counts), "hits": self.hits, "misses": self.misses}
+
+
+message_token_cache = MessageTokenCache()
+
+
+def count_message_tokens(model: str, messages: Iterable[Dict[str, Any]]) -> int:
+    """Prompt tokens of OpenAI-format message dicts for `model`."""
+    profile = tokenizer_profile(model)
+    encoding_name, encoding = profile_encoding(model, profile)
+    num_tokens = sum(
+        message_token_cache.count(m, profile, encoding_name, encoding) for m in messages
+    )
+    # every reply is primed with <im_start>assistant
+    return num_tokens + profile.tokens_per_reply
@@ -0,0 +1,205 @@
+"""Process-wide pooled HTTP clients shared by the OpenAI client wrappers."""
+
+from __future__ import annotations
+
+import asyncio
+import importlib.util
+import os
+import threading
+import weakref
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+import httpx
+
+# 连接池配置，可通过环境变量覆盖
+HTTP_MAX_CONNECTIONS = int(os.getenv("HTTP_MAX_CONNECTIONS", "20"))
+HTTP_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("HTTP_MAX_KEEPALIVE_CONNECTIONS", "10"))
+HTTP_KEEPALIVE_EXPIRY = float(os.getenv("HTTP_KEEPALIVE_EXPIRY", "60"))
+# HTTP/2 需要安装 h2 (`pip install httpx[http2]`)，未安装时使用 HTTP/1.1
+HTTP2 = os.getenv("HTTP2", "1") != "0" and importlib.util.find_spec("h2") is not None
+
+_lock = threading.Lock()
+_sync_clients: Dict[Optional[str], httpx.Client] = {}
+_async_clients: Dict[Optional[str], "LoopLocalAsyncClient"] = {}
+_requests: Dict[str, int] = {"sync": 0, "async": 0}
+
+
+def _limits() -> httpx.Limits:
+    return httpx.Limits(
+        max_connections=HTTP_MAX_CONNECTIONS,
+        max_keepalive_connections=HTTP_MAX_KEEPALIVE_CONNECTIONS,
+        keepalive_expiry=HTTP_KEEPALIVE_EXPIRY,
+    )
+
+
+def _count(kind: str):
+    def hook(request: httpx.Request) -> None:
+        with _lock:
+            _requests[kind] += 1
+
+    return hook
+
+
+def _count_async(kind: str):
+    sync_hook = _count(kind)
+
+    async def hook(request: httpx.Request) -> None:
+        sync_hook(request)
+
+    return hook
+
+
+class LoopLocalTransport(httpx.AsyncBaseTransport):
+    """Async transport with one connection pool per running event loop.
+
+    Pooled connections belong to the loop that opened them, so a second
+    `asyncio.run()` or a thread with its own loop gets a pool of its own
+    instead of reusing dead connections. Pools of closed loops are dropped.
+    """
+
+    def __init__(self, factory: Callable[[], httpx.AsyncBaseTransport]):
+        self._factory = factory
+        self._pools: Dict[int, Tuple[weakref.ref, httpx.AsyncBaseTransport]] = {}
+        self._lock = threading.Lock()
+
+    def _prune(self) -> None:
+        for key, (ref, _) in list(self._pools.items()):
+            loop = ref()
+            if loop is None or loop.is_closed():
+                del self._pools[key]
+
+    def _current(self) -> httpx.AsyncBaseTransport:
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            self._prune()
+            entry = self._pools.get(id(loop))
+            if entry is None or entry[0]() is not loop:
+                entry = (weakref.ref(loop), self._factory())
+                self._pools[id(loop)] = entry
+            return entry[1]
+
+    def pools(self) -> List[httpx.AsyncBaseTransport]:
+        with self._lock:
+            self._prune()
+            return [transport for _, transport in self._pools.values()]
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        return await self._current().handle_async_request(request)
+
+    async def aclose(self) -> None:
+        # 其他事件循环的连接只能在各自的循环中关闭，这里只关闭当前循环的连接池
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            entry = self._pools.pop(id(loop), None)
+        if entry is not None:
+            await entry[1].aclose()
+
+
+class LoopLocalAsyncClient(httpx.AsyncClient):
+    """`httpx.AsyncClient` whose transports, proxy mounts included, are loop-local.
+
+    httpx builds every transport through `_init_transport` and
+    `_init_proxy_transport`; each is wrapped in a `LoopLocalTransport`.
+    """
+
+    def _init_transport(self, *args, transport=None, **kwargs):
+        if transport is not None:
+            return transport
+        parent = super()._init_transport
+        return LoopLocalTransport(lambda: parent(*args, **kwargs))
+
+    def _init_proxy_transport(self, *args, **kwargs):
+        parent = super()._init_proxy_transport
+        return LoopLocalTransport(lambda: parent(*args, **kwargs))
+
+
+def shared_http_client(proxy: Optional[str] = None) -> httpx.Client:
+    """The pooled sync client for `proxy` (None for a direct connection).
+
+    Every ChatOpenAI, OpenAI and OpenAIEmbeddings instance in the process
+    uses the same client, so connections and TLS sessions are reused across
+    instances instead of each instance opening its own.
+    """
+    proxy = proxy or None
+    with _lock:
+        client = _sync_clients.get(proxy)
+        if client is None or client.is_closed:
+            client = httpx.Client(
+                proxy=proxy,
+                http2=HTTP2,
+                limits=_limits(),
+                event_hooks={"request": [_count("sync")]},
+            )
+            _sync_clients[proxy] = client
+        return client
+
+
+def shared_async_http_client(proxy: Optional[str] = None) -> LoopLocalAsyncClient:
+    """Async counterpart of `shared_http_client`.
+
+    The client is created outside any event loop and kept by the model
+    instances, so it keeps a separate connection pool for each loop it is
+    used from (see `LoopLocalTransport`).
+    """
+    proxy = proxy or None
+    with _lock:
+        client = _async_clients.get(proxy)
+        if client is None or client.is_closed:
+            client = LoopLocalAsyncClient(
+                proxy=proxy,
+                http2=HTTP2,
+                limits=_limits(),
+                event_hooks={"request": [_count_async("async")]},
+            )
+            _async_clients[proxy] = client
+        return client
+
+
+def _transports(client: Any) -> Iterator[Any]:
+    # 设置代理（参数或环境变量）时请求经由 _mounts 中的代理传输层发出
+    for transport in [client._transport, *client._mounts.values()]:
+        if isinstance(transport, LoopLocalTransport):
+            yield from transport.pools()
+        elif transport is not None:
+            yield transport
+
+
+def _pool_usage(client: Any) -> Dict[str, int]:
+    connections = [
+        connection
+        for transport in _transports(client)
+        for connection in getattr(getattr(transport, "_pool", None), "connections", [])
+    ]
+    idle = sum(1 for c in connections if c.is_idle())
+    return {"connections": len(connections), "idle": idle, "active": len(connections) - idle}
+
+
+def http_pool_stats() -> Dict[str, Any]:
+    """Requests sent and connection usage of every shared client."""
+    with _lock:
+        stats: Dict[str, Any] = {
+            "http2": HTTP2,
+            "max_connections": HTTP_MAX_CONNECTIONS,
+            "requests": dict(_requests),
+            "clients": {},
+        }
+        for kind, clients in (("sync", _sync_clients), ("async", _async_clients)):
+            for proxy, client in clients.items():
+                stats["clients"][f"{kind}:{proxy or 'direct'}"] = _pool_usage(client)
+    return stats
+
+
+def close_http_clients() -> None:
+    with _lock:
+        clients = list(_sync_clients.values())
+        _sync_clients.clear()
+    for client in clients:
+        client.close()
+
+
+async def aclose_http_clients() -> None:
+    with _lock:
+        clients = list(_async_clients.values())
+        _async_clients.clear()
+    for client in clients:
+        await client.aclose()
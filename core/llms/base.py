@@ -20,7 +20,6 @@ from typing import (
 )
 
 import openai
-import tiktoken
 from langchain_core.callbacks import (
     AsyncCallbackManagerForLLMRun,
     CallbackManagerForLLMRun,
@@ -35,6 +34,9 @@ from langchain_core.utils import (
 )
 from langchain_core.utils.utils import build_extra_kwargs
 
+from core.encodings import encoding_for_model
+from core.http_clients import shared_async_http_client, shared_http_client
+
 logger = logging.getLogger(__name__)
 
 
@@ -198,11 +200,15 @@ class BaseOpenAI(BaseLLM):
             "default_query": values["default_query"],
         }
         if not values.get("client"):
+            if not values["http_client"]:
+                values["http_client"] = shared_http_client(values["pro"])
             sync_specific = {"http_client": values["http_client"]}
             values["client"] = openai.OpenAI(
                 **client_params, **sync_specific
             ).completions
         if not values.get("async_client"):
+            if not values["http_async_client"]:
+                values["http_async_client"] = shared_async_http_client(values["pro"])
             async_specific = {"http_client": values["http_async_client"]}
             values["async_client"] = openai.AsyncOpenAI(
                 **client_params, **async_specific
@@ -510,10 +516,7 @@ class BaseOpenAI(BaseLLM):
             return super().get_num_tokens(text)
 
         mod = self.tiktoken_mod or self.mod
-        try:
-            enc = tiktoken.encoding_for_model(mod)
-        except KeyError:
-            enc = tiktoken.get_encoding("cl100k_base")
+        _, enc = encoding_for_model(mod)
 
         return enc.encode(
             text,
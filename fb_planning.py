@@ -1,18 +1,78 @@
 from __future__ import annotations
 
-from typing import List, Optional, Sequence, Union
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from contextvars import ContextVar
+from typing import AsyncIterator, Dict, Iterator, List, Optional, Sequence, Tuple, Union
 
+from langchain_core.agents import AgentAction, AgentFinish, AgentStep
+from langchain_core.callbacks import (
+    AsyncCallbackManagerForChainRun,
+    CallbackManagerForChainRun,
+)
 from langchain_core.language_models import BaseLanguageModel
-from langchain_core.prompts import BasePromptTemplate
-from langchain_core.runnables import Runnable, RunnablePassthrough
+from langchain_core.prompts import BasePromptTemplate, ChatPromptTemplate, MessagesPlaceholder
+from langchain_core.runnables import Runnable, RunnableConfig, RunnableLambda, RunnablePassthrough
 from langchain_core.tools import BaseTool
 
-from langchain.agents import AgentOutputParser
-from langchain.agents.format_scratchpad import format_log_to_str
+from langchain.agents import AgentExecutor, AgentOutputParser
+from langchain.agents.format_scratchpad.tools import format_to_tool_messages
+from langchain.agents.output_parsers.tools import ToolsAgentOutputParser
 # from langchain.agents.output_parsers import ReActSingleInputOutputParser
 from langchain.tools.render import ToolsRenderer, render_text_description
 
-from react_output_parsers import ReActSingleInputOutputParser
+from react_output_parsers import ReActSingleInputOutputParser, action_end, action_names
+from prompt_cache import PromptPrefixCache, prompt_cache, template_text
+from scratchpad import IncrementalScratchpad, compact_observation
+
+MULTI_ACTION_INSTRUCTIONS = """
+
+If several steps are independent of each other (for example they configure different instruments), you may give them in one reply as numbered actions, they will be executed together:
+Action 1: the first action
+Action Input 1: its input
+Action 2: the second action
+Action Input 2: its input"""
+
+
+def stream_until_action(llm: Runnable, connector=None, early_stop: bool = True) -> Runnable:
+    """Stream the completion and stop reading once a single action is complete.
+
+    With `early_stop`, `action_end` is passed to the model as its
+    `stop_condition` (see `core.chat_models.ChatOpenAI`): as soon as the
+    `Action Input:` line of an unnumbered action has ended, the model closes
+    the HTTP response and finishes the stream normally, so the tool can run
+    without waiting for the rest of the generation or the stop sequence.
+    Models that ignore `stop_condition` stream to the end and the text is
+    cut after the action here.
+    If a `connector` (see `speculation.SpeculativeConnector`) is given, each
+    tool name is passed to it as soon as its `Action:` line is complete, so
+    the tool's instruments are connected ahead of time, and the speculations
+    are resolved against the final text.
+    """
+
+    def complete(prompt_value, config: RunnableConfig) -> str:
+        text = ""
+        seen = 0
+        kwargs = {"stop_condition": action_end} if early_stop else {}
+        try:
+            for chunk in llm.stream(prompt_value, config, **kwargs):
+                piece = chunk.content if hasattr(chunk, "content") else str(chunk)
+                text += piece
+                if connector is not None and "\n" in piece:
+                    names = action_names(text)
+                    for name in names[seen:]:
+                        connector.start(name)
+                    seen = len(names)
+            end = action_end(text) if early_stop else None
+            if end is not None:
+                text = text[:end]
+        finally:
+            if connector is not None:
+                connector.resolve(action_names(text + "\n"))
+        return text
+
+    return RunnableLambda(complete, name="stream_until_action")
+
 
 def create_react_agent(
     llm: BaseLanguageModel,
@@ -22,6 +82,10 @@ def create_react_agent(
     tools_renderer: ToolsRenderer = render_text_description,
     *,
     stop_sequence: Union[bool, List[str]] = True,
+    multi_action: bool = False,
+    prefix_cache: Optional[PromptPrefixCache] = prompt_cache,
+    early_stop: bool = True,
+    connector=None,
 ) -> Runnable:
     missing_vars = {"tools", "tool_names", "agent_scratchpad"}.difference(
         prompt.input_variables + list(prompt.partial_variables)
@@ -29,23 +93,255 @@ def create_react_agent(
     if missing_vars:
         raise ValueError(f"Prompt missing required variables: {missing_vars}")
 
-    prompt = prompt.partial(
-        tools=tools_renderer(list(tools)),
-        tool_names=", ".join([t.name for t in tools]),
-    )
+    suffix = MULTI_ACTION_INSTRUCTIONS if multi_action else ""
+    if prefix_cache is not None:
+        # 工具描述等静态前缀按工具集缓存，每次调用的前缀逐字节相同
+        cached = prefix_cache.get(tools, tools_renderer, template_text(prompt), suffix)
+        tools_text, tool_names = cached.tools, cached.tool_names
+    else:
+        tools_text = tools_renderer(list(tools)) + suffix
+        tool_names = ", ".join([t.name for t in tools])
+    prompt = prompt.partial(tools=tools_text, tool_names=tool_names)
     if stop_sequence:
         stop = ["\nObservation"] if stop_sequence is True else stop_sequence
         # stop = ["\n    Observation"] if stop_sequence is True else stop_sequence
         llm_with_stop = llm.bind(stop=stop)
     else:
         llm_with_stop = llm
+    if early_stop or connector is not None:
+        llm_with_stop = stream_until_action(llm_with_stop, connector, early_stop)
     output_parser = output_parser or ReActSingleInputOutputParser()
+    scratchpad = IncrementalScratchpad()
     agent = (
         RunnablePassthrough.assign(
-            agent_scratchpad=lambda x: format_log_to_str(x["intermediate_steps"]),
+            agent_scratchpad=lambda x: scratchpad(x["intermediate_steps"]),
         )
         | prompt
         | llm_with_stop
         | output_parser
     )
     return agent
+
+
+TOOL_CALLING_SYSTEM = """你是一名电子测量工程师，通过调用工具来操作示波器、信号发生器和电源，完成用户的测量需求。
+每次只调用完成当前步骤所需的工具，参数必须符合工具的定义；得到所有需要的测量结果后，直接用中文给出最终答案。"""
+
+TOOL_CALLING_PROMPT = ChatPromptTemplate.from_messages(
+    [
+        ("system", TOOL_CALLING_SYSTEM),
+        ("human", "{process}"),
+        MessagesPlaceholder("agent_scratchpad"),
+    ]
+)
+
+
+def create_tool_calling_agent(
+    llm: BaseLanguageModel,
+    tools: Sequence[BaseTool],
+    prompt: BasePromptTemplate = TOOL_CALLING_PROMPT,
+) -> Runnable:
+    """Agent that calls tools through the model's native function calling.
+
+    Tool arguments arrive as structured JSON validated against each tool's
+    schema, so there is no free-text Action/Action Input to parse.
+    """
+    missing_vars = {"agent_scratchpad"}.difference(
+        prompt.input_variables + list(prompt.partial_variables)
+    )
+    if missing_vars:
+        raise ValueError(f"Prompt missing required variables: {missing_vars}")
+    if not hasattr(llm, "bind_tools"):
+        raise ValueError("This function requires a .bind_tools method on the LLM.")
+
+    llm_with_tools = llm.bind_tools(list(tools))
+    agent = (
+        RunnablePassthrough.assign(
+            agent_scratchpad=lambda x: format_to_tool_messages(
+                [(a, compact_observation(o)) for a, o in x["intermediate_steps"]]
+            ),
+        )
+        | prompt
+        | llm_with_tools
+        | ToolsAgentOutputParser()
+    )
+    return agent
+
+
+def tool_instruments(tool: BaseTool) -> Tuple[str, ...]:
+    """Instruments a tool locks, as declared with `tools.uses_instruments`."""
+    return getattr(getattr(tool, "func", None), "instruments", ())
+
+
+def group_by_instrument(
+    actions: Sequence[AgentAction], name_to_tool_map: Dict[str, BaseTool]
+) -> List[List[AgentAction]]:
+    """Split actions into groups that share no instrument.
+
+    Actions touching a common instrument end up in the same group, in their
+    original order; actions that use no instrument are groups of their own.
+    """
+    groups: List[Tuple[set, List[AgentAction]]] = []
+    for action in actions:
+        tool = name_to_tool_map.get(action.tool)
+        names = set(tool_instruments(tool)) if tool is not None else set()
+        merged_names, merged_actions = set(names), []
+        remaining = []
+        for group_names, group_actions in groups:
+            if names & group_names:
+                merged_names |= group_names
+                merged_actions.extend(group_actions)
+            else:
+                remaining.append((group_names, group_actions))
+        # 合并后的组保持动作的原始顺序
+        merged_actions.sort(key=actions.index)
+        groups = remaining + [(merged_names, merged_actions + [action])]
+    return [group_actions for _, group_actions in groups]
+
+
+class _Turn:
+    """Actions of the current LLM turn and the steps already executed for them."""
+
+    def __init__(self) -> None:
+        self.actions: List[AgentAction] = []
+        self.steps: Dict[int, AgentStep] = {}
+        self.task: Optional[asyncio.Future] = None
+
+
+# 每次 _iter_next_step 调用各自的本轮状态；执行器实例可能被多个会话（线程）共用
+_current_turn: ContextVar[Optional[_Turn]] = ContextVar("current_turn", default=None)
+
+
+class ParallelAgentExecutor(AgentExecutor):
+    """AgentExecutor that runs the actions of one LLM turn concurrently.
+
+    When the agent returns several actions at once, they are grouped by the
+    instruments their tools use: groups run in parallel threads, while the
+    actions within a group run one after another in the order given. All
+    observations are returned together as the result of the turn. The async
+    path (`ainvoke`, `astream`) runs the groups concurrently on the event
+    loop with the same ordering within a group.
+    """
+
+    def _iter_next_step(
+        self,
+        name_to_tool_map: Dict[str, BaseTool],
+        color_mapping: Dict[str, str],
+        inputs: Dict[str, str],
+        intermediate_steps: List[Tuple[AgentAction, str]],
+        run_manager: Optional[CallbackManagerForChainRun] = None,
+    ) -> Iterator[Union[AgentFinish, AgentAction, AgentStep]]:
+        # 父类先依次产出本轮全部动作，再逐个执行；执行第一个动作时本轮动作已全部已知
+        turn = _Turn()
+        token = _current_turn.set(turn)
+        try:
+            for item in super()._iter_next_step(
+                name_to_tool_map, color_mapping, inputs, intermediate_steps, run_manager
+            ):
+                if isinstance(item, AgentAction):
+                    turn.actions.append(item)
+                yield item
+        finally:
+            _current_turn.reset(token)
+
+    def _perform_agent_action(
+        self,
+        name_to_tool_map: Dict[str, BaseTool],
+        color_mapping: Dict[str, str],
+        agent_action: AgentAction,
+        run_manager: Optional[CallbackManagerForChainRun] = None,
+    ) -> AgentStep:
+        turn = _current_turn.get()
+        if (
+            turn is None
+            or len(turn.actions) < 2
+            or id(agent_action) not in map(id, turn.actions)
+        ):
+            return super()._perform_agent_action(
+                name_to_tool_map, color_mapping, agent_action, run_manager
+            )
+        if id(agent_action) not in turn.steps:
+            self._run_turn(name_to_tool_map, color_mapping, turn, run_manager)
+        return turn.steps[id(agent_action)]
+
+    def _run_turn(
+        self,
+        name_to_tool_map: Dict[str, BaseTool],
+        color_mapping: Dict[str, str],
+        turn: _Turn,
+        run_manager: Optional[CallbackManagerForChainRun],
+    ) -> None:
+        perform = super()._perform_agent_action
+
+        def run_group(group: List[AgentAction]) -> None:
+            for action in group:
+                turn.steps[id(action)] = perform(
+                    name_to_tool_map, color_mapping, action, run_manager
+                )
+
+        groups = group_by_instrument(turn.actions, name_to_tool_map)
+        with ThreadPoolExecutor(max_workers=len(groups)) as pool:
+            for future in [pool.submit(run_group, group) for group in groups]:
+                future.result()
+
+    async def _aiter_next_step(
+        self,
+        name_to_tool_map: Dict[str, BaseTool],
+        color_mapping: Dict[str, str],
+        inputs: Dict[str, str],
+        intermediate_steps: List[Tuple[AgentAction, str]],
+        run_manager: Optional[AsyncCallbackManagerForChainRun] = None,
+    ) -> AsyncIterator[Union[AgentFinish, AgentAction, AgentStep]]:
+        # 父类用 asyncio.gather 同时执行本轮全部动作，不区分仪器；
+        # 这里让第一个开始执行的动作按仪器分组运行整轮，其余动作等待其结果
+        turn = _Turn()
+        token = _current_turn.set(turn)
+        try:
+            async for item in super()._aiter_next_step(
+                name_to_tool_map, color_mapping, inputs, intermediate_steps, run_manager
+            ):
+                if isinstance(item, AgentAction):
+                    turn.actions.append(item)
+                yield item
+        finally:
+            _current_turn.reset(token)
+
+    async def _aperform_agent_action(
+        self,
+        name_to_tool_map: Dict[str, BaseTool],
+        color_mapping: Dict[str, str],
+        agent_action: AgentAction,
+        run_manager: Optional[AsyncCallbackManagerForChainRun] = None,
+    ) -> AgentStep:
+        turn = _current_turn.get()
+        if (
+            turn is None
+            or len(turn.actions) < 2
+            or id(agent_action) not in map(id, turn.actions)
+        ):
+            return await super()._aperform_agent_action(
+                name_to_tool_map, color_mapping, agent_action, run_manager
+            )
+        if turn.task is None:
+            turn.task = asyncio.ensure_future(
+                self._arun_turn(name_to_tool_map, color_mapping, turn, run_manager)
+            )
+        await turn.task
+        return turn.steps[id(agent_action)]
+
+    async def _arun_turn(
+        self,
+        name_to_tool_map: Dict[str, BaseTool],
+        color_mapping: Dict[str, str],
+        turn: _Turn,
+        run_manager: Optional[AsyncCallbackManagerForChainRun],
+    ) -> None:
+        perform = super()._aperform_agent_action
+
+        async def run_group(group: List[AgentAction]) -> None:
+            for action in group:
+                turn.steps[id(action)] = await perform(
+                    name_to_tool_map, color_mapping, action, run_manager
+                )
+
+        groups = group_by_instrument(turn.actions, name_to_tool_map)
+        await asyncio.gather(*[run_group(group) for group in groups])
@@ -0,0 +1,610 @@
+"""Lazy VISA connections for the bench instruments."""
+
+import asyncio
+import os
+import re
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import ExitStack, contextmanager
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+import pyvisa as visa
+from pyvisa.constants import StatusCode
+from pyvisa.errors import VisaIOError
+
+# 可通过环境变量覆盖默认的仪器地址
+DEFAULT_RESOURCES = {
+    "scope": os.getenv("SCOPE_RESOURCE", "USB0::0x5656::0x0832::AMOL323130008::INSTR"),
+    "awg": os.getenv("AWG_RESOURCE", "USB0::0x6656::0x0834::AWG4422490001::INSTR"),
+    "power": os.getenv("POWER_RESOURCE", "USB0::0x1AB1::0x0E11::DP8C200600640::INSTR"),
+}
+
+DEFAULT_TIMEOUTS = {
+    "scope": 10000,
+}
+
+# 单条 SCPI 消息的最大长度，超过后拆分为多次写入
+MAX_MESSAGE_LENGTH = 256
+DEFAULT_MAX_MESSAGE_LENGTHS: Dict[str, int] = {}
+
+# 等待仪器完成操作的方式："opc" 使用 *OPC? 阻塞查询，"esr" 发送 *OPC 后轮询 *ESR?
+DEFAULT_WAIT_MODES: Dict[str, str] = {}
+SETTLE_TIMEOUT = 10.0
+ESR_POLL_INTERVAL = 0.05
+
+# 电源的 :CURR/:VOLT 作用于 :INST 选中的通道，同一路径在不同通道下含义不同，
+# 因此不对电源做影子缓存
+DEFAULT_SHADOWED = {"scope", "awg"}
+
+# 执行后仪器设置会整体改变的命令（短格式）
+INVALIDATING_COMMANDS = {"*RST", ":RST", ":KEY:AUTO", ":AUT", ":AUTOSCALE"}
+
+# 不改变被测信号的命令，不会使已缓存的测量结果失效：
+# 自动设置只调整显示档位，:WAVeform 只影响波形传输格式，运行/停止只控制采集
+NON_STATE_COMMANDS = (":KEY:AUTO", ":WAV", ":RUN", ":STOP", ":SING", "*CLS", "*OPC")
+# 同理，时基的档位/位移只改变显示方式（短格式）；通道的垂直档位/位移会改变削波和
+# 幅度测量的分辨率，仍然算作状态改变
+_DISPLAY_SETTINGS = re.compile(r":TIM(:MAIN)?:(SCAL|OFFS)$")
+
+# 这些错误说明会话已失效，重新打开后可以重试一次
+_STALE_SESSION_ERRORS = {
+    StatusCode.error_connection_lost,
+    StatusCode.error_invalid_object,
+    StatusCode.error_closing_failed,
+}
+
+
+def pack_commands(commands: List[str], max_length: int) -> List[str]:
+    """Join SCPI commands with `;:` into as few messages as `max_length` allows.
+
+    Every command is re-rooted with a leading colon so that it does not depend
+    on the header path of the previous one. A command longer than `max_length`
+    is sent on its own.
+    """
+    messages: List[str] = []
+    current = ""
+    for command in commands:
+        command = command.strip()
+        part = command if command.startswith("*") else ":" + command.lstrip(":")
+        candidate = f"{current};{part}" if current else part
+        if current and len(candidate) > max_length:
+            messages.append(current)
+            current = part
+        else:
+            current = candidate
+    if current:
+        messages.append(current)
+    return messages
+
+
+_NODE = re.compile(r"([A-Za-z]*)(\d*)")
+
+
+def scpi_key(header: str) -> str:
+    """Normalise a SCPI header to its upper-case short form.
+
+    `:CHANnel1:BASE:FREQuency` and `:chan1:base:freq` both become
+    `:CHAN1:BASE:FREQ`, so long and short spellings share one shadow entry.
+    """
+    header = header.strip()
+    if header.startswith("*"):
+        return header.upper()
+    nodes = []
+    for node in header.lstrip(":").split(":"):
+        letters, digits = _NODE.match(node).groups()
+        short = re.match(r"[A-Z]*", letters).group()
+        rest = node[len(letters) + len(digits) :]
+        nodes.append((short or letters.upper()) + digits + rest)
+    return ":" + ":".join(nodes)
+
+
+def split_command(command: str) -> Tuple[str, str]:
+    header, _, argument = command.strip().partition(" ")
+    return scpi_key(header), argument.strip()
+
+
+def _normalize_value(value: str) -> str:
+    value = value.strip().strip('"').upper()
+    try:
+        return repr(float(value))
+    except ValueError:
+        return value
+
+
+def changes_state(command: str) -> bool:
+    """Whether sending `command` may change what the instruments measure."""
+    if "?" in command:
+        return False
+    key, _ = split_command(command)
+    return not (key.startswith(NON_STATE_COMMANDS) or _DISPLAY_SETTINGS.match(key))
+
+
+class CompletionTimeout(Exception):
+    """An instrument did not report that its pending operations completed."""
+
+
+class ShadowState:
+    """Last-known value of each setting, keyed by short-form SCPI path."""
+
+    def __init__(self):
+        self.values: Dict[str, str] = {}
+        self.sent = 0
+        self.skipped = 0
+
+    @staticmethod
+    def _setting(command: str) -> Optional[Tuple[str, str]]:
+        if "?" in command:
+            return None
+        key, argument = split_command(command)
+        if key.startswith("*") or not argument:
+            return None
+        return key, _normalize_value(argument)
+
+    def is_redundant(self, command: str) -> bool:
+        setting = self._setting(command)
+        if setting is None or self.values.get(setting[0]) != setting[1]:
+            return False
+        self.skipped += 1
+        return True
+
+    def record(self, command: str) -> None:
+        self.sent += 1
+        key, _ = split_command(command)
+        if key in INVALIDATING_COMMANDS:
+            self.invalidate()
+            return
+        setting = self._setting(command)
+        if setting is not None:
+            self.values[setting[0]] = setting[1]
+
+    def get(self, header: str) -> Optional[str]:
+        return self.values.get(scpi_key(header))
+
+    def forget(self, command: str) -> None:
+        self.values.pop(split_command(command)[0], None)
+
+    def invalidate(self) -> None:
+        self.values.clear()
+
+
+class FairLock:
+    """Reentrant FIFO lock that also records queue depth and wait times.
+
+    Callers are served strictly in arrival order, so one agent session that
+    keeps issuing commands cannot starve the others sharing the instrument.
+    """
+
+    def __init__(self):
+        self._cond = threading.Condition(threading.Lock())
+        self._next_ticket = 0
+        self._serving = 0
+        self._owner: Optional[int] = None
+        self._count = 0
+        self.max_depth = 0
+        self.acquisitions = 0
+        self.total_wait = 0.0
+
+    @property
+    def depth(self) -> int:
+        """Number of callers holding or waiting for the lock."""
+        return self._next_ticket - self._serving
+
+    def acquire(self) -> None:
+        me = threading.get_ident()
+        with self._cond:
+            if self._owner == me:
+                self._count += 1
+                return
+            ticket = self._next_ticket
+            self._next_ticket += 1
+            self.max_depth = max(self.max_depth, self.depth)
+            start = time.monotonic()
+            while ticket != self._serving:
+                self._cond.wait()
+            self._owner = me
+            self._count = 1
+            self.acquisitions += 1
+            self.total_wait += time.monotonic() - start
+
+    def release(self) -> None:
+        with self._cond:
+            if self._owner != threading.get_ident():
+                raise RuntimeError("Cannot release a lock held by another thread")
+            self._count -= 1
+            if self._count:
+                return
+            self._owner = None
+            self._serving += 1
+            self._cond.notify_all()
+
+    def __enter__(self) -> "FairLock":
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.release()
+
+    def stats(self) -> Dict[str, float]:
+        with self._cond:
+            return {
+                "depth": self.depth,
+                "max_depth": self.max_depth,
+                "acquisitions": self.acquisitions,
+                "mean_wait": self.total_wait / self.acquisitions
+                if self.acquisitions
+                else 0.0,
+            }
+
+
+class InstrumentSession:
+    """Stands in for a pyvisa resource and opens it on first use."""
+
+    def __init__(
+        self,
+        registry: "InstrumentRegistry",
+        name: str,
+        timeout: Optional[int] = None,
+        max_message_length: int = MAX_MESSAGE_LENGTH,
+        shadowed: bool = False,
+        wait_mode: str = "opc",
+    ):
+        self.registry = registry
+        self.name = name
+        self.max_message_length = max_message_length
+        self.shadow = ShadowState() if shadowed else None
+        self.wait_mode = wait_mode
+        self._timeout = timeout
+        self._resource = None
+        self._lock = threading.RLock()
+        self._local = threading.local()
+        # 所有会话共用同一台仪器时，命令在这里排队
+        self.queue = FairLock()
+        self._worker: Optional[ThreadPoolExecutor] = None
+
+    @property
+    def connected(self) -> bool:
+        return self._resource is not None
+
+    @property
+    def resource(self):
+        if self._resource is None:
+            self.connect()
+        return self._resource
+
+    def connect(self):
+        with self._lock:
+            if self._resource is None:
+                self._resource = self.registry.open_resource(
+                    self.name, timeout=self._timeout
+                )
+            return self._resource
+
+    def close(self) -> None:
+        with self._lock:
+            resource, self._resource = self._resource, None
+        if self.shadow is not None:
+            # 重新连接后无法确认仪器状态是否被改动过
+            self.shadow.invalidate()
+        if resource is not None:
+            self.registry.bump_generation()
+            try:
+                resource.close()
+            except VisaIOError:
+                pass
+
+    def reconnect(self):
+        self.close()
+        return self.connect()
+
+    def exclusive(self) -> FairLock:
+        """Hold the instrument for a multi-command sequence.
+
+        Individual writes and queries are already serialised; use this when a
+        sequence such as autoscale-then-measure must not be interleaved with
+        another session's commands.
+        """
+        return self.queue
+
+    @property
+    def worker(self) -> ThreadPoolExecutor:
+        """Single-thread executor whose work queue orders this instrument's I/O."""
+        with self._lock:
+            if self._worker is None:
+                self._worker = ThreadPoolExecutor(
+                    max_workers=1, thread_name_prefix=f"visa-{self.name}"
+                )
+            return self._worker
+
+    def submit(self, fn: Callable[..., Any], *args: Any, **kwargs: Any) -> Future:
+        return self.worker.submit(fn, *args, **kwargs)
+
+    async def run(self, fn: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+        """Run blocking `fn` on this instrument's worker without blocking the loop."""
+        return await asyncio.wrap_future(self.submit(fn, *args, **kwargs))
+
+    def shutdown(self) -> None:
+        with self._lock:
+            worker, self._worker = self._worker, None
+        if worker is not None:
+            worker.shutdown(wait=True)
+        self.close()
+
+    @property
+    def timeout(self) -> Optional[int]:
+        if self._resource is not None:
+            return self._resource.timeout
+        return self._timeout
+
+    @timeout.setter
+    def timeout(self, value: Optional[int]) -> None:
+        self._timeout = value
+        if self._resource is not None:
+            self._resource.timeout = value
+
+    def _call(self, method: str, *args):
+        with self.queue:
+            return self._call_unlocked(method, *args)
+
+    def _call_unlocked(self, method: str, *args):
+        try:
+            return getattr(self.resource, method)(*args)
+        except VisaIOError as e:
+            if e.error_code not in _STALE_SESSION_ERRORS:
+                raise
+        return getattr(self.reconnect(), method)(*args)
+
+    def write(self, command: str):
+        with self.queue:
+            return self._write(command)
+
+    def _write(self, command: str):
+        if self.shadow is not None and self.shadow.is_redundant(command):
+            return None
+        pending = getattr(self._local, "batch", None)
+        if pending is not None:
+            if "?" not in command:
+                pending.append(command)
+                return None
+            self._flush_pending()
+        return self._send([command], [command])
+
+    def _send(self, commands: List[str], messages: List[str], sync: bool = False):
+        """Write `messages` (the packed form of `commands`) and update the shadow."""
+        if sync:
+            *messages, last = messages
+        try:
+            for message in messages:
+                self._call("write", message)
+            result = self._call("query", last) if sync else None
+        except Exception:
+            if self.shadow is not None:
+                for command in commands:
+                    self.shadow.forget(command)
+            self.registry.bump_generation()
+            raise
+        if self.shadow is not None:
+            for command in commands:
+                self.shadow.record(command)
+        if any(changes_state(command) for command in commands):
+            self.registry.bump_generation()
+        return result
+
+    def resync(self, keys: Optional[Iterable[str]] = None) -> None:
+        """Refresh the shadow state from the instrument.
+
+        Without `keys` the whole shadow is dropped and every setting is sent
+        again on its next write; with `keys` each path is queried back.
+        """
+        if self.shadow is None:
+            return
+        # 重新同步说明仪器可能被外部改动过
+        self.registry.bump_generation()
+        if keys is None:
+            self.shadow.invalidate()
+            return
+        for key in keys:
+            key = scpi_key(key)
+            self.shadow.values[key] = _normalize_value(self.query(f"{key}?"))
+
+    @contextmanager
+    def batch(self, sync: bool = True) -> Iterator["InstrumentSession"]:
+        """Queue writes made inside the block and send them packed on exit.
+
+        The queued commands are joined with `;:` into as few messages as
+        `max_message_length` permits. With `sync`, the last message carries a
+        trailing `*OPC?` so the block only returns once the instrument has
+        applied every setting. Nothing is sent if the block raises, and no
+        sync is needed when the shadow state filtered out every write.
+        """
+        if getattr(self._local, "batch", None) is not None:
+            # 嵌套的 batch 合并到最外层
+            yield self
+            return
+        with self.queue:
+            self._local.batch = []
+            try:
+                yield self
+                pending = self._local.batch
+            finally:
+                self._local.batch = None
+            if pending:
+                self._flush(pending, sync=sync)
+
+    def _flush_pending(self) -> None:
+        # 查询需要立即读回结果，先把已排队的命令发出去
+        pending = getattr(self._local, "batch", None)
+        if pending:
+            self._flush(pending, sync=False)
+            pending.clear()
+
+    def _flush(self, commands: List[str], sync: bool) -> None:
+        messages = pack_commands(
+            commands + ["*OPC?"] if sync else commands, self.max_message_length
+        )
+        self._send(commands, messages, sync=sync)
+
+    def wait_complete(self, timeout: float = SETTLE_TIMEOUT, strict: bool = False) -> bool:
+        """Block until all pending operations have finished, or `timeout` s.
+
+        Returns False if the instrument did not report completion in time,
+        or raises `CompletionTimeout` with `strict`. After a timeout the late
+        completion reply is discarded, so it cannot be read as the reply to
+        the next query.
+        """
+        with self.queue:
+            if self._wait_complete(timeout):
+                return True
+        if strict:
+            raise CompletionTimeout(f"仪器 {self.name} 未在 {timeout:g} s 内完成操作")
+        return False
+
+    def _wait_complete(self, timeout: float) -> bool:
+        self._flush_pending()
+        if self.wait_mode == "esr":
+            return self._wait_esr(timeout)
+        resource = self.resource
+        previous = resource.timeout
+        resource.timeout = int(timeout * 1000)
+        try:
+            self._call("query", "*OPC?")
+            return True
+        except VisaIOError as e:
+            if e.error_code != StatusCode.error_timeout:
+                raise
+            # 设备清除丢弃之后才到达的 *OPC? 回复
+            resource.clear()
+            return False
+        finally:
+            resource.timeout = previous
+
+    def _wait_esr(self, timeout: float) -> bool:
+        # *OPC 在所有操作完成后置位 ESR 的 bit0（Operation Complete）
+        deadline = time.monotonic() + timeout
+        self._call("write", "*OPC")
+        while True:
+            if int(float(self._call("query", "*ESR?"))) & 1:
+                return True
+            if time.monotonic() >= deadline:
+                # 取消仍在等待的 *OPC，避免其稍后置位的 bit0 被下一次等待误读
+                self._call("write", "*CLS")
+                return False
+            time.sleep(ESR_POLL_INTERVAL)
+
+    def read(self) -> str:
+        return self._call("read")
+
+    def read_raw(self) -> bytes:
+        return self._call("read_raw")
+
+    def query(self, command: str) -> str:
+        """Write `command` and read its reply as one atomic operation."""
+        with self.queue:
+            self._flush_pending()
+            return self._call("query", command)
+
+
+class InstrumentRegistry:
+    """Resolves bench instruments by role ("scope", "awg", "power") on demand.
+
+    Creating the registry and its sessions performs no I/O; the VISA resource
+    manager and each instrument are only opened by the first command sent.
+    """
+
+    def __init__(
+        self,
+        resources: Optional[Dict[str, str]] = None,
+        timeouts: Optional[Dict[str, int]] = None,
+        max_message_lengths: Optional[Dict[str, int]] = None,
+        shadowed: Optional[Iterable[str]] = None,
+        wait_modes: Optional[Dict[str, str]] = None,
+        backend: str = "",
+    ):
+        self.resources = dict(DEFAULT_RESOURCES if resources is None else resources)
+        self.timeouts = dict(DEFAULT_TIMEOUTS if timeouts is None else timeouts)
+        self.max_message_lengths = dict(
+            DEFAULT_MAX_MESSAGE_LENGTHS
+            if max_message_lengths is None
+            else max_message_lengths
+        )
+        self.shadowed = set(DEFAULT_SHADOWED if shadowed is None else shadowed)
+        self.wait_modes = dict(DEFAULT_WAIT_MODES if wait_modes is None else wait_modes)
+        self.backend = backend
+        self._rm = None
+        self._sessions: Dict[str, InstrumentSession] = {}
+        self._lock = threading.Lock()
+        # 台架状态代数：任何可能改变被测信号的写入都会使其加一
+        self.generation = 0
+
+    @property
+    def resource_manager(self):
+        with self._lock:
+            if self._rm is None:
+                print("正在连接仪器.......")
+                self._rm = visa.ResourceManager(self.backend)
+            return self._rm
+
+    def bump_generation(self) -> int:
+        with self._lock:
+            self.generation += 1
+            return self.generation
+
+    def list_resources(self):
+        return self.resource_manager.list_resources()
+
+    def session(self, name: str) -> InstrumentSession:
+        if name not in self.resources:
+            raise KeyError(f"Unknown instrument: {name}")
+        with self._lock:
+            if name not in self._sessions:
+                self._sessions[name] = InstrumentSession(
+                    self,
+                    name,
+                    timeout=self.timeouts.get(name),
+                    max_message_length=self.max_message_lengths.get(
+                        name, MAX_MESSAGE_LENGTH
+                    ),
+                    shadowed=name in self.shadowed,
+                    wait_mode=self.wait_modes.get(name, "opc"),
+                )
+            return self._sessions[name]
+
+    def open_resource(self, name: str, timeout: Optional[int] = None):
+        resource = self.resource_manager.open_resource(self.resources[name])
+        if timeout is not None:
+            resource.timeout = timeout
+        try:
+            response = resource.query("*IDN?")
+            print("已连接到仪器：" + response)
+        except VisaIOError as e:
+            print(f"仪器 {name} 未响应 *IDN?: {e}")
+        return resource
+
+    @contextmanager
+    def exclusive(self, *names: str) -> Iterator[None]:
+        """Hold several instruments at once, always locking in registry order."""
+        order = list(self.resources)
+        sessions = [self.session(n) for n in sorted(set(names), key=order.index)]
+        with ExitStack() as stack:
+            for session in sessions:
+                stack.enter_context(session.exclusive())
+            yield
+
+    def queue_stats(self) -> Dict[str, Dict[str, float]]:
+        return {name: s.queue.stats() for name, s in self._sessions.items()}
+
+    def reconnect(self, name: Optional[str] = None) -> None:
+        names = [name] if name else list(self._sessions)
+        for n in names:
+            self.session(n).reconnect()
+
+    def close(self) -> None:
+        for session in list(self._sessions.values()):
+            session.shutdown()
+        with self._lock:
+            rm, self._rm = self._rm, None
+        if rm is not None:
+            rm.close()
+
+
+registry = InstrumentRegistry()
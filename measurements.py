@@ -0,0 +1,126 @@
+"""Oscilloscope `:MEASure` queries with a result cache."""
+
+import threading
+import time
+from typing import Dict, List, NamedTuple, Optional, Sequence, Tuple
+
+from instruments import InstrumentRegistry, pack_commands, scpi_key
+
+# 状态未变时测量结果的有效期（秒），超时后重新测量以反映被测信号的漂移
+MEASUREMENT_TTL = 10.0
+
+# 上升/下降时间的结果取决于当时的时基分辨率，不同档位下测得的值不能互相替代，不缓存
+UNCACHED_ITEMS = frozenset({":RIS", ":FALL"})
+
+
+def parse_measurement(result: str) -> Optional[float]:
+    """Convert a measurement reply to float, or None if it is empty/invalid."""
+    if not result:
+        return None
+    try:
+        return float(result)
+    except ValueError:
+        return None
+
+
+class _Entry(NamedTuple):
+    value: float
+    generation: int
+    timestamp: float
+
+
+class MeasurementCache:
+    """Results of `:MEASure:<item>? <source>`, valid while the bench is unchanged.
+
+    Each entry remembers the registry's state generation at the time it was
+    measured. Any configuration write that reaches an instrument bumps the
+    generation and so invalidates every entry, while writes skipped by the
+    shadow state do not. Items in `UNCACHED_ITEMS` are always measured.
+    """
+
+    def __init__(self, registry: InstrumentRegistry, ttl: float = MEASUREMENT_TTL):
+        self.registry = registry
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries: Dict[Tuple[str, str], _Entry] = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(item: str, source: str) -> Tuple[str, str]:
+        return scpi_key(item), source.strip().upper()
+
+    def get(
+        self, item: str, source: str, ttl: Optional[float] = None
+    ) -> Optional[float]:
+        ttl = self.ttl if ttl is None else ttl
+        key = self._key(item, source)
+        if key[0] in UNCACHED_ITEMS:
+            return None
+        with self._lock:
+            entry = self._entries.get(key)
+            if (
+                entry is None
+                or entry.generation != self.registry.generation
+                or time.monotonic() - entry.timestamp > ttl
+            ):
+                self.misses += 1
+                return None
+            self.hits += 1
+            return entry.value
+
+    def put(self, item: str, source: str, value: float) -> None:
+        key = self._key(item, source)
+        if key[0] in UNCACHED_ITEMS:
+            return
+        with self._lock:
+            self._entries[key] = _Entry(
+                value, self.registry.generation, time.monotonic()
+            )
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+
+def measure_many(
+    inst, source: str, items: Sequence[str], cache: Optional[MeasurementCache] = None
+) -> Dict[str, Optional[float]]:
+    """Measure several items of one source with chained queries.
+
+    The `:MEASure:<item>? <source>` queries are joined with `;:` into as few
+    messages as the instrument accepts, and the semicolon-separated reply is
+    split back per item. Items still valid in `cache` are not queried at all;
+    fresh results are stored in it.
+    """
+    results: Dict[str, Optional[float]] = {}
+    pending: List[str] = []
+    for item in items:
+        cached = cache.get(item, source) if cache is not None else None
+        if cached is None:
+            pending.append(item)
+        results[item] = cached
+    if not pending:
+        return results
+
+    queries = [f":MEASure:{item}? {source}" for item in pending]
+    replies: List[str] = []
+    for message in pack_commands(queries, inst.max_message_length):
+        replies.extend(inst.query(message).strip().split(";"))
+    if len(replies) != len(pending):
+        # 仪器不支持串联查询时逐项查询
+        replies = [inst.query(query) for query in queries]
+
+    for item, reply in zip(pending, replies):
+        value = parse_measurement(reply.strip())
+        results[item] = value
+        if cache is not None and value is not None:
+            cache.put(item, source, value)
+    return results
+
+
+def measure(
+    inst, item: str, source: str, cache: Optional[MeasurementCache] = None
+) -> Optional[float]:
+    """Single-item form of `measure_many`."""
+    return measure_many(inst, source, [item], cache)[item]
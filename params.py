@@ -0,0 +1,176 @@
+"""Parsing of the `key=value, ...` action inputs the agent passes to tools."""
+
+import copy
+import functools
+import inspect
+import json
+import re
+import typing
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from instruments import scpi_key
+
+# key=value 对，值可以用单引号或双引号括起来，引号内允许出现逗号
+_PARAM_PATTERN = re.compile(
+    r"""\s*([A-Za-z_]\w*)\s*=\s*("(?:[^"\\]|\\.)*"|'(?:[^'\\]|\\.)*'|[^,]*?)\s*(?:,|$)"""
+)
+
+_TRUE_WORDS = frozenset({"true", "on", "yes", "1", "1.0", "是"})
+_FALSE_WORDS = frozenset({"false", "off", "no", "0", "0.0", "否", "none", ""})
+# 可选参数取这些值时表示“不指定”，传入 None
+_NONE_WORDS = frozenset({"none", "null", ""})
+
+
+class ArgumentError(ValueError):
+    """An action input the tool cannot accept; the message is shown to the agent."""
+
+
+def tokenize(param_string: Optional[str]) -> Dict[str, str]:
+    """Split an action input into raw string values, with quotes removed.
+
+    A JSON object is accepted as well, since some models answer that way.
+    """
+    if not param_string:
+        return {}
+    text = param_string.strip()
+    if text.startswith("{"):
+        try:
+            return {str(k): v for k, v in json.loads(text).items()}
+        except (ValueError, AttributeError):
+            pass
+    params = {}
+    for match in _PARAM_PATTERN.finditer(text):
+        key, value = match.groups()
+        if value[:1] in ("'", '"') and value[-1:] == value[:1] and len(value) >= 2:
+            value = value[1:-1]
+        if value.strip():  # 忽略空值
+            params[key] = value
+    return params
+
+
+def _to_float_or_str(value):
+    if not isinstance(value, str):
+        return value
+    try:
+        return float(value)
+    except ValueError:
+        return value
+
+
+def _to_bool(value) -> bool:
+    if isinstance(value, str):
+        word = value.strip().lower()
+        if word in _TRUE_WORDS:
+            return True
+        if word in _FALSE_WORDS:
+            return False
+        raise ArgumentError(f"参数值 {value!r} 不是布尔值，可用 true/false")
+    return bool(value)
+
+
+def _to_int(value) -> int:
+    return int(float(value))
+
+
+def _literal_converter(choices: Tuple[Any, ...]) -> Callable[[Any], Any]:
+    """Map any case of a choice, or its SCPI short form, to the declared spelling."""
+    lookup = {}
+    for choice in choices:
+        if isinstance(choice, str):
+            lookup.setdefault(choice.lower(), choice)
+            lookup.setdefault(scpi_key(choice).lstrip(":").lower(), choice)
+
+    def convert(value):
+        if isinstance(value, str):
+            return lookup.get(value.strip().lower(), value)
+        return value
+
+    return convert
+
+
+def _optional(convert: Callable[[Any], Any]) -> Callable[[Any], Any]:
+    def optional(value):
+        if value is None or isinstance(value, str) and value.strip().lower() in _NONE_WORDS:
+            return None
+        return convert(value)
+
+    return optional
+
+
+def _converter(annotation, default) -> Callable[[Any], Any]:
+    convert = _required_converter(annotation, default)
+    optional = typing.get_origin(annotation) is typing.Union and type(None) in typing.get_args(
+        annotation
+    )
+    return _optional(convert) if optional or default is None else convert
+
+
+def _required_converter(annotation, default) -> Callable[[Any], Any]:
+    if annotation is inspect.Parameter.empty:
+        if default is None or default is inspect.Parameter.empty:
+            return _to_float_or_str
+        annotation = type(default)
+    origin = typing.get_origin(annotation)
+    if origin is typing.Literal:
+        return _literal_converter(typing.get_args(annotation))
+    if origin is typing.Union:
+        members = [a for a in typing.get_args(annotation) if a is not type(None)]
+        if len(members) != 1:
+            return _to_float_or_str
+        return _required_converter(members[0], inspect.Parameter.empty)
+    if annotation is bool:
+        return _to_bool
+    if annotation is int:
+        return _to_int
+    if annotation is float:
+        return float
+    if annotation is str:
+        return str
+    return _to_float_or_str
+
+
+class ToolArguments:
+    """Argument schema of one tool, compiled once from its signature.
+
+    Values are converted to the annotated type (or the type of the default
+    when there is no annotation); `Literal` choices are matched case
+    insensitively and by SCPI short form, so `sine` becomes `SINe`. Values
+    that cannot be converted are passed through unchanged, except booleans,
+    and `none`/`null` of an optional parameter become None. Unknown keys and
+    invalid booleans raise `ArgumentError`.
+    """
+
+    def __init__(self, func: Callable):
+        signature = inspect.signature(func)
+        self.converters = {
+            name: _converter(p.annotation, p.default)
+            for name, p in signature.parameters.items()
+            if p.kind in (p.POSITIONAL_OR_KEYWORD, p.KEYWORD_ONLY)
+        }
+        self._parse_string = functools.lru_cache(maxsize=128)(self._parse_string)
+
+    def coerce(self, params: Dict[str, Any]) -> Dict[str, Any]:
+        unknown = [key for key in params if key not in self.converters]
+        if unknown:
+            raise ArgumentError(
+                f"未知参数 {', '.join(unknown)}，可用参数: {', '.join(self.converters)}"
+            )
+        result = {}
+        for key, value in params.items():
+            try:
+                result[key] = self.converters[key](value)
+            except ArgumentError:
+                raise
+            except (TypeError, ValueError):
+                result[key] = value
+        return result
+
+    def _parse_string(self, param_string: Optional[str]) -> Tuple[Tuple[str, Any], ...]:
+        return tuple(self.coerce(tokenize(param_string)).items())
+
+    def parse(self, param_string: Optional[str] = None, **kwargs) -> Dict[str, Any]:
+        """Parse an action input string and/or structured keyword arguments."""
+        # JSON 输入中的列表/字典会被缓存共享，复制后再交给工具修改
+        params = dict(copy.deepcopy(self._parse_string(param_string)))
+        params.update(self.coerce(kwargs))
+        return params
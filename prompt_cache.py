@@ -0,0 +1,108 @@
+"""Cache of the static, tool-dependent part of the agent prompt."""
+
+import string
+import threading
+from typing import Callable, Dict, Hashable, Sequence, Tuple
+
+from langchain_core.tools import BaseTool
+
+from core.encodings import profile_encoding, tokenizer_profile
+
+_SENTINEL = "\x00PROMPT_VARIABLE\x00"
+
+
+class PromptPrefix:
+    """Rendered tool block, tool name list and the static prompt prefix.
+
+    The token count of the prefix is computed on first use for each model.
+    """
+
+    def __init__(self, tools: str, tool_names: str, prefix: str = ""):
+        self.tools = tools
+        self.tool_names = tool_names
+        self.prefix = prefix
+        self._tokens: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def num_tokens(self, model: str) -> int:
+        """Tokens of the static prefix with the tokenizer profile of `model`."""
+        with self._lock:
+            tokens = self._tokens.get(model)
+            if tokens is None:
+                _, encoding = profile_encoding(model, tokenizer_profile(model))
+                tokens = self._tokens[model] = len(encoding.encode(self.prefix))
+            return tokens
+
+
+def tool_key(tools: Sequence[BaseTool]) -> Tuple[Hashable, ...]:
+    """Everything about a tool set that ends up in the prompt, as a hashable key.
+
+    The argument schema class stands in for the rendered arguments, so
+    building the key does not serialise any schema.
+    """
+    return tuple((tool.name, tool.description, tool.args_schema) for tool in tools)
+
+
+def template_text(prompt) -> str:
+    """Raw template string of a prompt, or of all messages of a chat prompt."""
+    if hasattr(prompt, "template"):
+        return prompt.template
+    texts = []
+    for message in getattr(prompt, "messages", []):
+        inner = getattr(message, "prompt", None)
+        texts.append(getattr(inner, "template", ""))
+    return "\n".join(texts)
+
+
+def _field_names(template: str):
+    return [name for _, name, _, _ in string.Formatter().parse(template) if name]
+
+
+def static_prefix(template: str, **values: str) -> str:
+    """The template up to its first variable not given in `values`."""
+    fields = {}
+    for name in _field_names(template):
+        fields[name] = values.get(name, _SENTINEL)
+    try:
+        rendered = template.format(**fields)
+    except (KeyError, IndexError, ValueError):
+        return ""
+    return rendered.split(_SENTINEL, 1)[0]
+
+
+class PromptPrefixCache:
+    """Rendered prompt prefixes keyed by tool set, renderer, template and suffix.
+
+    The tool descriptions and the static prefix are rendered once per tool
+    set in this process and shared by every session. Because the static
+    prefix comes first and is rendered byte-for-byte the same every time,
+    servers with prefix caching can reuse it across calls.
+    """
+
+    def __init__(self):
+        self._entries: Dict[tuple, PromptPrefix] = {}
+        self._lock = threading.Lock()
+
+    def get(
+        self,
+        tools: Sequence[BaseTool],
+        renderer: Callable[[list], str],
+        template: str = "",
+        suffix: str = "",
+    ) -> PromptPrefix:
+        key = (tool_key(tools), renderer, template, suffix)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                tools_text = renderer(list(tools)) + suffix
+                tool_names = ", ".join(t.name for t in tools)
+                entry = PromptPrefix(
+                    tools_text,
+                    tool_names,
+                    static_prefix(template, tools=tools_text, tool_names=tool_names),
+                )
+                self._entries[key] = entry
+            return entry
+
+
+prompt_cache = PromptPrefixCache()
@@ -1,5 +1,5 @@
 import re
-from typing import Union
+from typing import List, Optional, Union
 
 from termcolor import colored
 
@@ -24,30 +24,58 @@ USER_MESSAGE = (
 )
 
 
+# 未编号的 Action 在其 Action Input 行结束后即可执行；编号的多动作回复需要等待完整输出
+_COMPLETE_ACTION = re.compile(r"Action\s*:\s*.*?\s*Action\s*Input\s*:[^\n]*\n", re.DOTALL)
+
+
+_ACTION_NAME = re.compile(r"^\s*Action\s*\d*\s*:\s*(\S+?)\s*\n", re.MULTILINE)
+
+
+def action_names(text: str) -> List[str]:
+    """Tool names of the `Action:` lines that are already complete."""
+    return _ACTION_NAME.findall(text)
+
+
+def action_end(text: str) -> Optional[int]:
+    """End of the first finished single action in a partial completion, if any."""
+    match = _COMPLETE_ACTION.search(text)
+    return match.end() if match else None
+
+
 class ReActSingleInputOutputParser(AgentOutputParser):
 
     def get_format_instructions(self) -> str:
         return FORMAT_INSTRUCTIONS
 
-    def parse(self, text: str) -> Union[AgentAction, AgentFinish]:
+    def parse(self, text: str) -> Union[AgentAction, List[AgentAction], AgentFinish]:
         pattern = r'^Final Answer: .*?\.$'
         match = re.search(pattern, text, flags=re.MULTILINE)
         regex = r"Action\s*\d*\s*:\s*(.*?)\s*Action\s*\d*\s*Input\s*\d*\s*:([^$\n]*)"
 
-        action_match = re.search(regex, text, re.DOTALL)
-        if action_match:
+        action_matches = list(re.finditer(regex, text, re.DOTALL))
+        if action_matches:
             new_text = text
             if match:
                 new_text = re.sub(pattern, '', text, flags=re.MULTILINE)
+                action_matches = list(re.finditer(regex, new_text, re.DOTALL))
+
+            # 一次回复中可以有多个编号的 Action，各自的日志只包含自己的那一段
+            actions = []
+            for i, action_match in enumerate(action_matches):
+                start = 0 if i == 0 else action_match.start()
+                end = action_matches[i + 1].start() if i + 1 < len(action_matches) else len(new_text)
+                action = action_match.group(1).strip()
+                action_input = action_match.group(2).strip()
+                action_input = action_input.strip('"')
+                log = new_text if len(action_matches) == 1 else new_text[start:end]
+                actions.append(AgentAction(action, action_input, log))
 
-            action = action_match.group(1).strip()
-            action_input = action_match.group(2).strip()
-            action_input = action_input.strip('"')
-            corrected_input = input(colored(f"\n是否执行:{action}, {action_input}\n", "red")).strip()
+            summary = "\n".join(f"{a.tool}, {a.tool_input}" for a in actions)
+            corrected_input = input(colored(f"\n是否执行:{summary}\n", "red")).strip()
             bool_map = {"是": True, "否": False, '\n': True, 'yes': True, '': True}
             bool_value = bool_map.get(corrected_input, False)
             if bool_value:
-                return AgentAction(action, action_input, new_text)
+                return actions[0] if len(actions) == 1 else actions
             else:
                 user_input = input(colored(f"更改需求为：", "red")).strip()+f'\n'
                 raise OutputParserException(
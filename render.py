@@ -0,0 +1,103 @@
+"""Headless waveform rendering off the agent's critical path."""
+
+import os
+from concurrent.futures import Future, ThreadPoolExecutor
+from datetime import datetime
+from typing import Optional, Sequence, Tuple
+
+import numpy as np
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
+
+PLOT_DIR = "plots"
+FIGURE_SIZE = (8.0, 4.5)
+FIGURE_DPI = 100
+
+
+def decimate_minmax(
+    x: np.ndarray, y: np.ndarray, columns: int
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Reduce a trace to the min and max of each pixel column.
+
+    The result has at most `2 * columns` points but draws the same envelope
+    as the full record, so narrow glitches stay visible.
+    """
+    n = y.size
+    if columns <= 0 or n <= 2 * columns:
+        return np.asarray(x), np.asarray(y)
+    edges = np.linspace(0, n, columns + 1).astype(np.intp)[:-1]
+    lows = np.minimum.reduceat(y, edges)
+    highs = np.maximum.reduceat(y, edges)
+    xs = np.repeat(np.asarray(x[edges]), 2)
+    ys = np.empty(2 * columns)
+    ys[0::2] = lows
+    ys[1::2] = highs
+    return xs, ys
+
+
+def plot_path(prefix: str = "observe_wave") -> str:
+    os.makedirs(PLOT_DIR, exist_ok=True)
+    stamp = datetime.now().strftime("%Y%m%d_%H%M%S_%f")
+    return os.path.join(PLOT_DIR, f"{prefix}_{stamp}.png")
+
+
+def render_traces(
+    path: str,
+    x: np.ndarray,
+    traces: Sequence[np.ndarray],
+    colors: Optional[Sequence[str]] = None,
+    title: str = "",
+    xlabel: str = "",
+    ylabel: str = "",
+    log_x: bool = False,
+    size: Tuple[float, float] = FIGURE_SIZE,
+    dpi: int = FIGURE_DPI,
+) -> str:
+    """Draw traces sharing one x axis into a PNG file and return its path.
+
+    Uses its own Figure on the Agg canvas, so nothing is left in pyplot's
+    global state and it is safe to call from any thread.
+    """
+    fig = Figure(figsize=size, dpi=dpi)
+    FigureCanvasAgg(fig)
+    ax = fig.add_subplot()
+    columns = int(size[0] * dpi)
+    for i, y in enumerate(traces):
+        xs, ys = (x, y) if log_x else decimate_minmax(x, y, columns)
+        ax.plot(xs, ys, colors[i] if colors else None, linewidth=0.8)
+    if log_x:
+        ax.set_xscale("log")
+    ax.set_title(title)
+    ax.set_xlabel(xlabel)
+    ax.set_ylabel(ylabel)
+    ax.grid()
+    fig.savefig(path)
+    return path
+
+
+def _report_failure(path: str, future: Future) -> None:
+    if not future.cancelled() and future.exception() is not None:
+        print(f"波形图 {path} 绘制失败: {future.exception()!r}")
+
+
+class WaveformRenderer:
+    """Renders plots on a background thread and writes uniquely named files."""
+
+    def __init__(self):
+        self._worker = ThreadPoolExecutor(max_workers=1, thread_name_prefix="render")
+
+    def submit(self, x, traces, prefix: str = "observe_wave", **kwargs) -> Tuple[str, Future]:
+        """Queue a plot and return its file name at once, with the pending future.
+
+        Callers usually drop the future, so a failed render is reported here.
+        """
+        path = plot_path(prefix)
+        future = self._worker.submit(render_traces, path, x, traces, **kwargs)
+        future.add_done_callback(lambda f: _report_failure(path, f))
+        return path, future
+
+    def shutdown(self, wait: bool = True) -> None:
+        self._worker.shutdown(wait=wait)
+
+
+renderer = WaveformRenderer()
@@ -0,0 +1,99 @@
+"""Incremental rendering of the agent scratchpad."""
+
+import re
+import threading
+from collections import OrderedDict
+from typing import List, Sequence, Tuple
+
+from langchain_core.agents import AgentAction
+
+# 写入 scratchpad 的单条观察结果的最大长度（字符）
+MAX_OBSERVATION_CHARS = 1000
+# 同时缓存渲染结果的执行器运行（步骤列表）数
+MAX_CACHED_RUNS = 64
+
+_SEPARATOR_LINE = re.compile(r"^\s*-{3,}\s*$")
+
+
+def compact_observation(observation, max_chars: int = MAX_OBSERVATION_CHARS) -> str:
+    """Canonical short form of a tool result for the prompt.
+
+    Tools pad their results with separator lines and blank lines for the
+    console; the model only needs the content lines.
+    """
+    lines = [
+        line.strip()
+        for line in str(observation).splitlines()
+        if line.strip() and not _SEPARATOR_LINE.match(line)
+    ]
+    text = "\n".join(lines)
+    if len(text) > max_chars:
+        text = text[:max_chars] + "…"
+    return text
+
+
+class _Rendered:
+    """Steps of one executor run already rendered, and their text."""
+
+    def __init__(self, source: Sequence[Tuple[AgentAction, str]]):
+        self.source = source
+        self.steps: List[Tuple[AgentAction, str]] = []
+        self.text = ""
+
+
+class IncrementalScratchpad:
+    """Drop-in for `format_log_to_str` that only renders new steps.
+
+    The executor appends to the same list of intermediate steps on every
+    iteration of a run, so the text rendered for the steps already seen is
+    kept per list and only the steps added since the last call are
+    formatted. One instance serves concurrent sessions, each with its own
+    list; the least recently used of more than `max_runs` lists is dropped.
+    A list that does not extend its cached steps is rendered from scratch.
+    """
+
+    def __init__(
+        self,
+        observation_prefix: str = "Observation: ",
+        llm_prefix: str = "Thought: ",
+        max_runs: int = MAX_CACHED_RUNS,
+    ):
+        self.observation_prefix = observation_prefix
+        self.llm_prefix = llm_prefix
+        self.max_runs = max_runs
+        self._runs: "OrderedDict[int, _Rendered]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _render(self, action: AgentAction, observation) -> str:
+        return (
+            f"{action.log}\n{self.observation_prefix}"
+            f"{compact_observation(observation)}\n{self.llm_prefix}"
+        )
+
+    @staticmethod
+    def _extends(run: _Rendered, steps: Sequence[Tuple[AgentAction, str]]) -> bool:
+        if run.source is not steps or len(steps) < len(run.steps):
+            return False
+        return all(
+            new[0] is old[0] and new[1] is old[1] for new, old in zip(steps, run.steps)
+        )
+
+    def _run(self, steps: Sequence[Tuple[AgentAction, str]]) -> _Rendered:
+        # 按步骤列表区分各次运行；列表被回收后 id 可能复用，因此同时核对对象本身
+        run = self._runs.get(id(steps))
+        if run is None or not self._extends(run, steps):
+            run = _Rendered(steps)
+            self._runs[id(steps)] = run
+        self._runs.move_to_end(id(steps))
+        while len(self._runs) > self.max_runs:
+            self._runs.popitem(last=False)
+        return run
+
+    def __call__(self, steps: Sequence[Tuple[AgentAction, str]]) -> str:
+        with self._lock:
+            run = self._run(steps)
+            new_steps = list(steps[len(run.steps) :])
+            if new_steps:
+                run.text += "".join(self._render(a, o) for a, o in new_steps)
+                run.steps.extend(new_steps)
+            return run.text
@@ -0,0 +1,94 @@
+"""Connecting to instruments ahead of time while the model is still generating."""
+
+import threading
+from concurrent.futures import Future
+from typing import Dict, Iterable, List, Sequence, Tuple
+
+from langchain_core.tools import BaseTool
+
+from fb_planning import tool_instruments
+from instruments import InstrumentRegistry
+
+
+def _report_failure(future: Future) -> None:
+    # 预连接失败不影响工具执行，工具调用时会重新连接并报告真正的错误
+    if not future.cancelled() and future.exception() is not None:
+        print(f"仪器预连接失败: {future.exception()}")
+
+
+class Speculation:
+    """Connections started for one tool name seen in the streamed output."""
+
+    def __init__(self, tool: str, futures: List[Future]):
+        self.tool = tool
+        self.futures = futures
+
+    def discard(self) -> None:
+        # 尚未开始的连接直接取消；已建立的连接保持打开，不影响仪器状态
+        for future in self.futures:
+            future.cancel()
+
+    def report_failures(self) -> None:
+        """Log connections that failed, now or once they finish."""
+        for future in self.futures:
+            future.add_done_callback(_report_failure)
+
+
+class SpeculativeConnector:
+    """Opens the VISA sessions a tool needs as soon as its name is streamed.
+
+    Nothing but the connection is done ahead of time: open_resource and the
+    `*IDN?` check run on the instrument's own worker thread, overlapping with
+    the rest of the LLM generation. Tools whose instruments are all connected
+    already start nothing. Once the full action has been parsed, speculations
+    for the tools actually called are committed and the others discarded.
+    """
+
+    def __init__(self, registry: InstrumentRegistry, tools: Sequence[BaseTool]):
+        self.registry = registry
+        self.instruments: Dict[str, Tuple[str, ...]] = {
+            tool.name: tool_instruments(tool) for tool in tools
+        }
+        self.started = 0
+        self.committed = 0
+        self.discarded = 0
+        self._pending: Dict[str, Speculation] = {}
+        self._lock = threading.Lock()
+
+    def start(self, tool: str) -> None:
+        names = self.instruments.get(tool)
+        with self._lock:
+            if not names or tool in self._pending:
+                return
+            futures = []
+            for name in names:
+                session = self.registry.session(name)
+                if not session.connected:
+                    futures.append(session.submit(session.connect))
+            if not futures:
+                return
+            self._pending[tool] = Speculation(tool, futures)
+            self.started += 1
+
+    def resolve(self, called: Iterable[str]) -> None:
+        """Commit speculations for the tools in `called`, discard the rest.
+
+        Connections that fail are logged instead of being dropped unseen.
+        """
+        called = set(called)
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        for tool, speculation in pending.items():
+            if tool in called:
+                self.committed += 1
+            else:
+                speculation.discard()
+                self.discarded += 1
+            speculation.report_failures()
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "started": self.started,
+            "committed": self.committed,
+            "discarded": self.discarded,
+        }
@@ -0,0 +1,143 @@
+"""Stepped-frequency response measurement with pipelined acquisition and analysis."""
+
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+
+import numpy as np
+
+from analysis import (
+    FrequencyResponse,
+    relative_gain_db,
+    response_from_points,
+    tone_amplitude,
+)
+from waveform import arm_single, read_binary_waveform, wait_single_acquisition
+
+# 每个频点切换后等待被测电路稳定的时间（秒）
+STEP_SETTLE = 0.02
+# 每个频点在屏幕上显示的周期数，示波器水平方向共 14 格
+STEP_PERIODS = 5
+SCREEN_DIVISIONS = 14
+STEP_CAPTURE_TIMEOUT = 5.0
+# 自适应加密：相邻频点增益变化超过该值（dB）或跨越 -3 dB 时在其间插入频点
+REFINE_STEP_DB = 1.0
+REFINE_POINTS = 3
+
+
+def step_frequencies(
+    f_start: float, f_stop: float, points: int, sweep_type: str = "LINe"
+) -> np.ndarray:
+    if sweep_type.upper().startswith("LOG"):
+        return np.geomspace(f_start, f_stop, points)
+    return np.linspace(f_start, f_stop, points)
+
+
+def refine_frequencies(
+    frequency: np.ndarray,
+    gain_db: np.ndarray,
+    budget: int,
+    log: bool = False,
+    per_interval: int = REFINE_POINTS,
+    threshold_db: float = REFINE_STEP_DB,
+) -> np.ndarray:
+    """Frequencies to add where the response changes quickly.
+
+    Intervals that straddle the -3 dB level come first, then those with the
+    largest gain step above `threshold_db`; at most `budget` points are
+    returned.
+    """
+    level = gain_db.max() - 3.0
+    step = np.abs(np.diff(gain_db))
+    straddles = (gain_db[:-1] - level) * (gain_db[1:] - level) < 0
+    score = np.where(straddles, np.inf, np.where(step > threshold_db, step, 0.0))
+    intervals = np.argsort(-score, kind="stable")[: budget // per_interval]
+    intervals = intervals[score[intervals] > 0]
+    if not intervals.size:
+        return np.empty(0)
+    fractions = np.arange(1, per_interval + 1) / (per_interval + 1)
+    lo, hi = frequency[intervals, None], frequency[intervals + 1, None]
+    new = lo * (hi / lo) ** fractions if log else lo + (hi - lo) * fractions
+    return new.ravel()
+
+
+class SteppedSweep:
+    """Measures a response point by point with a continuous sine from the AWG.
+
+    The steps are pipelined: as soon as the scope has finished the
+    single-shot capture at frequency N, the AWG is moved to N+1 so the
+    circuit settles while capture N is transferred, and capture N is
+    analysed on a worker thread while the next one is acquired.
+    """
+
+    def __init__(
+        self,
+        awg,
+        scope,
+        awg_channel: str = "CHANnel1",
+        scope_channel: str = "CHAN1",
+        settle: float = STEP_SETTLE,
+        periods: float = STEP_PERIODS,
+    ):
+        self.awg = awg
+        self.scope = scope
+        self.awg_channel = awg_channel
+        self.scope_channel = scope_channel
+        self.settle = settle
+        self.periods = periods
+
+    def _set_frequency(self, frequency: float) -> float:
+        self.awg.write(f":{self.awg_channel}:BASE:FREQuency {frequency}")
+        return time.monotonic()
+
+    def _capture(self, frequency: float, changed_at: float):
+        self.scope.write(f":TIM:SCAL {self.periods / (frequency * SCREEN_DIVISIONS)}")
+        remaining = self.settle - (time.monotonic() - changed_at)
+        if remaining > 0:
+            time.sleep(remaining)
+        arm_single(self.scope)
+        if not wait_single_acquisition(self.scope, STEP_CAPTURE_TIMEOUT):
+            raise ValueError(f"Capture at {frequency:.6g} Hz did not complete")
+
+    def measure(self, frequencies: np.ndarray) -> np.ndarray:
+        """Amplitude of the scope channel at each frequency, in volts."""
+        if not len(frequencies):
+            return np.empty(0)
+        with ThreadPoolExecutor(max_workers=1, thread_name_prefix="sweep") as worker:
+            futures = []
+            changed_at = self._set_frequency(frequencies[0])
+            for i, frequency in enumerate(frequencies):
+                self._capture(frequency, changed_at)
+                if i + 1 < len(frequencies):
+                    changed_at = self._set_frequency(frequencies[i + 1])
+                t, y = read_binary_waveform(self.scope, self.scope_channel)
+                futures.append(worker.submit(tone_amplitude, t, y, frequency))
+            return np.array([future.result() for future in futures])
+
+    def response(
+        self,
+        f_start: float,
+        f_stop: float,
+        points: int = 100,
+        sweep_type: str = "LOG",
+        reference: Optional[float] = None,
+    ) -> FrequencyResponse:
+        """Measure about `points` frequencies, denser where the gain changes.
+
+        Half of the points form an even grid; the rest are spent on the
+        intervals around the corners found in it.
+        """
+        log = sweep_type.upper().startswith("LOG")
+        frequency = step_frequencies(f_start, f_stop, max(points // 2, 2), sweep_type)
+        magnitude = self.measure(frequency)
+        while frequency.size < points:
+            extra = refine_frequencies(
+                frequency, relative_gain_db(magnitude, reference), points - frequency.size, log
+            )
+            if not extra.size:
+                break
+            frequency = np.concatenate((frequency, extra))
+            magnitude = np.concatenate((magnitude, self.measure(extra)))
+            order = np.argsort(frequency)
+            frequency, magnitude = frequency[order], magnitude[order]
+        return response_from_points(frequency, magnitude, reference, log)
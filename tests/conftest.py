@@ -0,0 +1,23 @@
+import threading
+
+import pytest
+from langchain_core.tools import Tool
+
+
+@pytest.fixture
+def make_tool():
+    """Factory for tools that declare the instruments they use.
+
+    With `calls`, each call appends the tool name and the thread it ran on.
+    """
+
+    def make(name, *instruments, calls=None):
+        def func(param_string=None):
+            if calls is not None:
+                calls.append((name, threading.current_thread().name))
+            return f"{name}({param_string})"
+
+        func.instruments = instruments
+        return Tool(name=name, func=func, description=name)
+
+    return make
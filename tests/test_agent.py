@@ -0,0 +1,200 @@
+import asyncio
+import threading
+
+import pytest
+from langchain.agents.output_parsers.tools import ToolAgentAction
+from langchain_core.agents import AgentAction, AgentFinish
+from langchain_core.language_models.fake_chat_models import GenericFakeChatModel
+from langchain_core.messages import AIMessage, ToolMessage
+from langchain_core.runnables import RunnableLambda
+from langchain_core.tools import StructuredTool
+
+from fb_planning import (
+    ParallelAgentExecutor,
+    _current_turn,
+    create_tool_calling_agent,
+    group_by_instrument,
+)
+from react_output_parsers import ReActSingleInputOutputParser, action_end, action_names
+
+
+@pytest.fixture
+def confirm(monkeypatch):
+    # 解析器执行动作前会请求用户确认，空输入表示确认
+    monkeypatch.setattr("builtins.input", lambda prompt="": "")
+
+
+def test_parser_single_action(confirm):
+    action = ReActSingleInputOutputParser().parse(
+        "Thought: set up\nAction: set_power_supply_channel\nAction Input: voltage=5\n"
+    )
+    assert isinstance(action, AgentAction)
+    assert (action.tool, action.tool_input) == ("set_power_supply_channel", "voltage=5")
+
+
+def test_parser_numbered_actions(confirm):
+    text = (
+        "Thought: both\n"
+        "Action 1: set_power_supply_channel\nAction Input 1: voltage=5\n"
+        "Action 2: configure_signal_generator\nAction Input 2: frequency=1000\n"
+    )
+    actions = ReActSingleInputOutputParser().parse(text)
+    assert [(a.tool, a.tool_input) for a in actions] == [
+        ("set_power_supply_channel", "voltage=5"),
+        ("configure_signal_generator", "frequency=1000"),
+    ]
+    assert actions[0].log.startswith("Thought: both")
+    assert actions[1].log.startswith("Action 2:")
+
+
+def test_parser_final_answer():
+    finish = ReActSingleInputOutputParser().parse("Thought: done\nFinal Answer: 5 V.")
+    assert isinstance(finish, AgentFinish)
+    assert finish.return_values == {"output": "5 V."}
+
+
+def test_action_end_and_names():
+    partial = "Thought: x\nAction: observe_channel_wave\nAction Input: channel=CHAN1"
+    assert action_names(partial) == ["observe_channel_wave"]
+    assert action_end(partial) is None
+    assert action_end(partial + "\nObserv") == len(partial) + 1
+
+
+def test_group_by_instrument_merges_shared_instruments(make_tool):
+    tools = {
+        t.name: t
+        for t in [
+            make_tool("scope_a", "scope"),
+            make_tool("awg_a", "awg"),
+            make_tool("both", "scope", "awg"),
+            make_tool("power_a", "power"),
+            make_tool("think"),
+        ]
+    }
+    actions = [AgentAction(name, "", "") for name in ["scope_a", "awg_a", "power_a", "both", "think"]]
+    groups = group_by_instrument(actions, tools)
+    assert [[a.tool for a in group] for group in groups] == [
+        ["power_a"],
+        ["scope_a", "awg_a", "both"],
+        ["think"],
+    ]
+
+
+def _executor(tools, first_turn):
+    def plan(inputs):
+        if not inputs["intermediate_steps"]:
+            return [AgentAction(name, inputs["input"], "") for name in first_turn]
+        observations = [observation for _, observation in inputs["intermediate_steps"]]
+        return AgentFinish({"output": ",".join(observations)}, "")
+
+    return ParallelAgentExecutor(agent=RunnableLambda(plan), tools=tools)
+
+
+def test_executor_runs_turn_actions_in_instrument_groups(make_tool):
+    calls = []
+    tools = [make_tool("scope_a", "scope", calls=calls), make_tool("awg_a", "awg", calls=calls)]
+    executor = _executor(tools, ["scope_a", "awg_a"])
+    assert executor.invoke({"input": "x"})["output"] == "scope_a(x),awg_a(x)"
+    assert sorted(name for name, _ in calls) == ["awg_a", "scope_a"]
+    assert all(thread != threading.current_thread().name for _, thread in calls)
+    assert _current_turn.get() is None
+
+
+def test_executor_turns_are_independent_across_sessions(make_tool):
+    tools = [make_tool("scope_a", "scope"), make_tool("awg_a", "awg")]
+    executor = _executor(tools, ["scope_a", "awg_a"])
+    outputs = {}
+
+    def session(key):
+        outputs[key] = executor.invoke({"input": key})["output"]
+
+    threads = [threading.Thread(target=session, args=(str(i),)) for i in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert outputs == {str(i): f"scope_a({i}),awg_a({i})" for i in range(8)}
+
+
+def _async_tool(make_tool, name, events, *instruments):
+    async def coroutine(param_string=None):
+        events.append(("start", name))
+        await asyncio.sleep(0.01)
+        events.append(("end", name))
+        return f"{name}({param_string})"
+
+    tool = make_tool(name, *instruments)
+    tool.coroutine = coroutine
+    return tool
+
+
+def test_async_executor_runs_groups_concurrently_and_groups_in_order(make_tool):
+    events = []
+    tools = [
+        _async_tool(make_tool, "scope_a", events, "scope"),
+        _async_tool(make_tool, "scope_b", events, "scope"),
+        _async_tool(make_tool, "awg_a", events, "awg"),
+    ]
+    executor = _executor(tools, ["scope_a", "awg_a", "scope_b"])
+    result = asyncio.run(executor.ainvoke({"input": "x"}))
+    assert result["output"] == "scope_a(x),awg_a(x),scope_b(x)"
+    scope = [event for event in events if event[1] != "awg_a"]
+    assert scope == [
+        ("start", "scope_a"),
+        ("end", "scope_a"),
+        ("start", "scope_b"),
+        ("end", "scope_b"),
+    ]
+    # 不同仪器的组同时执行
+    assert events.index(("start", "awg_a")) < events.index(("end", "scope_a"))
+    assert _current_turn.get() is None
+
+
+class _ToolCallingModel(GenericFakeChatModel):
+    """Fake chat model with native tool calling: replies with `messages` in order."""
+
+    bound: list = []
+    prompts: list = []
+
+    def bind_tools(self, tools):
+        self.bound.extend(tool.name for tool in tools)
+        return self.bind(tools=[tool.name for tool in tools])
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        self.prompts.append(messages)
+        return super()._generate(messages, stop=stop, run_manager=run_manager, **kwargs)
+
+
+def set_voltage(channel: str, voltage: float) -> str:
+    """Set the output voltage of a power supply channel."""
+    return f"{channel}={voltage}V"
+
+
+def test_tool_calling_agent_returns_structured_tool_actions():
+    call = {"name": "set_voltage", "args": {"channel": "CH1", "voltage": 5.0}, "id": "call_1"}
+    llm = _ToolCallingModel(
+        messages=iter([AIMessage(content="", tool_calls=[call]), AIMessage(content="完成")])
+    )
+    tool = StructuredTool.from_function(set_voltage)
+    agent = create_tool_calling_agent(llm, [tool])
+    assert llm.bound == ["set_voltage"]
+
+    actions = agent.invoke({"process": "把 CH1 设为 5V", "intermediate_steps": []})
+    assert len(actions) == 1
+    action = actions[0]
+    assert isinstance(action, ToolAgentAction)
+    assert (action.tool, action.tool_input, action.tool_call_id) == (
+        "set_voltage",
+        {"channel": "CH1", "voltage": 5.0},
+        "call_1",
+    )
+
+    finish = agent.invoke(
+        {"process": "把 CH1 设为 5V", "intermediate_steps": [(action, tool.run(action.tool_input))]}
+    )
+    assert isinstance(finish, AgentFinish)
+    assert finish.return_values["output"] == "完成"
+    observation = llm.prompts[-1][-1]
+    assert isinstance(observation, ToolMessage)
+    assert observation.tool_call_id == "call_1"
+    assert "CH1=5.0V" in observation.content
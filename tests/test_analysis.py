@@ -0,0 +1,132 @@
+import numpy as np
+import pytest
+
+from analysis import (
+    bandwidth_3db,
+    cross_correlation_delay,
+    dominant_frequency,
+    edge_delay,
+    frequency_response,
+    phase_difference,
+    relative_gain_db,
+    sweep_frequency,
+    tone_amplitude,
+    top_base,
+    waveform_metrics,
+)
+
+
+def _square(t, frequency, delay=0.0):
+    return np.where(np.mod((t - delay) * frequency, 1.0) < 0.5, 1.0, -1.0)
+
+
+def test_dominant_frequency_of_sine():
+    t = np.arange(10000) * 1e-6
+    # 频率分辨率为 100 Hz，插值误差应小于十分之一个分箱
+    assert dominant_frequency(t, np.sin(2 * np.pi * 1234.0 * t)) == pytest.approx(1234.0, abs=10.0)
+
+
+def test_cross_correlation_delay_with_max_lag():
+    t = np.arange(4000) * 1e-8
+    frequency, delay = 1e5, 2e-7
+    reference = _square(t, frequency)
+    signal = _square(t, frequency, delay)
+    assert cross_correlation_delay(t, reference, signal, 0.5 / frequency) == pytest.approx(delay, abs=2e-8)
+
+
+def test_edge_delay_needs_only_one_edge():
+    t = np.linspace(-1e-6, 1e-6, 1400)
+    reference = np.tanh(t / 5e-8)
+    signal = np.tanh((t - 3e-7) / 5e-8)
+    assert edge_delay(t, reference, signal) == pytest.approx(3e-7, abs=2e-9)
+    assert edge_delay(t, signal, reference) == pytest.approx(-3e-7, abs=2e-9)
+    assert edge_delay(t, reference, signal, max_lag=1e-7) is None
+
+
+def test_edge_delay_without_edges():
+    t = np.linspace(0, 1, 100)
+    assert edge_delay(t, np.ones_like(t), np.ones_like(t)) is None
+
+
+@pytest.mark.parametrize("delay, expected", [(2e-7, 7.2), (-2e-7, -7.2), (6e-6, -144.0)])
+def test_phase_difference_wraps(delay, expected):
+    assert phase_difference(delay, 1e5) == pytest.approx(expected)
+
+
+def _trapezoid(t, frequency, edge, low=-1.0, high=1.0):
+    """Square wave whose 0-100 % edges take `edge` seconds."""
+    period = 1.0 / frequency
+    phase = np.mod(t, period)
+    up = np.clip(phase / edge, 0.0, 1.0)
+    down = np.clip((phase - period / 2) / edge, 0.0, 1.0)
+    return low + (high - low) * (up - down)
+
+
+def test_waveform_metrics_of_square_wave():
+    t = np.arange(200000) * 1e-9
+    edge = 1e-6
+    metrics = waveform_metrics(t, _trapezoid(t, 1e4, edge, low=0.0, high=5.0))
+    assert metrics.vtop == pytest.approx(5.0, abs=0.05)
+    assert metrics.vbase == pytest.approx(0.0, abs=0.05)
+    assert metrics.amplitude == pytest.approx(5.0, abs=0.1)
+    assert metrics.rise_time == pytest.approx(0.8 * edge, rel=0.01)
+    assert metrics.fall_time == pytest.approx(0.8 * edge, rel=0.01)
+    assert metrics.frequency == pytest.approx(1e4, rel=1e-3)
+    assert metrics.slew_rate_rise == pytest.approx(5.0 / edge, rel=0.01)
+
+
+def test_waveform_metrics_of_sine():
+    t = np.arange(100000) * 1e-7
+    metrics = waveform_metrics(t, 2.0 * np.sin(2 * np.pi * 1e3 * t))
+    assert metrics.vpp == pytest.approx(4.0, rel=1e-3)
+    assert metrics.vrms == pytest.approx(2.0 / np.sqrt(2), rel=1e-3)
+    assert metrics.frequency == pytest.approx(1e3, rel=1e-3)
+
+
+def test_top_base_of_sine_is_near_extremes():
+    y = 1.0 + 2.0 * np.sin(np.linspace(0, 20 * np.pi, 10000))
+    top, base = top_base(y)
+    assert top == pytest.approx(3.0, abs=4.0 / 256)
+    assert base == pytest.approx(-1.0, abs=4.0 / 256)
+
+
+def _rc_gain(frequency, corner):
+    return 1.0 / np.sqrt(1.0 + (frequency / corner) ** 2)
+
+
+def test_sweep_frequency_lin_and_log():
+    elapsed = np.array([0.0, 0.5, 1.0, 2.0])
+    assert sweep_frequency(elapsed, 1e3, 1e5, 1.0, "LINe") == pytest.approx([1e3, 50500.0, 1e5, 1e5])
+    assert sweep_frequency(elapsed, 1e3, 1e5, 1.0, "LOG") == pytest.approx([1e3, 1e4, 1e5, 1e5])
+
+
+def test_bandwidth_3db_of_lowpass():
+    frequency = np.geomspace(1e2, 1e6, 400)
+    gain_db = 20 * np.log10(_rc_gain(frequency, 1e4))
+    low, high = bandwidth_3db(frequency, gain_db, log=True)
+    assert low is None
+    assert high == pytest.approx(1e4, rel=0.01)
+
+
+def test_frequency_response_of_swept_lowpass():
+    # 扫频时间需覆盖起始频率的足够多周期，否则包络在记录开头的过冲会抬高峰值
+    sweep_time, f_start, f_stop, dt = 1.0, 1e2, 1e5, 2e-6
+    t = np.arange(0, sweep_time, dt)
+    f = sweep_frequency(t, f_start, f_stop, sweep_time, "LOG")
+    phase = 2 * np.pi * np.cumsum(f) * dt
+    y = 0.5 * _rc_gain(f, 1e4) * np.sin(phase)
+    response = frequency_response(t, y, f_start, f_stop, sweep_time, "LOG", reference=0.5)
+    assert response.log
+    assert response.peak_gain_db == pytest.approx(0.0, abs=0.2)
+    assert response.f_high == pytest.approx(1e4, rel=0.05)
+
+
+def test_tone_amplitude_ignores_offset_and_partial_periods():
+    t = np.arange(1234) * 1e-6
+    y = 0.3 + 0.75 * np.sin(2 * np.pi * 2e3 * t + 0.4)
+    assert tone_amplitude(t, y, 2e3) == pytest.approx(0.75, rel=1e-6)
+
+
+def test_relative_gain_db():
+    assert relative_gain_db(np.array([1.0, 0.5]), 2.0) == pytest.approx([-6.0206, -12.0412], abs=1e-3)
+    assert relative_gain_db(np.array([1.0, 0.5])) == pytest.approx([0.0, -6.0206], abs=1e-3)
@@ -0,0 +1,154 @@
+import pytest
+from langchain_core.messages import AIMessage, HumanMessage, SystemMessage
+
+from core import encodings
+from core.chat_models import ChatOpenAI
+from core.encodings import (
+    DEFAULT_PROFILE,
+    MessageTokenCache,
+    TokenizerProfile,
+    register_tokenizer_profile,
+    tokenizer_profile,
+)
+
+
+class _Encoding:
+    """Stands in for a tiktoken encoding: one token per UTF-8 byte."""
+
+    def __init__(self, name):
+        self.name = name
+        self.calls = 0
+
+    def encode(self, text):
+        self.calls += 1
+        return list(text.encode())
+
+
+@pytest.fixture
+def fake_encodings(monkeypatch):
+    # 离线环境无法下载 BPE 文件，用假编码代替
+    loaded = {}
+
+    def get_encoding(name):
+        return loaded.setdefault(name, _Encoding(name))
+
+    monkeypatch.setattr(encodings, "get_encoding", get_encoding)
+    return loaded
+
+
+@pytest.fixture
+def profiles(monkeypatch):
+    monkeypatch.setattr(encodings, "_profiles", dict(encodings._profiles))
+    tokenizer_profile.cache_clear()
+    yield
+    tokenizer_profile.cache_clear()
+
+
+def test_profile_longest_prefix_wins(profiles):
+    assert tokenizer_profile("gpt-3.5-turbo-0301").tokens_per_message == 4
+    assert tokenizer_profile("gpt-3.5-turbo-0613").tokens_per_message == 3
+    assert tokenizer_profile("gpt-4-0613") == TokenizerProfile()
+
+
+def test_unknown_model_uses_default_profile(profiles, fake_encodings):
+    assert tokenizer_profile("qwen-72b-chat") is DEFAULT_PROFILE
+    name, encoding = encodings.profile_encoding("qwen-72b-chat", DEFAULT_PROFILE)
+    assert (name, encoding.name) == ("cl100k_base", "cl100k_base")
+
+
+def test_register_clears_cached_profile(profiles):
+    assert tokenizer_profile("qwen-72b-chat") is DEFAULT_PROFILE
+    profile = TokenizerProfile(tokens_per_message=5, encoding="o200k_base")
+    register_tokenizer_profile("qwen", profile)
+    assert tokenizer_profile("qwen-72b-chat") is profile
+    assert tokenizer_profile("qwen-7b") is profile
+
+
+def _uncached_count(messages, profile, encoding):
+    # OpenAI cookbook 的逐条计数方式，不经过缓存
+    total = profile.tokens_per_reply
+    for message in messages:
+        total += profile.tokens_per_message
+        for key, value in message.items():
+            total += len(encoding.encode(str(value)))
+            if key == "name":
+                total += profile.tokens_per_name
+    return total
+
+
+def test_cached_counts_match_uncached_counts(monkeypatch, profiles, fake_encodings):
+    cache = MessageTokenCache()
+    monkeypatch.setattr(encodings, "message_token_cache", cache)
+    llm = ChatOpenAI(model="qwen-72b-chat", key="test", base="http://localhost:1")
+    messages = [
+        SystemMessage(content="你是一名电子测量工程师"),
+        HumanMessage(content="测量 CHAN1 的频率", name="user"),
+        AIMessage(content="Action: calculate_frequency\nAction Input: channel=CHAN1"),
+    ]
+    dicts = [
+        {"role": "system", "content": "你是一名电子测量工程师"},
+        {"role": "user", "content": "测量 CHAN1 的频率", "name": "user"},
+        {"role": "assistant", "content": messages[2].content},
+    ]
+    expected = _uncached_count(dicts, DEFAULT_PROFILE, _Encoding("reference"))
+
+    assert llm.get_num_tokens_from_messages(messages) == expected
+    assert cache.stats() == {"size": 3, "hits": 0, "misses": 3}
+    encoding = fake_encodings["cl100k_base"]
+    calls = encoding.calls
+    assert llm.get_num_tokens_from_messages(messages) == expected
+    assert cache.stats()["hits"] == 3
+    assert encoding.calls == calls
+
+    # 只有新增的消息需要分词
+    messages.append(HumanMessage(content="继续"))
+    dicts.append({"role": "user", "content": "继续"})
+    assert llm.get_num_tokens_from_messages(messages) == _uncached_count(
+        dicts, DEFAULT_PROFILE, _Encoding("reference")
+    )
+    assert cache.stats()["misses"] == 4
+
+
+def test_cache_key_includes_profile(fake_encodings):
+    cache = MessageTokenCache()
+    encoding = fake_encodings.setdefault("cl100k_base", _Encoding("cl100k_base"))
+    message = {"role": "user", "content": "hi"}
+    assert cache.count(message, TokenizerProfile(), "cl100k_base", encoding) == 3 + 4 + 2
+    assert cache.count(message, TokenizerProfile(tokens_per_message=4), "cl100k_base", encoding) == 4 + 4 + 2
+
+
+def test_cache_evicts_least_recently_used(fake_encodings):
+    cache = MessageTokenCache(maxsize=2)
+    encoding = _Encoding("cl100k_base")
+    for content in ["a", "b", "a", "c"]:
+        cache.count({"content": content}, DEFAULT_PROFILE, "cl100k_base", encoding)
+    assert cache.stats() == {"size": 2, "hits": 1, "misses": 3}
+    cache.count({"content": "a"}, DEFAULT_PROFILE, "cl100k_base", encoding)
+    assert cache.stats()["hits"] == 2
+
+
+def test_warm_up_loads_each_model_encoding(fake_encodings):
+    encodings.warm_up(["gpt-4", None, "qwen-72b-chat"])
+    assert set(fake_encodings) == {"cl100k_base"}
+    assert encodings._resolve("qwen-72b-chat") == ("cl100k_base", "cl100k_base")
+
+
+def test_warm_up_without_models_loads_default(fake_encodings):
+    encodings.warm_up([None])
+    assert list(fake_encodings) == [encodings.DEFAULT_ENCODING]
+
+
+def test_warm_up_reports_failures(monkeypatch, capsys):
+    def get_encoding(name):
+        raise OSError("no network")
+
+    monkeypatch.setattr(encodings, "get_encoding", get_encoding)
+    encodings.warm_up(["gpt-4"])
+    assert "tiktoken 编码预加载失败 (gpt-4): no network" in capsys.readouterr().out
+
+
+def test_warm_up_in_background_runs_on_daemon_thread(fake_encodings):
+    thread = encodings.warm_up_in_background(model for model in ["gpt-4"])
+    thread.join(timeout=5)
+    assert thread.daemon and not thread.is_alive()
+    assert "cl100k_base" in fake_encodings
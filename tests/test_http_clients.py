@@ -0,0 +1,73 @@
+import asyncio
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import httpx
+import pytest
+
+from core.http_clients import LoopLocalAsyncClient, _pool_usage, _transports
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive，连接回到连接池
+
+    def do_GET(self):
+        body = b"ok"
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server_url():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _Handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_address[1]}/"
+    server.shutdown()
+    server.server_close()
+
+
+def _get(client, url):
+    async def fetch():
+        response = await client.get(url)
+        return response.text
+
+    return asyncio.run(fetch())
+
+
+def test_async_client_works_from_successive_event_loops(server_url):
+    client = LoopLocalAsyncClient(trust_env=False)
+    assert _get(client, server_url) == "ok"
+    assert _get(client, server_url) == "ok"
+    # 两个循环都已关闭，它们的连接池不再计入
+    assert _pool_usage(client)["connections"] == 0
+
+
+def test_async_client_works_from_another_thread(server_url):
+    client = LoopLocalAsyncClient(trust_env=False)
+    assert _get(client, server_url) == "ok"
+    results = []
+    thread = threading.Thread(target=lambda: results.append(_get(client, server_url)))
+    thread.start()
+    thread.join()
+    assert results == ["ok"]
+
+
+def test_pool_usage_reads_proxy_mounts():
+    client = LoopLocalAsyncClient(proxy="http://127.0.0.1:9", trust_env=False)
+
+    async def pools():
+        # 代理的连接池在首次使用时为当前循环创建
+        for transport in client._mounts.values():
+            transport._current()
+        return [type(t._pool).__name__ for t in _transports(client)]
+
+    assert "AsyncHTTPProxy" in asyncio.run(pools())
+    assert "HTTPProxy" in [
+        type(t._pool).__name__ for t in _transports(httpx.Client(proxy="http://127.0.0.1:9"))
+    ]
@@ -0,0 +1,145 @@
+import threading
+import time
+
+import pytest
+from pyvisa.constants import StatusCode
+from pyvisa.errors import VisaIOError
+
+from instruments import (
+    CompletionTimeout,
+    FairLock,
+    InstrumentRegistry,
+    ShadowState,
+    pack_commands,
+    scpi_key,
+)
+
+
+def test_pack_commands_joins_and_reroots():
+    messages = pack_commands([":CHAN1:COUP DC", "CHAN1:SCAL 0.5", "*CLS"], 256)
+    assert messages == [":CHAN1:COUP DC;:CHAN1:SCAL 0.5;*CLS"]
+
+
+def test_pack_commands_respects_max_length():
+    commands = [f":CHAN1:SCAL {i}" for i in range(5)]
+    messages = pack_commands(commands, 30)
+    assert all(len(m) <= 30 for m in messages)
+    assert ";".join(messages).split(";") == commands
+
+
+def test_pack_commands_sends_long_command_alone():
+    long = ":SYST:TEXT " + "x" * 40
+    assert pack_commands([":RUN", long, ":STOP"], 20) == [":RUN", long, ":STOP"]
+
+
+def test_pack_commands_empty():
+    assert pack_commands([], 256) == []
+
+
+def test_scpi_key_short_form():
+    assert scpi_key(":CHANnel1:BASE:FREQuency") == ":CHAN1:BASE:FREQ"
+    assert scpi_key("chan1:base:freq") == ":CHAN1:BASE:FREQ"
+    assert scpi_key("*rst") == "*RST"
+
+
+def test_shadow_skips_repeated_setting():
+    shadow = ShadowState()
+    shadow.record(":CHANnel1:SCALe 0.5")
+    assert shadow.is_redundant(":CHAN1:SCAL 5e-1")
+    assert not shadow.is_redundant(":CHAN1:SCAL 1")
+    assert shadow.skipped == 1
+
+
+def test_shadow_never_skips_queries_or_commands_without_argument():
+    shadow = ShadowState()
+    shadow.record(":SINGle")
+    shadow.record(":TRIGger:STATus?")
+    assert not shadow.is_redundant(":SINGle")
+    assert not shadow.is_redundant(":TRIGger:STATus?")
+
+
+def test_shadow_reset_and_forget():
+    shadow = ShadowState()
+    shadow.record(":CHAN1:COUP DC")
+    shadow.record(":CHAN2:COUP AC")
+    shadow.forget(":CHAN1:COUP DC")
+    assert shadow.get(":CHAN1:COUP") is None
+    assert shadow.get(":CHANnel2:COUPling") == "AC"
+    shadow.record("*RST")
+    assert shadow.values == {}
+
+
+class _TimeoutResource:
+    timeout = 1000
+
+    def __init__(self):
+        self.cleared = 0
+
+    def query(self, command):
+        raise VisaIOError(StatusCode.error_timeout)
+
+    def clear(self):
+        self.cleared += 1
+
+
+def test_wait_complete_clears_device_on_timeout():
+    resource = _TimeoutResource()
+    registry = InstrumentRegistry(resources={"scope": "FAKE"})
+    registry.open_resource = lambda name, timeout=None: resource
+    session = registry.session("scope")
+    assert session.wait_complete(0.01) is False
+    assert resource.cleared == 1
+    assert resource.timeout == 1000
+    with pytest.raises(CompletionTimeout):
+        session.wait_complete(0.01, strict=True)
+
+
+def test_fair_lock_is_reentrant():
+    lock = FairLock()
+    with lock:
+        with lock:
+            assert lock.depth == 1
+    assert lock.depth == 0
+    assert lock.stats()["acquisitions"] == 1
+
+
+def test_fair_lock_rejects_release_from_other_thread():
+    lock = FairLock()
+    lock.acquire()
+    errors = []
+
+    def release():
+        try:
+            lock.release()
+        except RuntimeError as e:
+            errors.append(e)
+
+    thread = threading.Thread(target=release)
+    thread.start()
+    thread.join()
+    lock.release()
+    assert len(errors) == 1
+
+
+def test_fair_lock_serves_waiters_in_arrival_order():
+    lock = FairLock()
+    order = []
+
+    def worker(i):
+        with lock:
+            order.append(i)
+
+    lock.acquire()
+    threads = []
+    for i in range(5):
+        thread = threading.Thread(target=worker, args=(i,))
+        thread.start()
+        threads.append(thread)
+        # 等待该线程进入等待队列后再启动下一个
+        while lock.depth < i + 2:
+            time.sleep(0.001)
+    assert lock.stats()["max_depth"] == 6
+    lock.release()
+    for thread in threads:
+        thread.join()
+    assert order == list(range(5))
@@ -0,0 +1,83 @@
+from instruments import InstrumentRegistry, changes_state
+from measurements import MeasurementCache, measure_many, parse_measurement
+
+
+class _FakeScope:
+    max_message_length = 256
+
+    def __init__(self, values, chained=True):
+        self.values = values
+        self.chained = chained
+        self.queries = []
+
+    def query(self, message):
+        self.queries.append(message)
+        items = [part.split("?")[0].split(":")[-1] for part in message.split(";")]
+        if len(items) > 1 and not self.chained:
+            return self.values[items[0]]
+        return ";".join(self.values[item] for item in items)
+
+
+def _cache(ttl=10.0):
+    return MeasurementCache(InstrumentRegistry(resources={}), ttl=ttl)
+
+
+def test_parse_measurement():
+    assert parse_measurement("1.5e-3") == 1.5e-3
+    assert parse_measurement("") is None
+    assert parse_measurement("****") is None
+
+
+def test_cache_hit_until_generation_changes():
+    cache = _cache()
+    cache.put("VAMPlitude", "chan1", 2.0)
+    assert cache.get(":VAMP", "CHAN1") == 2.0
+    cache.registry.bump_generation()
+    assert cache.get("VAMPlitude", "CHAN1") is None
+    assert (cache.hits, cache.misses) == (1, 1)
+
+
+def test_cache_expires_after_ttl():
+    cache = _cache(ttl=0.0)
+    cache.put("VPP", "CHAN1", 1.0)
+    assert cache.get("VPP", "CHAN1") is None
+    assert cache.get("VPP", "CHAN1", ttl=float("inf")) == 1.0
+
+
+def test_display_settings_do_not_change_state():
+    assert not changes_state(":TIMebase:SCALe 1e-6")
+    assert not changes_state(":TIMebase:MAIN:OFFSet 1e-6")
+    assert not changes_state(":KEY:AUTO")
+    # 垂直档位影响幅度测量
+    assert changes_state(":CHAN1:OFFSet 0.5")
+    assert changes_state(":CHANnel2:SCALe 0.2")
+    assert changes_state(":CHAN1:COUPling AC")
+    assert changes_state(":CHANnel1:BASE:FREQuency 1000")
+
+
+def test_measure_many_chains_queries_and_uses_cache():
+    cache = _cache()
+    cache.put("VAMPlitude", "CHAN1", 2.0)
+    scope = _FakeScope({"VPP": "3.0", "FREQuency": "1000"})
+    results = measure_many(scope, "CHAN1", ["VAMPlitude", "VPP", "FREQuency"], cache)
+    assert results == {"VAMPlitude": 2.0, "VPP": 3.0, "FREQuency": 1000.0}
+    assert scope.queries == [":MEASure:VPP? CHAN1;:MEASure:FREQuency? CHAN1"]
+    assert cache.get("FREQuency", "CHAN1") == 1000.0
+
+
+def test_measure_many_falls_back_to_single_queries():
+    scope = _FakeScope({"VPP": "3.0", "VMAX": "1.5"}, chained=False)
+    assert measure_many(scope, "CHAN1", ["VPP", "VMAX"]) == {"VPP": 3.0, "VMAX": 1.5}
+    assert len(scope.queries) == 3
+
+
+def test_rise_and_fall_times_are_never_cached():
+    cache = _cache()
+    cache.put("RISetime", "CHAN1", 1e-7)
+    cache.put(":FALL", "CHAN1", 1e-7)
+    assert cache.get("RISetime", "CHAN1") is None
+    assert cache.get("FALLtime", "CHAN1") is None
+    scope = _FakeScope({"RISetime": "2e-8"})
+    measure_many(scope, "CHAN1", ["RISetime"], cache)
+    measure_many(scope, "CHAN1", ["RISetime"], cache)
+    assert len(scope.queries) == 2
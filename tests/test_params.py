@@ -0,0 +1,94 @@
+from typing import Literal, Optional
+
+import pytest
+
+from params import ArgumentError, ToolArguments, tokenize
+
+
+def _tool(
+    channel: str = "CHANnel1",
+    function: Literal["SINe", "SQUare"] = "SINe",
+    frequency: float = 1000,
+    points: int = 1400,
+    enable: bool = False,
+    offset: Optional[float] = 0.0,
+    label=None,
+):
+    pass
+
+
+def test_tokenize_quotes_and_commas():
+    assert tokenize("channel=CHAN1, label='a, b', name=\"x\"") == {
+        "channel": "CHAN1",
+        "label": "a, b",
+        "name": "x",
+    }
+
+
+def test_tokenize_skips_empty_values():
+    assert tokenize("channel=, frequency=1e3") == {"frequency": "1e3"}
+    assert tokenize(None) == {}
+
+
+def test_tokenize_accepts_json():
+    assert tokenize('{"channel": "CHAN2", "frequency": 5}') == {
+        "channel": "CHAN2",
+        "frequency": 5,
+    }
+
+
+def test_coerce_annotated_types():
+    arguments = ToolArguments(_tool)
+    assert arguments.parse("function=square, frequency=2e3, points=700.0, enable=on") == {
+        "function": "SQUare",
+        "frequency": 2000.0,
+        "points": 700,
+        "enable": True,
+    }
+
+
+def test_literal_accepts_scpi_short_form():
+    assert ToolArguments(_tool).parse("function=squ") == {"function": "SQUare"}
+
+
+def test_unconvertible_values_pass_through():
+    assert ToolArguments(_tool).parse("frequency=fast") == {"frequency": "fast"}
+
+
+def test_unknown_keys_are_rejected():
+    with pytest.raises(ArgumentError, match="amplitude"):
+        ToolArguments(_tool).parse("channel=CHAN1, amplitude=2")
+    with pytest.raises(ArgumentError):
+        ToolArguments(_tool).parse(amplitude=2)
+
+
+def test_invalid_bool_is_rejected():
+    arguments = ToolArguments(_tool)
+    assert arguments.parse("enable=否") == {"enable": False}
+    with pytest.raises(ArgumentError):
+        arguments.parse("enable=maybe")
+
+
+@pytest.mark.parametrize("word", ["None", "null", "NULL"])
+def test_none_words_for_optional_params(word):
+    assert ToolArguments(_tool).parse(f"offset={word}, label={word}") == {
+        "offset": None,
+        "label": None,
+    }
+
+
+def test_none_word_for_required_str_is_kept():
+    assert ToolArguments(_tool).parse("channel=None") == {"channel": "None"}
+
+
+def test_structured_kwargs_override_string():
+    assert ToolArguments(_tool).parse("frequency=1", frequency="2") == {"frequency": 2.0}
+
+
+def test_cached_parse_is_not_shared_between_calls():
+    args = ToolArguments(_tool)
+    text = '{"label": {"marks": [1, 2]}}'
+    first = args.parse(text)
+    first["label"]["marks"].append(3)
+    first["channel"] = "CHANnel2"
+    assert args.parse(text) == {"label": {"marks": [1, 2]}}
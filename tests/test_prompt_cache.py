@@ -0,0 +1,79 @@
+from langchain.tools.render import render_text_description
+from langchain_core.prompts import ChatPromptTemplate, PromptTemplate
+from langchain_core.tools import Tool
+
+import prompt_cache
+from prompt_cache import PromptPrefix, PromptPrefixCache, static_prefix, template_text
+
+TEMPLATE = "你可以使用以下工具:\n{tools}\n工具名: {tool_names}\n问题: {input}\n{agent_scratchpad}"
+
+
+def _tools(description="读取波形"):
+    return [
+        Tool(name="observe_channel_wave", func=str, description=description),
+        Tool(name="autoscale", func=str, description="自动设置"),
+    ]
+
+
+def test_prompt_prefix_is_rendered_once_per_tool_set():
+    calls = []
+
+    def renderer(tools):
+        calls.append(tools)
+        return render_text_description(tools)
+
+    cache = PromptPrefixCache()
+    first = cache.get(_tools(), renderer, TEMPLATE, "\nsuffix")
+    assert cache.get(_tools(), renderer, TEMPLATE, "\nsuffix") is first
+    assert len(calls) == 1
+    assert first.tools == render_text_description(_tools()) + "\nsuffix"
+    assert first.tool_names == "observe_channel_wave, autoscale"
+
+
+def test_static_prefix_stops_at_first_dynamic_variable():
+    prefix = PromptPrefixCache().get(_tools(), render_text_description, TEMPLATE).prefix
+    tools_text = render_text_description(_tools())
+    assert prefix == (
+        f"你可以使用以下工具:\n{tools_text}\n工具名: observe_channel_wave, autoscale\n问题: "
+    )
+    assert static_prefix("{input} {tools}", tools="x") == ""
+
+
+def test_prompt_prefix_changes_with_description_template_and_suffix():
+    cache = PromptPrefixCache()
+    base = cache.get(_tools(), render_text_description, TEMPLATE)
+    changed = cache.get(_tools("读取深存储波形"), render_text_description, TEMPLATE)
+    assert changed.tools != base.tools and changed.prefix != base.prefix
+    assert cache.get(_tools(), render_text_description, "{tools}|{input}").prefix == base.tools + "|"
+    assert cache.get(_tools(), render_text_description, TEMPLATE, "x").tools == base.tools + "x"
+
+
+class _Encoding:
+    def __init__(self):
+        self.calls = []
+
+    def encode(self, text):
+        self.calls.append(text)
+        return text.split()
+
+
+def test_prefix_token_count_is_lazy_and_memoized(monkeypatch):
+    encoding = _Encoding()
+    models = []
+    monkeypatch.setattr(
+        prompt_cache,
+        "profile_encoding",
+        lambda model, profile: models.append(model) or ("fake", encoding),
+    )
+    prefix = PromptPrefix("tools", "names", "你可以使用以下工具: observe_channel_wave")
+    assert encoding.calls == []
+    assert prefix.num_tokens("gpt-4") == 2
+    assert prefix.num_tokens("gpt-4") == 2
+    assert prefix.num_tokens("qwen-72b-chat") == 2
+    assert models == ["gpt-4", "qwen-72b-chat"]
+    assert len(encoding.calls) == 2
+
+
+def test_template_text_of_chat_prompt():
+    assert template_text(PromptTemplate.from_template(TEMPLATE)) == TEMPLATE
+    assert template_text(ChatPromptTemplate.from_template(TEMPLATE)) == TEMPLATE
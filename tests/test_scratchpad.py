@@ -0,0 +1,80 @@
+from langchain.agents.format_scratchpad import format_log_to_str
+from langchain_core.agents import AgentAction
+
+from scratchpad import IncrementalScratchpad, compact_observation
+
+FRAMED = "\n---------------------------\n\n\n\n\n所测通道的频率是: 1000.000000 Hz \n\n\n\n---------------------------\n"
+
+
+def _step(i):
+    return AgentAction("observe_channel_wave", f"channel=CHAN{i}", f"Action: {i}"), FRAMED
+
+
+def test_compact_observation_drops_frame_and_blank_lines():
+    assert compact_observation(FRAMED) == "所测通道的频率是: 1000.000000 Hz"
+
+
+def test_compact_observation_keeps_content_lines_and_truncates():
+    assert compact_observation("a\n\n  b  \n") == "a\nb"
+    assert compact_observation("x" * 20, max_chars=8) == "x" * 8 + "…"
+    assert compact_observation(3.5) == "3.5"
+
+
+def test_scratchpad_matches_format_log_to_str():
+    steps = [_step(i) for i in range(3)]
+    compacted = [(a, compact_observation(o)) for a, o in steps]
+    assert IncrementalScratchpad()(steps) == format_log_to_str(compacted)
+
+
+def test_scratchpad_renders_only_new_steps(monkeypatch):
+    scratchpad = IncrementalScratchpad()
+    steps = [_step(0)]
+    first = scratchpad(steps)
+    rendered = []
+    render = scratchpad._render
+    monkeypatch.setattr(scratchpad, "_render", lambda a, o: rendered.append(a) or render(a, o))
+    steps.append(_step(1))
+    second = scratchpad(steps)
+    assert second.startswith(first)
+    assert rendered == [steps[1][0]]
+    assert scratchpad(steps) == second
+    assert rendered == [steps[1][0]]
+
+
+def test_scratchpad_rerenders_a_different_history():
+    scratchpad = IncrementalScratchpad()
+    scratchpad([_step(0), _step(1)])
+    other = [_step(5)]
+    assert scratchpad(other) == IncrementalScratchpad()(other)
+    assert scratchpad([]) == ""
+
+
+def test_scratchpad_keeps_interleaved_sessions_incremental(monkeypatch):
+    scratchpad = IncrementalScratchpad()
+    rendered = []
+    render = scratchpad._render
+    monkeypatch.setattr(scratchpad, "_render", lambda a, o: rendered.append(a) or render(a, o))
+    first, second = [], []
+    for i in range(3):
+        first.append(_step(i))
+        second.append(_step(10 + i))
+        assert scratchpad(first) == IncrementalScratchpad()(first)
+        assert scratchpad(second) == IncrementalScratchpad()(second)
+    # 两个会话交替调用，每个步骤仍只渲染一次
+    assert rendered == [a for pair in zip(first, second) for a, _ in pair]
+
+
+def test_scratchpad_rerenders_a_rewritten_list():
+    scratchpad = IncrementalScratchpad()
+    steps = [_step(0), _step(1)]
+    scratchpad(steps)
+    steps[1:] = [_step(7)]
+    assert scratchpad(steps) == IncrementalScratchpad()(steps)
+
+
+def test_scratchpad_evicts_least_recently_used_runs():
+    scratchpad = IncrementalScratchpad(max_runs=2)
+    runs = [[_step(i)] for i in range(3)]
+    for steps in runs:
+        scratchpad(steps)
+    assert list(scratchpad._runs) == [id(runs[1]), id(runs[2])]
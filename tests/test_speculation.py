@@ -0,0 +1,75 @@
+from concurrent.futures import Future
+
+from speculation import SpeculativeConnector
+
+
+class _Session:
+    def __init__(self, connected=False):
+        self.connected = connected
+        self.submitted = []
+
+    def connect(self):
+        self.connected = True
+
+    def submit(self, func):
+        self.submitted.append(func)
+        return Future()
+
+
+class _Registry:
+    def __init__(self, **sessions):
+        self.sessions = sessions
+
+    def session(self, name):
+        return self.sessions[name]
+
+
+def test_connects_only_instruments_not_yet_connected(make_tool):
+    registry = _Registry(scope=_Session(), awg=_Session(connected=True))
+    connector = SpeculativeConnector(registry, [make_tool("both", "scope", "awg")])
+    connector.start("both")
+    connector.start("both")
+    assert len(registry.sessions["scope"].submitted) == 1
+    assert registry.sessions["awg"].submitted == []
+    assert connector.stats()["started"] == 1
+
+
+def test_nothing_is_recorded_when_already_connected(make_tool):
+    registry = _Registry(awg=_Session(connected=True))
+    connector = SpeculativeConnector(registry, [make_tool("awg_a", "awg"), make_tool("think")])
+    connector.start("awg_a")
+    connector.start("think")
+    connector.start("unknown")
+    connector.resolve(["awg_a"])
+    assert connector.stats() == {"started": 0, "committed": 0, "discarded": 0}
+
+
+def test_resolve_commits_called_tools_and_cancels_the_rest(make_tool):
+    registry = _Registry(scope=_Session(), power=_Session())
+    connector = SpeculativeConnector(
+        registry, [make_tool("scope_a", "scope"), make_tool("power_a", "power")]
+    )
+    connector.start("scope_a")
+    connector.start("power_a")
+    connector.resolve(["scope_a"])
+    assert connector.stats() == {"started": 2, "committed": 1, "discarded": 1}
+    assert connector._pending == {}
+
+
+def test_resolve_reports_failed_connections(make_tool, capsys):
+    registry = _Registry(scope=_Session(), power=_Session())
+    connector = SpeculativeConnector(
+        registry, [make_tool("scope_a", "scope"), make_tool("power_a", "power")]
+    )
+    connector.start("scope_a")
+    connector.start("power_a")
+    scope = connector._pending["scope_a"].futures[0]
+    power = connector._pending["power_a"].futures[0]
+    scope.set_running_or_notify_cancel()
+    power.set_running_or_notify_cancel()
+    scope.set_exception(OSError("VI_ERROR_RSRC_NFOUND"))
+    connector.resolve(["scope_a"])
+    assert capsys.readouterr().out == "仪器预连接失败: VI_ERROR_RSRC_NFOUND\n"
+    # 已在连接中的被丢弃的推测，完成后同样报告
+    power.set_exception(OSError("timeout"))
+    assert capsys.readouterr().out == "仪器预连接失败: timeout\n"
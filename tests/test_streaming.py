@@ -0,0 +1,172 @@
+import asyncio
+import warnings
+from typing import List
+
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.language_models.fake_chat_models import GenericFakeChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk
+
+from core.chat_models import ChatOpenAI
+from fb_planning import action_end, stream_until_action
+
+REPLY = (
+    "Thought: 先看波形\n"
+    "Action: observe_channel_wave\n"
+    "Action Input: channel=CHAN1\n"
+    "Observation: 幻觉出的结果\n"
+    "Final Answer: 完成.\n"
+)
+ACTION = REPLY[: REPLY.index("Observation")]
+
+
+class _Response:
+    """Streamed chat completion that records how far it was read."""
+
+    def __init__(self, pieces: List[str]):
+        self.pieces = pieces
+        self.read = 0
+        self.closed = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.closed = True
+
+    def __iter__(self):
+        for piece in self.pieces:
+            self.read += 1
+            yield {"choices": [{"delta": {"role": "assistant", "content": piece}}]}
+
+
+class _Completions:
+    def __init__(self, pieces: List[str]):
+        self.response = _Response(pieces)
+        self.params = None
+
+    def create(self, **params):
+        self.params = params
+        return self.response
+
+
+class _AsyncResponse(_Response):
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        self.closed = True
+
+    async def __aiter__(self):
+        for chunk in self:
+            yield chunk
+
+
+class _AsyncCompletions(_Completions):
+    def __init__(self, pieces: List[str]):
+        super().__init__(pieces)
+        self.response = _AsyncResponse(pieces)
+
+    async def create(self, **params):
+        return super().create(**params)
+
+
+class _Events(BaseCallbackHandler):
+    def __init__(self):
+        self.ends = []
+        self.errors = []
+        self.options = []
+
+    def on_chat_model_start(self, serialized, messages, **kwargs):
+        self.options.append(kwargs.get("options"))
+
+    def on_llm_end(self, response, **kwargs):
+        self.ends.append(response.generations[0][0].text)
+
+    def on_llm_error(self, error, **kwargs):
+        self.errors.append(error)
+
+
+def _pieces(text: str, size: int = 7) -> List[str]:
+    return [text[i : i + size] for i in range(0, len(text), size)]
+
+
+def test_stream_stops_at_action_and_reports_end():
+    completions = _Completions(_pieces(REPLY))
+    llm = ChatOpenAI(model="gpt-4", key="test", base="http://localhost:1", client=completions)
+    events = _Events()
+    text = stream_until_action(llm.bind(stop=["\nObservation"])).invoke(
+        "测量", {"callbacks": [events]}
+    )
+    assert text == ACTION
+    assert completions.response.closed
+    assert completions.response.read < len(completions.response.pieces)
+    assert "stop_condition" not in completions.params
+    assert events.errors == []
+    assert events.ends == [ACTION]
+    assert events.options == [{"stop": ["\nObservation"]}]
+
+
+def test_cut_chunk_is_built_without_deprecated_copy():
+    completions = _Completions(_pieces(REPLY))
+    llm = ChatOpenAI(model="gpt-4", key="test", base="http://localhost:1", client=completions)
+    with warnings.catch_warnings():
+        warnings.simplefilter("error", DeprecationWarning)
+        chunks = list(llm.stream("测量", stop_condition=action_end))
+    assert all(isinstance(chunk, AIMessageChunk) for chunk in chunks)
+    assert "".join(chunk.content for chunk in chunks) == ACTION
+    assert chunks[-1].response_metadata["finish_reason"] == "stop"
+    assert len({chunk.id for chunk in chunks}) == 1
+
+
+def test_astream_stops_at_action_without_leaking_stop_condition():
+    completions = _AsyncCompletions(_pieces(REPLY))
+    llm = ChatOpenAI(
+        model="gpt-4", key="test", base="http://localhost:1", async_client=completions
+    )
+    events = _Events()
+
+    async def collect():
+        return [
+            chunk.content
+            async for chunk in llm.astream(
+                "测量", {"callbacks": [events]}, stop_condition=action_end
+            )
+        ]
+
+    text = "".join(asyncio.run(collect()))
+    assert text == ACTION
+    assert completions.response.closed
+    assert completions.response.read < len(completions.response.pieces)
+    assert "stop_condition" not in completions.params
+    assert events.options == [{"stop": None}]
+    assert events.errors == []
+
+
+def test_stream_without_stop_condition_support_is_cut_locally():
+    llm = GenericFakeChatModel(messages=iter([AIMessage(content=REPLY)]))
+    events = _Events()
+    text = stream_until_action(llm).invoke("测量", {"callbacks": [events]})
+    assert text == ACTION
+    assert events.errors == []
+    assert len(events.ends) == 1
+
+
+class _Connector:
+    def __init__(self):
+        self.started = []
+        self.resolved = None
+
+    def start(self, name):
+        self.started.append(name)
+
+    def resolve(self, names):
+        self.resolved = names
+
+
+def test_stream_passes_tool_names_to_preparer():
+    completions = _Completions(_pieces(REPLY))
+    llm = ChatOpenAI(model="gpt-4", key="test", base="http://localhost:1", client=completions)
+    connector = _Connector()
+    stream_until_action(llm, connector).invoke("测量")
+    assert connector.started == ["observe_channel_wave"]
+    assert connector.resolved == ["observe_channel_wave"]
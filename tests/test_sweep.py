@@ -0,0 +1,138 @@
+import numpy as np
+import pytest
+
+from instruments import ShadowState
+from sweep import SCREEN_DIVISIONS, SteppedSweep, refine_frequencies, step_frequencies
+
+CORNER = 1e4
+POINTS = 1000
+
+
+def _gain(frequency):
+    return 1 / np.sqrt(1 + (frequency / CORNER) ** 2)
+
+
+class _Awg:
+    def __init__(self, events):
+        self.events = events
+        self.frequency = None
+
+    def write(self, command):
+        header, value = command.split()
+        assert header == ":CHANnel1:BASE:FREQuency"
+        self.frequency = float(value)
+        self.events.append(("awg", self.frequency))
+
+
+class _Scope:
+    """Single-shot scope measuring a first-order lowpass driven by `awg`."""
+
+    def __init__(self, awg, events):
+        self.awg = awg
+        self.events = events
+        self.scale = 1e-3
+        self.record = None
+        self.shadow = ShadowState()
+        self.shadow.record(":TRIGger:SWEEp AUTO")
+        self._reply = None
+
+    def write(self, command):
+        if command.startswith(":TIM:SCAL "):
+            self.scale = float(command.split()[1])
+        elif command == ":SINGle":
+            # 记录在布防时按当时的信号发生器频率冻结
+            self.record = (self.awg.frequency, self.scale)
+            self.events.append(("single", self.awg.frequency))
+        elif command == ":WAVeform:DATA?":
+            frequency, scale = self.record
+            t = self._t(scale)
+            y = _gain(frequency) * np.sin(2 * np.pi * frequency * t)
+            raw = np.round(y / 0.01 + 128).astype(np.uint8).tobytes()
+            self._reply = b"#4%04d" % len(raw) + raw
+            self.events.append(("read", frequency))
+
+    def _t(self, scale):
+        return np.arange(POINTS) * (SCREEN_DIVISIONS * scale / POINTS)
+
+    def query(self, command):
+        if command == ":TRIGger:STATus?":
+            return "STOP\n"
+        assert command == ":WAVeform:PREamble?"
+        scale = self.record[1]
+        return f"0,0,{POINTS},1,{SCREEN_DIVISIONS * scale / POINTS},0,0,0.01,0,128\n"
+
+    def wait_complete(self, timeout):
+        return True
+
+    def read_raw(self):
+        reply, self._reply = self._reply, None
+        return reply
+
+
+def _sweep(**kwargs):
+    events = []
+    awg = _Awg(events)
+    scope = _Scope(awg, events)
+    return SteppedSweep(awg, scope, settle=0, **kwargs), events
+
+
+def test_step_frequencies():
+    np.testing.assert_allclose(step_frequencies(1, 100, 3, "LOG"), [1, 10, 100])
+    np.testing.assert_allclose(step_frequencies(0, 10, 3, "LINe"), [0, 5, 10])
+
+
+def test_measure_pipelines_awg_and_capture():
+    sweep, events = _sweep()
+    frequencies = np.array([1e3, 2e3, 4e3])
+    magnitude = sweep.measure(frequencies)
+    np.testing.assert_allclose(magnitude, _gain(frequencies), atol=0.01)
+    # 频点 N 采集完成后先把信号发生器切到 N+1，再读取 N 的波形
+    assert events == [
+        ("awg", 1e3),
+        ("single", 1e3),
+        ("awg", 2e3),
+        ("read", 1e3),
+        ("single", 2e3),
+        ("awg", 4e3),
+        ("read", 2e3),
+        ("single", 4e3),
+        ("read", 4e3),
+    ]
+
+
+def test_capture_drops_the_shadowed_trigger_sweep():
+    sweep, _ = _sweep()
+    sweep.measure(np.array([1e3]))
+    assert not sweep.scope.shadow.is_redundant(":TRIGger:SWEEp AUTO")
+
+
+def test_response_refines_around_the_corner():
+    sweep, events = _sweep()
+    response = sweep.response(1e2, 1e6, points=20, sweep_type="LOG", reference=1.0)
+    # 加密点按每个区间 REFINE_POINTS 个分配，不超过总点数
+    assert 20 - 3 < response.frequency.size <= 20
+    assert np.all(np.diff(response.frequency) > 0)
+    assert response.f_high == pytest.approx(CORNER, rel=0.05)
+    grid = step_frequencies(1e2, 1e6, 10, "LOG")
+    extra = np.setdiff1d(response.frequency, grid)
+    # 跨越 -3 dB 的区间最先加密
+    assert np.any((extra > CORNER / 2) & (extra < CORNER * 2))
+    assert not np.any(extra < 1e3)
+
+
+def test_refine_frequencies_prefers_the_3db_crossing():
+    frequency = np.array([1.0, 2.0, 3.0, 4.0, 5.0])
+    gain_db = np.array([0.0, -0.5, -2.0, -5.0, -5.2])
+    extra = refine_frequencies(frequency, gain_db, budget=3, per_interval=3)
+    np.testing.assert_allclose(extra, [3.25, 3.5, 3.75])
+    extra = refine_frequencies(frequency, gain_db, budget=6, per_interval=3)
+    np.testing.assert_allclose(extra, [3.25, 3.5, 3.75, 2.25, 2.5, 2.75])
+
+
+def test_refine_frequencies_log_spacing_and_flat_response():
+    frequency = np.array([1e3, 1e5])
+    extra = refine_frequencies(frequency, np.array([0.0, -10.0]), 1, log=True, per_interval=1)
+    np.testing.assert_allclose(extra, [1e4])
+    flat = refine_frequencies(np.array([1.0, 2.0, 3.0]), np.zeros(3), budget=10)
+    assert flat.size == 0
+    assert refine_frequencies(frequency, np.array([0.0, -10.0]), budget=2).size == 0
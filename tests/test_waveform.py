@@ -0,0 +1,218 @@
+import numpy as np
+import pytest
+
+from instruments import ShadowState
+from waveform import (
+    WaveformPreamble,
+    arm_single,
+    capture_channels,
+    capture_deep_memory,
+    capture_single,
+    parse_block,
+    read_binary_waveform,
+    read_block,
+    single_shot,
+    wait_single_acquisition,
+)
+
+PREAMBLE = "0,0,4,1,1e-6,-2e-6,0,0.1,0,100"
+
+
+class _Scope:
+    """Acquisition state and binary transfers of a scope, with every write recorded."""
+
+    def __init__(self, status="RUN", sweep="AUTO", raw=bytes([100, 110, 120, 130])):
+        self.status = status
+        self.sweep = sweep
+        self.raw = raw
+        self.writes = []
+        self.window = [1, len(raw)]
+        self.shadow = None
+        self.preamble = PREAMBLE
+        self._replies = []
+
+    def wait_complete(self, timeout):
+        return True
+
+    def write(self, command):
+        self.writes.append(command)
+        if command == ":STOP":
+            self.status = "STOP"
+        elif command == ":SINGle":
+            # 假定立即触发，单次采集随即完成
+            self.status, self.sweep = "STOP", "SINGle"
+        elif command.startswith(":TRIGger:SWEEp "):
+            self.sweep = command.split()[1]
+        elif command.startswith(":WAVeform:STARt "):
+            self.window[0] = int(command.split()[1])
+        elif command.startswith(":WAVeform:STOP "):
+            self.window[1] = int(command.split()[1])
+        elif command == ":WAVeform:DATA?":
+            raw = self.raw[self.window[0] - 1 : self.window[1]]
+            self._replies.append(b"#1%d" % len(raw) + raw + b"\n")
+
+    def query(self, command):
+        replies = {
+            ":TRIGger:STATus?": self.status,
+            ":TRIGger:SWEEp?": self.sweep,
+            ":WAVeform:PREamble?": self.preamble,
+            ":WAVeform:STARt?": "1",
+            ":WAVeform:STOP?": "1400",
+        }
+        return replies[command] + "\n"
+
+    def read_raw(self):
+        return self._replies.pop(0)
+
+
+class _SingleShotScope:
+    """Reports the previous capture's STOP until `*OPC?` has been answered."""
+
+    def __init__(self, statuses, complete=True):
+        self.statuses = list(statuses)
+        self.complete = complete
+        self.synced = False
+        self.polls = []
+
+    def wait_complete(self, timeout):
+        self.synced = self.complete
+        return self.complete
+
+    def query(self, message):
+        assert message == ":TRIGger:STATus?"
+        status = self.statuses.pop(0) if self.synced else "STOP"
+        self.polls.append(status)
+        return status + "\n"
+
+
+def test_single_acquisition_waits_for_completion_before_polling():
+    scope = _SingleShotScope(["WAIT", "RUN", "STOP"])
+    assert wait_single_acquisition(scope, timeout=1.0, interval=0)
+    assert scope.polls == ["WAIT", "RUN", "STOP"]
+
+
+def test_single_acquisition_fails_without_completion():
+    scope = _SingleShotScope(["STOP"], complete=False)
+    assert not wait_single_acquisition(scope, timeout=1.0, interval=0)
+    assert scope.polls == []
+
+
+@pytest.mark.parametrize(
+    "status, sweep, resume",
+    [("RUN", "AUTO", [":RUN"]), ("WAIT", "SINGle", [":SINGle"]), ("STOP", "AUTO", [])],
+)
+def test_capture_channels_restores_run_state(status, sweep, resume):
+    scope = _Scope(status, sweep)
+    t, data = capture_channels(scope, ["CHAN1", "CHAN2"])
+    assert data.shape == (2, 4)
+    np.testing.assert_allclose(data[0], [0.0, 1.0, 2.0, 3.0])
+    np.testing.assert_allclose(t, [-2e-6, -1e-6, 0.0, 1e-6])
+    assert scope.writes[0] == ":STOP"
+    assert [w for w in scope.writes if w in (":RUN", ":SINGle")] == resume
+
+
+@pytest.mark.parametrize("status, resume", [("RUN", [":RUN"]), ("STOP", [])])
+def test_deep_memory_restores_range_and_run_state(tmp_path, status, resume):
+    scope = _Scope(status)
+    capture = capture_deep_memory(scope, "CHAN1", path=str(tmp_path / "c.f32"), chunk_points=2)
+    np.testing.assert_allclose(capture.load(), [0.0, 1.0, 2.0, 3.0])
+    assert (capture.minimum, capture.maximum) == pytest.approx((0.0, 3.0))
+    windows = [w for w in scope.writes if w.startswith(":WAVeform:ST")]
+    assert windows == [
+        ":WAVeform:STARt 1",
+        ":WAVeform:STOP 2",
+        ":WAVeform:STARt 3",
+        ":WAVeform:STOP 4",
+        ":WAVeform:STARt 1",
+        ":WAVeform:STOP 1400",
+    ]
+    assert [w for w in scope.writes if w in (":RUN", ":SINGle")] == resume
+
+
+def test_arm_single_forgets_the_shadowed_trigger_sweep():
+    scope = _Scope()
+    scope.shadow = ShadowState()
+    scope.shadow.record(":TRIGger:SWEEp AUTO")
+    arm_single(scope)
+    assert not scope.shadow.is_redundant(":TRIGger:SWEEp AUTO")
+
+
+def test_single_shot_capture_restores_sweep_and_run_state():
+    scope = _Scope("RUN", "AUTO")
+    with single_shot(scope):
+        t, data = capture_single(scope, ["CHAN1"])
+        assert scope.sweep == "SINGle"
+    assert data.shape == (1, 4)
+    assert scope.writes[0] == ":SINGle"
+    assert scope.writes[-2:] == [":TRIGger:SWEEp AUTO", ":RUN"]
+    # 单次采集完成后示波器已停止，读取时不再恢复运行
+    assert scope.writes.count(":RUN") == 1
+
+
+def test_single_shot_keeps_a_stopped_scope_stopped():
+    scope = _Scope("STOP", "NORMal")
+    with single_shot(scope):
+        capture_single(scope, ["CHAN1"])
+    assert scope.writes[-1] == ":TRIGger:SWEEp NORMal"
+    assert ":RUN" not in scope.writes
+
+
+class _Reads:
+    def __init__(self, *chunks):
+        self.chunks = list(chunks)
+
+    def read_raw(self):
+        return self.chunks.pop(0) if self.chunks else b""
+
+
+def test_parse_block_strips_header_and_terminator():
+    assert bytes(parse_block(b"#15hello\n")) == b"hello"
+    assert bytes(parse_block(b"junk#210abcdefghij")) == b"abcdefghij"
+
+
+@pytest.mark.parametrize(
+    "raw, message",
+    [
+        (b"#15hel", "Truncated block"),
+        (b"#41", "Truncated IEEE"),
+        (b"hello", "Missing"),
+        (b"#0hello", "Indefinite"),
+    ],
+)
+def test_parse_block_rejects_malformed_blocks(raw, message):
+    with pytest.raises(ValueError, match=message):
+        parse_block(raw)
+
+
+def test_read_block_spans_several_reads():
+    payload = bytes(range(256)) * 4
+    raw = b"#41024" + payload + b"\n"
+    # 第一次读取只到块头的一部分
+    assert bytes(read_block(_Reads(raw[:3], raw[3:500], raw[500:]))) == payload
+    assert bytes(read_block(_Reads(raw[:1], raw[1:]))) == payload
+
+
+def test_read_block_raises_on_a_truncated_transfer():
+    with pytest.raises(ValueError, match="Truncated"):
+        read_block(_Reads(b"#41024" + b"x" * 600))
+
+
+def test_preamble_scaling_against_known_values():
+    preamble = WaveformPreamble.parse("0,2,1200,1,2.0e-09,-1.2e-06,0,0.04,-3,127\n")
+    assert (preamble.format, preamble.type, preamble.points) == (0, 2, 1200)
+    np.testing.assert_allclose(
+        preamble.scale(np.array([124, 127, 149], dtype=np.uint8)), [0.0, 0.12, 1.0]
+    )
+    np.testing.assert_allclose(preamble.time_axis(3), [-1.2e-6, -1.198e-6, -1.196e-6])
+    with pytest.raises(ValueError):
+        WaveformPreamble.parse("0,0,1200")
+
+
+def test_read_binary_waveform_word_format():
+    words = np.array([0, 32768, 65535], dtype="<u2")
+    scope = _Scope(raw=words.tobytes())
+    scope.preamble = "1,0,3,1,1e-6,0,0,1e-4,0,32768"
+    t, y = read_binary_waveform(scope, "CHAN1", "WORD")
+    np.testing.assert_allclose(y, [-3.2768, 0.0, 3.2767])
+    np.testing.assert_allclose(t, [0.0, 1e-6, 2e-6])
+    assert ":WAVeform:FORMat WORD" in scope.writes
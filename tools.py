@@ -1,39 +1,48 @@
-import time
-import pyvisa as visa
-import numpy as np
-import matplotlib.pyplot as plt
-import pandas as pd
-from datetime import datetime
 from pyvisa.errors import VisaIOError
-from PIL import Image
-import random
 from typing import Literal
 
-from scipy.signal import savgol_filter
-
-from langchain.agents import Tool
 from langchain_core.tools import StructuredTool
 import functools
 
+from instruments import CompletionTimeout, registry
+from params import ArgumentError, ToolArguments
+from measurements import MeasurementCache, measure, measure_many, parse_measurement
+from analysis import (
+    cross_correlation_delay,
+    dominant_frequency,
+    edge_delay,
+    frequency_response,
+    phase_difference,
+    waveform_metrics,
+)
+from waveform import (
+    arm_single,
+    capture_channels,
+    capture_deep_memory,
+    capture_single,
+    read_binary_waveform,
+    read_waveform,
+    single_shot,
+    wait_single_acquisition,
+)
+from render import renderer
+from sweep import SCREEN_DIVISIONS, SteppedSweep
 
-print("正在连接仪器.......")
-rm = visa.ResourceManager()
-sources = rm.list_resources()
-if not sources:
-    print("未找到仪器")
-print(sources)
-inst = rm.open_resource("USB0::0x5656::0x0832::AMOL323130008::INSTR")
-awg = rm.open_resource("USB0::0x6656::0x0834::AWG4422490001::INSTR")
-power = rm.open_resource("USB0::0x1AB1::0x0E11::DP8C200600640::INSTR")
 
+# 仪器在第一次使用时才会连接
+inst = registry.session("scope")
+awg = registry.session("awg")
+power = registry.session("power")
 
-inst.timeout = 10000
-response = inst.query("*IDN?")
-print("已连接到仪器：" + response)
+# 自动设置需要重新采集并调整档位，比普通设置耗时更长
+AUTOSCALE_TIMEOUT = 15.0
+# 等待单次扫频采集完成时，在扫频时间之外额外等待的时间（秒）
+SWEEP_CAPTURE_MARGIN = 5.0
+# 计算相位差、限制互相关搜索范围时，屏幕内至少需要的完整周期数
+MIN_PHASE_PERIODS = 2
 
-global signal_generator_amplitude
-global oscilloinst_amplitude
-global oscilloinst_frequency
+# 测量结果缓存，台架状态未变时直接复用
+measurement_cache = MeasurementCache(registry)
 
 
 #################for debug###############
@@ -46,41 +55,69 @@ global oscilloinst_frequency
 
 
 # decorator
-def parse_params(param_string):
-    if param_string is None or param_string == "":
-        return {}
-    param_dict = {}
-    params = param_string.split(", ")
-    
-    for param in params:
-        if "=" in param:
-            key, value = param.split("=", 1)  # 仅分割一次，以防值中包含 '='
-            value = value.strip("'").strip('"')  # 去除单引号和双引号
-            if value.strip():  # 确保值不为空字符串
+def param_decorator(func):
+    arguments = ToolArguments(func)
+
+    @functools.wraps(func)
+    def wrapper(param_string=None, **kwargs):
+        try:
+            params = arguments.parse(param_string, **kwargs)
+        except ArgumentError as e:
+            return f"\n---------------------------\n\n\n\n\n参数错误: {e}\n\n\n\n---------------------------\n"
+        return func(**params)
+
+    wrapper.arguments = arguments
+    return wrapper
+
+
+def uses_instruments(*names):
+    """标记工具会用到的仪器：执行期间独占这些仪器，异步调用时据此选择工作线程"""
+
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with registry.exclusive(*names):
                 try:
-                    value = float(value)
-                except ValueError:
-                    pass
-                param_dict[key] = value
-            else:
-                pass
-                # print(f"Warning: Empty value for key '{key}'")
-        else:
-            pass
-            # print(f"Warning: Malformed parameter '{param}'")
-    return param_dict
+                    return func(*args, **kwargs)
+                except CompletionTimeout as e:
+                    return f"\n---------------------------\n\n\n\n\n{e}\n\n\n\n---------------------------\n"
 
+        wrapper.instruments = names
+        return wrapper
 
+    return decorator
+
+
+def make_coroutine(func):
+    """为同步工具生成 coroutine，阻塞的仪器 I/O 在对应仪器的工作线程中执行"""
+    names = getattr(func, "instruments", ())
 
-def param_decorator(func):
     @functools.wraps(func)
-    def wrapper(param_string=None):
-        param_dict = parse_params(param_string)
-        return func(**param_dict)
+    async def coroutine(param_string=None, **kwargs):
+        if not names:
+            return func(param_string, **kwargs)
+        # 跨仪器的工具在第一个仪器的工作线程中执行
+        return await registry.session(names[0]).run(func, param_string, **kwargs)
 
-    return wrapper
+    return coroutine
+
+
+def awg_amplitude(channel: str = "CHANnel1"):
+    """信号发生器通道当前的幅值，优先取影子状态，未知时向仪器查询"""
+    header = f":{channel}:BASE:AMPLitude"
+    value = awg.shadow.get(header) if awg.shadow is not None else None
+    if value is None:
+        return parse_measurement(awg.query(f"{header}?"))
+    return float(value)
+
+
+def autoscale(timeout: float = AUTOSCALE_TIMEOUT) -> None:
+    """执行示波器自动设置，并等待其完成；超时抛出 CompletionTimeout"""
+    inst.write(":KEY:auto")
+    inst.wait_complete(timeout, strict=True)
 
 
+@uses_instruments("scope")
 @param_decorator
 def initialize_oscilloinst(initial_state: str = "ON") -> str:
     """初始化示波器"""
@@ -92,6 +129,7 @@ def initialize_oscilloinst(initial_state: str = "ON") -> str:
     return f"\n示波器初始化完成。\n"
 
 
+@uses_instruments("power")
 @param_decorator
 def set_power_supply_channel(
     channel: str = "CH1",
@@ -104,13 +142,13 @@ def set_power_supply_channel(
     设置电源的指定通道，包括电压、电流值、过流保护限值和输出状态。
     """
 
-    power.write("*IDN?")
-    power.write(f":INST {channel}")
-    power.write(f":CURR {current}")
-    power.write(f":CURR:PROT {current_protect}")
-    power.write(f":CURR:PROT:STAT ON")
-    power.write(f":VOLT {voltage}")
-    power.write(f":OUTP {channel},{output_state}")
+    with power.batch():
+        power.write(f":INST {channel}")
+        power.write(f":CURR {current}")
+        power.write(f":CURR:PROT {current_protect}")
+        power.write(f":CURR:PROT:STAT ON")
+        power.write(f":VOLT {voltage}")
+        power.write(f":OUTP {channel},{output_state}")
 
     # save_parameters_to_file(
     #     f"set_power_supply_channel: {channel}/ Voltage: {voltage}V/ Current: {current}A/ Current Protection: {current_protect}A/ Output: {output_state}"
@@ -128,6 +166,7 @@ def set_power_supply_channel(
 
 
 
+@uses_instruments("scope")
 @param_decorator
 def set_oscilloinst_channel(
     channel: str = "CHAN1",
@@ -143,14 +182,15 @@ def set_oscilloinst_channel(
     """
     设置示波器的指定通道，包括通道标识符、显示状态、耦合方式、是否反转信号、探头衰减因子、波形垂直偏移量、垂直缩放因子、测量单位和精细调节选项。
     """
-    inst.write(f":{channel}:DISP {state}")
-    inst.write(f":{channel}:COUP {coupling}")
-    inst.write(f":{channel}:INVert {invert}")
-    inst.write(f":{channel}:PROBe {probe}")
-    inst.write(f":{channel}:OFFSet {offset}")
-    inst.write(f":{channel}:SCALe {scale}")
-    inst.write(f":{channel}:UNITs {units}")
-    inst.write(f":{channel}:VERNier {vernier}")
+    with inst.batch():
+        inst.write(f":{channel}:DISP {state}")
+        inst.write(f":{channel}:COUP {coupling}")
+        inst.write(f":{channel}:INVert {invert}")
+        inst.write(f":{channel}:PROBe {probe}")
+        inst.write(f":{channel}:OFFSet {offset}")
+        inst.write(f":{channel}:SCALe {scale}")
+        inst.write(f":{channel}:UNITs {units}")
+        inst.write(f":{channel}:VERNier {vernier}")
 
     # save_parameters_to_file(
     #     f"set_channel: {channel}/ {state}/ {coupling}/ {invert}/ {probe}/ {offset}/ {scale}/ {units}/ {vernier}"
@@ -169,6 +209,7 @@ def set_oscilloinst_channel(
     )
 
 
+@uses_instruments("awg")
 @param_decorator
 def configure_signal_generator(
     channel: str = "CHANnel1",
@@ -195,29 +236,28 @@ def configure_signal_generator(
     trigger_output: Literal["CLOSe", "RISe", "FALL"] = "RISe",
 ) -> str:
     """配置信号发生器的通道、工作模式、波形类型、频率、幅值、偏移量、相位角度、占空比、反向输出、同步反向输出、幅值限制、幅值单位、PSK编码、QAM编码、触发源和触发输出极性参数"""
-    awg.write(f":{channel}:MODE {mode}")
-    awg.write(f":{channel}:BASE:WAVe {waveform}")
-    awg.write(f":{channel}:BASE:FREQuency {frequency}")
-    awg.write(f":{channel}:BASE:AMPLitude {amplitude}")
-    awg.write(f":{channel}:BASE:OFFSet {offset}")
-    awg.write(f":{channel}:BASE:PHAse {phase}")
-    awg.write(f":{channel}:BASE:DUTY {duty}")
-    awg.write(f":{channel}:INVersion {'ON' if invert else 'OFF'}")
-    awg.write(f":{channel}:OUTPut:SYNC:INVersion {'ON' if sync_invert else 'OFF'}")
-    awg.write(f":{channel}:LIMit:ENABle {'ON' if limit_enable else 'OFF'}")
-    global signal_generator_amplitude
-    if limit_lower is not None:
-        awg.write(f":{channel}:LIMit:LOWer {limit_lower}")
-    if limit_upper is not None:
-        awg.write(f":{channel}:LIMit:UPPer {limit_upper}")
-    # awg.write(f":{channel}:AMPLitude:UNIT {amplitude_unit}")
-    # awg.write(f":{channel}:LOAD {load}")
-    awg.write(f":{channel}:PSK:PNCode {psk_code}")
-    awg.write(f":{channel}:QAM:PNCode {qam_code}")
-    awg.write(f":{channel}:TRIGger:SOURce {trigger_source}")
-    awg.write(f":{channel}:TRIGger:OUTPut {trigger_output}")
-    awg.write(f":{channel}:OUTPut ON")
-    signal_generator_amplitude = amplitude
+    with awg.batch():
+        awg.write(f":{channel}:MODE {mode}")
+        awg.write(f":{channel}:BASE:WAVe {waveform}")
+        awg.write(f":{channel}:BASE:FREQuency {frequency}")
+        awg.write(f":{channel}:BASE:AMPLitude {amplitude}")
+        awg.write(f":{channel}:BASE:OFFSet {offset}")
+        awg.write(f":{channel}:BASE:PHAse {phase}")
+        awg.write(f":{channel}:BASE:DUTY {duty}")
+        awg.write(f":{channel}:INVersion {'ON' if invert else 'OFF'}")
+        awg.write(f":{channel}:OUTPut:SYNC:INVersion {'ON' if sync_invert else 'OFF'}")
+        awg.write(f":{channel}:LIMit:ENABle {'ON' if limit_enable else 'OFF'}")
+        if limit_lower is not None:
+            awg.write(f":{channel}:LIMit:LOWer {limit_lower}")
+        if limit_upper is not None:
+            awg.write(f":{channel}:LIMit:UPPer {limit_upper}")
+        # awg.write(f":{channel}:AMPLitude:UNIT {amplitude_unit}")
+        # awg.write(f":{channel}:LOAD {load}")
+        awg.write(f":{channel}:PSK:PNCode {psk_code}")
+        awg.write(f":{channel}:QAM:PNCode {qam_code}")
+        awg.write(f":{channel}:TRIGger:SOURce {trigger_source}")
+        awg.write(f":{channel}:TRIGger:OUTPut {trigger_output}")
+        awg.write(f":{channel}:OUTPut ON")
     # save_parameters_to_file(
     #     f"configure_awg: {channel}/ {mode}/ {waveform}/ {frequency}/ {amplitude}/ {offset}/ {phase}/ {duty}/ {invert}/ {sync_invert}/ {limit_enable}/ {limit_lower}/ {limit_upper}/ {amplitude_unit}/ {psk_code}/ {qam_code}/ {trigger_source}/ {trigger_output}"
     # )
@@ -241,6 +281,7 @@ def configure_signal_generator(
         f"触发输出: {trigger_output}\n"
     )
 
+@uses_instruments("scope", "awg")
 @param_decorator
 def calculate_amplitude_frequency_characteristic(
     channel: str = "CHANnel1",
@@ -250,36 +291,58 @@ def calculate_amplitude_frequency_characteristic(
     sweep_time: float = 1.4,
     trigger_sweep: bool = False,
     channel2: str = "CHAN1",
+    sweep_mode: Literal["SWEep", "STEP"] = "SWEep",
+    points: int = 100,
 ) -> str:
     """配置信号发生器的通道、扫描类型、起始频率、终止频率、扫描时间和触发扫描参数"""
 
-    global signal_generator_amplitude
-    channel = "CHANnel1"
-    sweep_type = "LTNe"
-    start_frequency = 1e3
-    stop_frequency = 1e7
-    sweep_time = 1.4
+    if sweep_mode == "STEP":
+        response = stepped_frequency_characteristic(
+            channel, channel2, sweep_type, start_frequency, stop_frequency, int(points)
+        )
+        return (
+            f"\n通道 {channel} 步进扫频完成：\n"
+            f"扫频类型: {sweep_type}\n"
+            f"起始频率: {start_frequency} Hz\n"
+            f"截止频率: {stop_frequency} Hz\n"
+            f"频点数: {int(points)}\n"
+            f"\n---------------------------\n\n\n\n{response}\n\n\n\n---------------------------\n"
+        )
+
     a = sweep_time / 14
+    source_amplitude = awg_amplitude(channel)
     awg.write(f":{channel}:OUTPut OFF")
 
-    inst.write(f":{channel}:COUP DC")
-    inst.write(":TRIGger:SWEEp SINGle")
-    amp_lev = signal_generator_amplitude / 4
-    inst.write(f":{channel}:SCALe {amp_lev}")
-    inst.write(f":TIM:SCAL {a}")
-    inst.write(f":TIM:OFFS {sweep_time/2}")
-
-    awg.write(f":{channel}:MODE SWEep")
-    awg.write(f":{channel}:SWEEp:TYPe {sweep_type}")
-    awg.write(f":{channel}:SWEEp:FREQuency:STARt {start_frequency}")
-    awg.write(f":{channel}:SWEEp:FREQuency:STOP {stop_frequency}")
-    awg.write(f":{channel}:SWEEp:TIMe {sweep_time}")
-
-    awg.write(f":{channel}:OUTPut ON")
-    if trigger_sweep:
-        awg.write(f":{channel}:SWEep:TRIGger")
-
-    print(observe__ndwave(channel, start_frequency, stop_frequency))
+    # 峰值检测只用于本次扫频采集，结束后恢复，以免影响之后的测量
+    acquire_type = inst.query(":ACQuire:TYPE?").strip() or "NORMal"
+    try:
+        inst.write(f":{channel2}:COUP DC")
+        inst.write(":TRIGger:SWEEp SINGle")
+        # 峰值检测采集，扫频信号欠采样时仍能保留包络
+        inst.write(":ACQuire:TYPE PEAK")
+        if source_amplitude:
+            inst.write(f":{channel2}:SCALe {source_amplitude / 4}")
+        inst.write(f":TIM:SCAL {a}")
+        inst.write(f":TIM:OFFS {sweep_time/2}")
+
+        awg.write(f":{channel}:MODE SWEep")
+        awg.write(f":{channel}:SWEEp:TYPe {sweep_type}")
+        awg.write(f":{channel}:SWEEp:FREQuency:STARt {start_frequency}")
+        awg.write(f":{channel}:SWEEp:FREQuency:STOP {stop_frequency}")
+        awg.write(f":{channel}:SWEEp:TIMe {sweep_time}")
+
+        # 触发方式为单次时影子状态会跳过重复的设置，每次扫频都要显式地重新布防
+        arm_single(inst)
+        awg.write(f":{channel}:OUTPut ON")
+        if trigger_sweep:
+            awg.write(f":{channel}:SWEep:TRIGger")
+
+        response = observe__ndwave(
+            channel2, start_frequency, stop_frequency, sweep_time, sweep_type,
+            reference=source_amplitude / 2 if source_amplitude else None,
+        )
+    finally:
+        inst.write(f":ACQuire:TYPE {acquire_type}")
 
     return (
         f"\n通道 {channel} 扫频配置完成：\n"
@@ -288,153 +351,207 @@ def calculate_amplitude_frequency_characteristic(
         f"截止频率: {stop_frequency} Hz\n"
         f"扫频时间: {sweep_time} s\n"
         f"扫频触发: {'是' if trigger_sweep else '否'}\n"
-        f"\n---------------------------\n\n\n\n幅频特性曲线已绘制 \n\n\n\n---------------------------\n"
+        f"\n---------------------------\n\n\n\n{response}\n\n\n\n---------------------------\n"
+    )
+
+
+def stepped_frequency_characteristic(
+    channel: str = "CHANnel1",
+    channel2: str = "CHAN1",
+    sweep_type: str = "LOG",
+    f_start=1e3,
+    f_end=1e7,
+    points: int = 100,
+):
+    """逐点步进频率测量幅频特性，信号发生器输出连续正弦波"""
+    source_amplitude = awg_amplitude(channel)
+    with awg.batch():
+        awg.write(f":{channel}:MODE CONTinue")
+        awg.write(f":{channel}:BASE:WAVe SINe")
+        awg.write(f":{channel}:OUTPut ON")
+    # 每个频点都以 :SINgle 采集，结束后恢复扫频前的触发方式和运行状态
+    with single_shot(inst):
+        with inst.batch():
+            inst.write(f":{channel2}:COUP DC")
+            inst.write(":ACQuire:TYPE NORMal")
+            if source_amplitude:
+                inst.write(f":{channel2}:SCALe {source_amplitude / 4}")
+            inst.write(":TIM:OFFS 0")
+        try:
+            response = SteppedSweep(awg, inst, channel, channel2).response(
+                f_start, f_end, points, sweep_type,
+                reference=source_amplitude / 2 if source_amplitude else None,
+            )
+        except (VisaIOError, ValueError) as e:
+            return f"未能完成步进扫频: {e}"
+    path, _ = renderer.submit(
+        response.frequency,
+        [response.gain_db],
+        prefix="frequency_response",
+        title="Amplitude-frequency characteristic curve",
+        xlabel="f/Hz",
+        ylabel="gain/dB",
+        log_x=response.log,
     )
+    return f"幅频特性曲线已绘制，图片保存为 {path}\n{response.summary()}"
 
 
+@uses_instruments("scope")
 @param_decorator
 def observe_channel_wave(
     channel: str = "CHAN1",
 ):
-    time.sleep(2)
     """观察示波器上的指定通道的波形"""
-    inst.write(f":WAVeform:SOURce {channel}")
-    inst.write(":WAVeform:MODE NORMal")
-    inst.write(":WAVeform:FORMat ASCII")
-    inst.write("WAVeform:DATA?")
-    x = inst.read()
+    inst.wait_complete(strict=True)
+    t, y = read_waveform(inst, channel)
+    path, _ = renderer.submit(
+        t, [y], title=channel, xlabel="t/s", ylabel="amp/V"
+    )
+    # save_parameters_to_file(f"observe_square_wave: {channel}")
+    return f"\n示波器上的波形已显示给用户，图片保存为 {path}\n"
 
-    # Remove unwanted characters
-    x = x.strip().replace("\r", "")
 
-    y = []
-    for i in range(1400):
-        try:
-            y.append(float(x[14 * i + 11 : 14 * i + 24]))
-        except ValueError as e:
-            print(f"ValueError at index {i}: {e}")
-            y.append(0.0)  # Append a default value in case of error
-
-    y = np.array(y)
-    t = np.arange(0, 1400, 1)
-    plt.plot(t, y)
-    # plt.show()
-    plt.savefig("observe_wave.png")
-    # save_parameters_to_file(f"observe_square_wave: {channel}")
-    return f"\n示波器上的波形已显示给用户\n"
+@uses_instruments("scope")
+@param_decorator
+def capture_channel_memory(
+    channel: str = "CHAN1",
+    mode: Literal["RAW", "MAX"] = "RAW",
+    points=None,
+):
+    """读取示波器指定通道的完整存储深度波形，保存到文件并返回统计摘要"""
+    inst.wait_complete(strict=True)
+    capture = capture_deep_memory(
+        inst, channel, points=int(points) if points else None, mode=mode
+    )
+    return f"\n深存储波形已保存\n{capture.summary()}"
 
 
+@uses_instruments("scope")
+@param_decorator
+def analyze_channel_wave(channel: str = "CHAN1"):
+    """一次采集，在本地计算指定通道的全部常用测量项"""
+    autoscale()
+    try:
+        t, y = read_binary_waveform(inst, channel)
+    except (VisaIOError, ValueError) as e:
+        return f"\n---------------------------\n\n\n\n\n未成功采集波形: {e}\n\n\n\n---------------------------\n"
+    metrics = waveform_metrics(t, y)
+    # 结果写入测量缓存，台架状态不变时其他测量工具可直接复用
+    for item, value in (
+        ("VPP", metrics.vpp),
+        ("VMAX", metrics.vmax),
+        ("VMIN", metrics.vmin),
+        ("VAVerage", metrics.vavg),
+        ("VRMS", metrics.vrms),
+        ("VTOP", metrics.vtop),
+        ("VBASe", metrics.vbase),
+        ("VAMPlitude", metrics.amplitude),
+        ("FREQuency", metrics.frequency),
+    ):
+        if value is not None:
+            measurement_cache.put(item, channel, value)
+    return f"\n---------------------------\n\n\n\n\n所测通道 {channel} 的测量结果:\n{metrics.summary()}\n\n\n---------------------------\n"
+
+
+@uses_instruments("scope")
 @param_decorator
 def calculate_slew_rate(channel: str = "CHAN1", voltage_range=5):
     """计算压摆率"""
-    inst.write(":KEY:auto")
-    time.sleep(1)
-    inst.write(f":MEASure:VAMPlitude? {channel}")
-    voltage = float(inst.read())
-    inst.write(f":MEASure:RISetime? {channel}")
-    result = inst.read()
-    # print(result)
-    if result:
-        try:
-            rise_time = float(result)
-        except ValueError:
-            rise_time = None
-            # print(f"Could not convert string to float: '{result}'")
-    else:
-        rise_time = None
-        # print("Received an empty string instead of a rise time value.")
-
-    if rise_time == None:
+    autoscale()
+    results = measure_many(inst, channel, ["VAMPlitude", "RISetime"], measurement_cache)
+    voltage, rise_time = results["VAMPlitude"], results["RISetime"]
+    if voltage is None or rise_time is None:
         return f"\n---------------------------\n\n\n\n未能成功测出压摆率\n\n\n\n---------------------------\n"
-    else:
-        inst.write(f":TIM:SCAL {rise_time/4}")  # 用于设置主时基挡位  UP ，DOWN 1
-        time.sleep(1)
-        inst.write(f":MEASure:RISetime? {channel}")
-        result1 = inst.read()
-        rise_time = float(result1)
-        slew_rate = voltage / rise_time / 1e6
-        # save_parameters_to_file(f"calculate_slew_rate: {channel}, {voltage}")
-        # print(observe__wave(channel))
-    # slew_rate = 0
+    # 屏幕分辨率下的上升时间只用于选择时基，放大后重新测量
+    inst.write(f":TIM:SCAL {rise_time/4}")  # 用于设置主时基挡位  UP ，DOWN 1
+    inst.wait_complete(strict=True)
+    rise_time = measure(inst, "RISetime", channel)
+    if rise_time is None:
+        return f"\n---------------------------\n\n\n\n未能成功测出压摆率\n\n\n\n---------------------------\n"
+    slew_rate = voltage / rise_time / 1e6
+    # save_parameters_to_file(f"calculate_slew_rate: {channel}, {voltage}")
+    # print(observe__wave(channel))
     return f"\n---------------------------\n\n\n\n压摆率是: {slew_rate:.4f} V/us \n\n\n\n---------------------------\n"
 
 
+@uses_instruments("scope")
 @param_decorator
 def calculate_time_delay(channel1: str = "CHAN1", channel2: str = "CHAN2"):
     """计算时间差"""
-    inst.write(":KEY:auto")
-
-    inst.write(f":MEASure:VAMPlitude? {channel1}")
-    voltage = float(inst.read())
-    inst.write(f":MEASure:RISetime? {channel1}")
-    result = inst.read()
-    # print(result)
-    if result:
-        try:
-            rise_time = float(result)
-        except ValueError:
-            rise_time = None
-            # print(f"Could not convert string to float: '{result}'")
-    else:
-        rise_time = None
-        # print("Received an empty string instead of a rise time value.")
+    autoscale()
+    results = measure_many(inst, channel1, ["VAMPlitude", "RISetime"], measurement_cache)
+    rise_time = results["RISetime"]
+    if rise_time is None:
+        return f"\n---------------------------\n\n\n\n\n未成功测出时间差\n\n\n\n---------------------------\n"
 
     inst.write(":CHAN1:COUP AC")
     inst.write(":CHAN2:COUP AC")
-    inst.write(":KEY:auto")
-    inst.write(f":TIM:SCAL {rise_time/4}")  # 用于设置主时基挡位  UP ，DOWN 1
-    inst.write(f":MEASure:PDEL? {channel1},{channel2}")
-    result = inst.read()
-    # print(result)
-    if result:
+    autoscale()
+
+    # 先在自动设置的时基下同一次触发采集两个通道。屏幕内至少有两个完整周期时，
+    # 才以此确定频率、限制互相关的搜索范围并计算相位差
+    max_lag = None
+    with single_shot(inst):
         try:
-            time_delay = float(result)
-        except ValueError:
-            time_delay = None
-            # print(f"Could not convert string to float: '{result}'")
-    else:
-        time_delay = None
-        # print("Received an empty string instead of a time delay value.")
-    # print(observe__dewave())
-    # time_delay = 0
-    return f"\n---------------------------\n\n\n\n\n时间差是: {abs(time_delay*1e9):4f} ns \n\n\n\n---------------------------\n"
+            t, data = capture_single(inst, [channel1, channel2])
+        except (VisaIOError, ValueError) as e:
+            return f"\n---------------------------\n\n\n\n\n未成功测出时间差: {e}\n\n\n\n---------------------------\n"
+        frequency = dominant_frequency(t, data[0])
+        if frequency and frequency * (t[-1] - t[0]) >= MIN_PHASE_PERIODS:
+            max_lag = 0.5 / frequency
+            coarse_delay = cross_correlation_delay(t, data[0], data[1], max_lag)
+        else:
+            frequency = None
+            coarse_delay = edge_delay(t, data[0], data[1])
+
+        # 再放大时基，使两个通道的边沿都在屏幕内，重新触发一次后用边沿中点精确计算时间差
+        half_window = abs(coarse_delay or 0.0) + 2 * rise_time
+        inst.write(f":TIM:SCAL {max(rise_time / 4, half_window / (SCREEN_DIVISIONS / 2))}")
+        inst.wait_complete(strict=True)
+        try:
+            t, data = capture_single(inst, [channel1, channel2])
+        except (VisaIOError, ValueError) as e:
+            return f"\n---------------------------\n\n\n\n\n未成功测出时间差: {e}\n\n\n\n---------------------------\n"
+        time_delay = edge_delay(t, data[0], data[1], max_lag)
+    if time_delay is None:
+        time_delay = coarse_delay
+    if time_delay is None:
+        # 两次采集都找不到成对的边沿时改用示波器的 PDEL 测量
+        time_delay = measure(inst, "PDEL", f"{channel1},{channel2}", measurement_cache)
+    if time_delay is None:
+        return f"\n---------------------------\n\n\n\n\n未成功测出时间差\n\n\n\n---------------------------\n"
+    phase_text = (
+        f"相位差是: {phase_difference(time_delay, frequency):4f}° \n" if frequency else ""
+    )
+    return f"\n---------------------------\n\n\n\n\n时间差是: {abs(time_delay*1e9):4f} ns \n{phase_text}\n\n\n---------------------------\n"
 
 
+@uses_instruments("scope")
 @param_decorator
 def calculate_amplitude(channel: str = "CHAN1"):
-    global oscilloinst_amplitude
-    inst.write(":KEY:auto")
-    inst.write(f":MEASure:VAMPlitude? {channel}")
-    result = inst.read()
-    if result:
-        try:
-            amplitude = float(result) / 2
-        except ValueError:
-            amplitude = None
-            # print(f"Could not convert string to float: '{result}'")
-    else:
-        amplitude = None
-        # print("Received an empty string instead of a time delay value.")
-    if amplitude == None:
-        return f"\n---------------------------\n\n\n\n\n未成功测出交流信号幅度大小\n\n\n\n---------------------------\n"
-    else:
-        amp_lev = amplitude / 6
+    vamp = measurement_cache.get("VAMPlitude", channel)
+    if vamp is None:
+        autoscale()
+        vamp = measure(inst, "VAMPlitude", channel)
+        if vamp is None:
+            return f"\n---------------------------\n\n\n\n\n未成功测出交流信号幅度大小\n\n\n\n---------------------------\n"
+        amp_lev = vamp / 2 / 6
         inst.write(f":{channel}:SCALe {amp_lev}")
-        inst.write(":KEY:auto")
-        inst.write(f":MEASure:VAMPlitude? {channel}")
-        result = inst.read()
-        amplitude = float(result) / 2
-        oscilloinst_amplitude = amplitude
-        # save_parameters_to_file(f"calculate_slew_rate: {channel}")
-        return f"\n---------------------------\n\n\n\n\n所测通道交流信号的幅度是: {amplitude:4f} V \n所测通道交流信号的峰峰值是: {amplitude*2:4f} V \n\n\n\n---------------------------\n"
+        autoscale()
+        vamp = measure(inst, "VAMPlitude", channel, measurement_cache)
+        if vamp is None:
+            return f"\n---------------------------\n\n\n\n\n未成功测出交流信号幅度大小\n\n\n\n---------------------------\n"
+    amplitude = vamp / 2
+    # save_parameters_to_file(f"calculate_slew_rate: {channel}")
+    return f"\n---------------------------\n\n\n\n\n所测通道交流信号的幅度是: {amplitude:4f} V \n所测通道交流信号的峰峰值是: {amplitude*2:4f} V \n\n\n\n---------------------------\n"
 
 
+@uses_instruments("scope")
 @param_decorator
 def calculate_DC(channel: str = "CHAN1"):
     inst.write(f":{channel}:COUP DC")
-    inst.write(":KEY:auto")
-    inst.write(f":MEASure:VAVerage? {channel}")
-    result = inst.read()
+    autoscale()
+    result = inst.query(f":MEASure:VAVerage? {channel}")
     if result:
         try:
             amplitude = float(result) / 2
@@ -451,90 +568,59 @@ def calculate_DC(channel: str = "CHAN1"):
     return f"\n---------------------------\n\n\n\n\n所测通道直流信号大小是: {amplitude:4f} V \n\n\n\n---------------------------\n"
 
 
+@uses_instruments("scope")
 @param_decorator
 def calculate_frequency(channel: str = "CHAN1"):
-    global oscilloinst_frequency
-    inst.write(":KEY:auto")
-    inst.write(f":{channel}:COUP AC")
-    inst.write(f":MEASure:VAMPlitude? {channel}")
-    result = inst.read()
-    if result:
-        try:
-            amplitude = float(result) / 2
-        except ValueError:
-            amplitude = None
-    else:
-        amplitude = None
-    if amplitude == None:
-        return f"\n---------------------------\n\n\n\n\n未成功测出频率大小\n\n\n\n---------------------------\n"
-    else:
-        amp_lev = amplitude / 6
+    frequency = measurement_cache.get("FREQuency", channel)
+    if frequency is None:
+        autoscale()
+        inst.write(f":{channel}:COUP AC")
+        vamp = measure(inst, "VAMPlitude", channel)
+        if vamp is None:
+            return f"\n---------------------------\n\n\n\n\n未成功测出频率大小\n\n\n\n---------------------------\n"
+        amp_lev = vamp / 2 / 6
         inst.write(f":{channel}:SCALe {amp_lev}")
-        inst.write(":KEY:auto")
-
-        inst.write(f":MEASure:FREQuency? {channel}")
-        result = inst.read()
-        if result:
-            try:
-                frequency = float(result)
-            except ValueError:
-                frequency = None
-        else:
-            frequency = None
-        if frequency == None:
+        autoscale()
+        frequency = measure(inst, "FREQuency", channel, measurement_cache)
+        if frequency is None:
             return f"\n---------------------------\n\n\n\n\n未成功测出频率大小\n\n\n\n---------------------------\n"
-        else:
-            oscilloinst_frequency = frequency
-    # frequency = 0
     return f"\n---------------------------\n\n\n\n\n所测通道的频率是: {frequency:4f} Hz \n\n\n\n---------------------------\n"
 
 
+@uses_instruments("scope")
 @param_decorator
 def calculate_power_ripple(channel: str = "CHAN1"):
     inst.write(f":{channel}:COUP DC")
-    inst.write(":KEY:auto")
+    autoscale()
     inst.write(f":{channel}:COUP DC")
 
-    inst.write(f":MEASure:VAVerage? {channel}")
-    result = inst.read()
-    if result:
-        try:
-            verage = float(result) * 1000
-        except ValueError:
-            verage = 1
-    else:
-        verage = 1
+    verage = measure(inst, "VAVerage", channel, measurement_cache)
+    verage = verage * 1000 if verage is not None else 1
 
     inst.write(f":{channel}:COUP AC")
     inst.write(f":{channel}:SCALe 0.05")
-    inst.write(":KEY:auto")
-    inst.write(f":MEASure:VAMPlitude? {channel}")
-    result = inst.read()
-    if result:
-        try:
-            amplitude = float(result) * 1000
-        except ValueError:
-            amplitude = 1
-    else:
-        amplitude = 1
-    inst.write(f":MEASure:FREQuency? {channel}")
-    result = inst.read()
-    if result:
-        try:
-            frequency = float(result)
-        except ValueError:
-            frequency = 0
-    else:
-        frequency = 0
+    autoscale()
+    results = measure_many(inst, channel, ["VAMPlitude", "FREQuency"], measurement_cache)
+    amplitude = results["VAMPlitude"]
+    amplitude = amplitude * 1000 if amplitude is not None else 1
+    frequency = results["FREQuency"]
+    frequency = frequency if frequency is not None else 0
 
     a = abs(amplitude / verage)
 
     return f"\n---------------------------\n\n\n\n\n电源直流电压为: {verage/1000:4f} V \n开关电源纹波频率为: {frequency:4f} Hz\n所测电源纹波大小为: {amplitude:4f} mV\n电源纹波系数为{a:4f}\n\n\n\n\n---------------------------\n"
 
+@uses_instruments("scope", "awg")
 @param_decorator
-def calculate_opa_Magnification(channel: str = "CHAN1"):
-    if oscilloinst_amplitude and signal_generator_amplitude:
-        amplitude = oscilloinst_amplitude
+def calculate_opa_Magnification(channel: str = "CHAN1", source_channel: str = "CHANnel1"):
+    # 输出幅度优先取最近一次的测量结果，台架状态改变或结果过期后在此重新测量
+    vamp = measurement_cache.get("VAMPlitude", channel)
+    if vamp is None:
+        autoscale()
+        vamp = measure(inst, "VAMPlitude", channel, measurement_cache)
+    signal_generator_amplitude = awg_amplitude(source_channel)
+    if vamp and signal_generator_amplitude:
+        amplitude = vamp / 2
         voltage_range = signal_generator_amplitude / 2
         # save_parameters_to_file(
         #     f"calculate_opa_Magnification: {channel}, {voltage_range}"
@@ -544,63 +630,27 @@ def calculate_opa_Magnification(channel: str = "CHAN1"):
         return f"\n---------------------------\n\n\n\n\n为能成功测量运放增益 \n\n\n\n---------------------------\n"
 
 
-def observe__dewave():
+def observe__dewave(channel1: str = "CHAN1", channel2: str = "CHAN2"):
     """观察示波器上的指定通道的波形"""
-    # inst.write(":TIM:SCAL?")
-    # t_level = float(inst.read())
-
-    # inst.write(f":WAVeform:SOURce CHAN1")
-    # inst.write(":WAVeform:MODE NORMal")
-    # inst.write(":WAVeform:FORMat ASCII")
-    # inst.write("WAVeform:DATA?")
-    # x1 = inst.read()
-    # time.sleep(3)
-    # inst.write(f":WAVeform:SOURce CHAN2")
-    # inst.write(":WAVeform:MODE NORMal")
-    # inst.write(":WAVeform:FORMat ASCII")
-    # inst.write("WAVeform:DATA?")
-    # x2 = inst.read()
-    # # Remove unwanted characters
-    # fig, ax = plt.subplots()
-    # x1 = x1.strip().replace("\r", "")
-    # x2 = x2.strip().replace("\r", "")
-    # y1 = []
-    # for i in range(1400):
-    #     try:
-    #         y1.append(float(x1[14 * i + 11 : 14 * i + 24]))
-    #     except ValueError as e:
-    #         print(f"ValueError at index {i}: {e}")
-    #         y1.append(0.0)  # Append a default value in case of error
-    # y2 = []
-    # for i in range(1400):
-    #     try:
-    #         y2.append(float(x2[14 * i + 11 : 14 * i + 24]))
-    #     except ValueError as e:
-    #         print(f"ValueError at index {i}: {e}")
-    #         y2.append(0.0)  # Append a default value in case of error
-
-    # y1 = np.array(y1)
-    # y2 = np.array(y2)
-    # y1 = savgol_filter(y1, 53, 3)
-    # y2 = savgol_filter(y2, 53, 3)
-    # t = np.arange(0, 1400, 1)
-    # t = t * t_level * 1e9 / 100
-    # ax.plot(t, y1, "r")
-    # ax.plot(t, y2, "b")
-    # ax.set_title("observe_square_wave")
-    # ax.set_xlabel("t/ns")
-    # ax.set_ylabel("amp/V")
-    # ax.grid()
-    # fig.savefig("observe_wave.png")
-    # # save_parameters_to_file(f"observe_square_wave")
-    return f"\n示波器上的波形已显示给用户，波形已保存为图片\n"
+    inst.wait_complete()
+    t, data = capture_channels(inst, [channel1, channel2])
+    path, _ = renderer.submit(
+        t * 1e9,
+        data,
+        colors=["r", "b"],
+        title="observe_square_wave",
+        xlabel="t/ns",
+        ylabel="amp/V",
+    )
+    # save_parameters_to_file(f"observe_square_wave")
+    return f"\n示波器上的波形已显示给用户，波形已保存为图片 {path}\n"
 
 
 def observe__wave(
     channel: str = "CHAN1",
 ):
-    time.sleep(2)
     """观察示波器上的指定通道的波形"""
+    inst.wait_complete()
     # inst.write(":TIM:SCAL?")
     # t_level = float(inst.read())
 
@@ -643,46 +693,37 @@ def observe__wave(
     return f"\n示波器上的波形已显示给用户，波形已保存为图片\n"
 
 
-def observe__ndwave(channel: str = "CHAN1", f_start=1e3, f_end=1e7):
-    # time.sleep(2)
-    # """观察示波器上的指定通道的波形"""
-    # # inst.write(f":WAVeform:SOURce {channel}")
-    # # inst.write(":WAVeform:MODE NORMal")
-    # # inst.write(":WAVeform:FORMat ASCII")
-    # # inst.write("WAVeform:DATA?")
-    # # x = inst.read()
-    # x=0
-    # # Remove unwanted characters
-    # x = x.strip().replace("\r", "")
-    # fig, ax = plt.subplots()
-    # y = []
-    # for i in range(1400):
-    #     try:
-    #         y.append(float(x[14 * i + 11 : 14 * i + 24]))
-    #     except ValueError as e:
-    #         print(f"ValueError at index {i}: {e}")
-    #         y.append(0.0)  # Append a default value in case of error
-
-    # y = np.array(y)
-    # t = np.arange(0, 1400, 1)
-    # y1 = abs(y)
-    # y1 = savgol_filter(y1, 53, 3)
-    # f = t * (f_start + f_end) / 1400
-    # ax.plot(f, y1)
-    # ax.set_title("Amplitude-frequency characteristic curve")
-    # ax.set_xlabel("f/Hz")
-    # ax.set_ylabel("amp/V")
-    # ax.grid()
-    # # plt.title("Amplitude-frequency characteristic curve")
-    # # plt.xlabel("f/Hz")
-    # # plt.ylabel("amp/V")
-    # # plt.grid()
-    # # plt.show()
-    # # plt.savefig("observe_wave1.png")
-    # fig.savefig("observe_wave.png")
-
+def observe__ndwave(
+    channel: str = "CHAN1",
+    f_start=1e3,
+    f_end=1e7,
+    sweep_time=1.4,
+    sweep_type="LINe",
+    reference=None,
+):
+    """采集扫频响应并计算幅频特性曲线和 -3 dB 带宽"""
+    if not wait_single_acquisition(inst, sweep_time + SWEEP_CAPTURE_MARGIN):
+        return "扫频采集未在规定时间内完成，未能绘制幅频特性曲线"
+    try:
+        t, y = read_binary_waveform(inst, channel)
+        # 示波器在扫频开始时触发，触发点即扫频起点
+        response = frequency_response(
+            t, y, f_start, f_end, sweep_time, sweep_type, reference=reference
+        )
+    except (VisaIOError, ValueError) as e:
+        return f"未能计算幅频特性: {e}"
+    path, _ = renderer.submit(
+        response.frequency,
+        [response.gain_db],
+        prefix="frequency_response",
+        title="Amplitude-frequency characteristic curve",
+        xlabel="f/Hz",
+        ylabel="gain/dB",
+        log_x=response.log,
+    )
     # save_parameters_to_file(f"observe_square_wave: {channel}")
-    return f"\n示波器上的波形已显示给用户，波形已保存为图片\n"
+    return f"幅频特性曲线已绘制，图片保存为 {path}\n{response.summary()}"
+
 
 @param_decorator
 def feedback_user(content:str,role:str):
@@ -695,72 +736,100 @@ tools = [
     StructuredTool.from_function(
         name="initialize_oscilloinst",
         func=initialize_oscilloinst,
+        coroutine=make_coroutine(initialize_oscilloinst),
         description="初始化示波器。重置并清除仪器，未设置自动设置。",
     ),
     StructuredTool.from_function(
         name="set_oscilloinst_channel",
         func=set_oscilloinst_channel,
+        coroutine=make_coroutine(set_oscilloinst_channel),
         description="设置示波器的指定通道，包括通道标识符、显示状态、耦合方式、电阻值、是否反转信号、探头衰减因子、波形垂直偏移量、垂直缩放因子、测量单位和精细调节选项。",
     ),
     StructuredTool.from_function(
         name="configure_signal_generator",
         func=configure_signal_generator,
+        coroutine=make_coroutine(configure_signal_generator),
         description="配置信号发生器的通道、工作模式、波形类型、频率、幅值、偏移量、相位角度、占空比、反向输出、同步反向输出、幅值限制、幅值单位、负载阻抗、PSK编码、QAM编码、触发源和触发输出极性参数,扫频时不使用此函数",
     ),
     StructuredTool.from_function(
         name="observe_channel_wave",
         func=observe_channel_wave,
+        coroutine=make_coroutine(observe_channel_wave),
         description="观察示波器上的指定通道的波形。默认波形源为 CHAN1",
     ),
+    StructuredTool.from_function(
+        name="capture_channel_memory",
+        func=capture_channel_memory,
+        coroutine=make_coroutine(capture_channel_memory),
+        description="以 RAW 或 MAX 模式读取示波器指定通道的完整存储深度波形（可达数百万点），保存到本地文件并返回点数、采样率、峰峰值、平均值和有效值等摘要。默认波形源为 CHAN1",
+    ),
+    StructuredTool.from_function(
+        name="analyze_channel_wave",
+        func=analyze_channel_wave,
+        coroutine=make_coroutine(analyze_channel_wave),
+        description="只采集一次波形，在本地同时计算示波器通道的峰峰值、平均值、有效值、幅度、上升/下降时间、频率、纹波和压摆率。需要多个测量项时优先使用本函数。默认波形源为 CHAN1",
+    ),
     StructuredTool.from_function(
         name="calculate_slew_rate",
         func=calculate_slew_rate,
+        coroutine=make_coroutine(calculate_slew_rate),
         description="计算压摆率。返回压摆率的大小",
         # return_direct = True
     ),
     StructuredTool.from_function(
         name="calculate_time_delay",
         func=calculate_time_delay,
+        coroutine=make_coroutine(calculate_time_delay),
         description="计算示波器两个通道的时间差。返回时间差的大小",
     ),
     StructuredTool.from_function(
         name="calculate_amplitude",
         func=calculate_amplitude,
+        coroutine=make_coroutine(calculate_amplitude),
         description="测量示波器通道交流信号幅度或峰峰值。返回幅度的大小",
     ),
     StructuredTool.from_function(
         name="calculate_DC",
         func=calculate_DC,
+        coroutine=make_coroutine(calculate_DC),
         description="测量示波器通道直流信号。返回直流的大小",
     ),
     StructuredTool.from_function(
         name="calculate_frequency",
         func=calculate_frequency,
+        coroutine=make_coroutine(calculate_frequency),
         description="测量示波器通道信号频率。返回频率的大小",
     ),
     StructuredTool.from_function(
         name="calculate_power_ripple",
         func=calculate_power_ripple,
+        coroutine=make_coroutine(calculate_power_ripple),
         description="测量开关电源纹波。返回电源纹波的大小",
     ),
     StructuredTool.from_function(
         name="calculate_opa_Magnification",
         func=calculate_opa_Magnification,
+        coroutine=make_coroutine(calculate_opa_Magnification),
         description="测量运算放大器的放大倍数（增益）。返回其大小",
     ),
     StructuredTool.from_function(
         name="calculate_amplitude_frequency_characteristic",
         func=calculate_amplitude_frequency_characteristic,
-        description="配置信号发生器扫频相关参数并测量模块的幅频特性。返回其大小",
+        coroutine=make_coroutine(calculate_amplitude_frequency_characteristic),
+        description="配置信号发生器扫频相关参数并测量模块的幅频特性，返回 -3 dB 带宽等结果。sweep_mode 为 SWEep 时用信号发生器连续扫频、示波器一次采集；为 STEP 时逐点步进频率测量，动态范围和精度更高，points 为频点数",
     ),
     StructuredTool.from_function(
         name="feedback_user",
         func=feedback_user,
+        coroutine=make_coroutine(feedback_user),
         description="遇到任何异常情况时请不要道歉，而是按照格式来调用本函数，反馈给用户（请务必注意本函数只能反馈报错的内容）",
         return_direct=True
     ),
 ]
 
-set_power_supply_channel(
-    channel="CH1", voltage=5.0, current=2.0, current_protect=2.3, output_state="ON"
-)
+
+def setup_bench():
+    """上电前的台架准备：打开电源输出"""
+    set_power_supply_channel(
+        channel="CH1", voltage=5.0, current=2.0, current_protect=2.3, output_state="ON"
+    )
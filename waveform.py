@@ -0,0 +1,404 @@
+"""Waveform transfer helpers for the oscilloscope."""
+
+import os
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Iterator, List, NamedTuple, Optional, Sequence, Tuple
+
+import numpy as np
+from pyvisa.errors import VisaIOError
+
+# 旧版 ASCII 读取固定为 1400 个点，每个点占 14 个字符
+ASCII_POINTS = 1400
+ASCII_FIELD_WIDTH = 14
+ASCII_FIELD_OFFSET = 11
+
+SCOPE_CHANNELS = ("CHAN1", "CHAN2")
+
+# 深存储读取：每次传输的点数，以及采样数据文件的保存目录
+DEEP_MEMORY_CHUNK = 250_000
+CAPTURE_DIR = "captures"
+# 等待一次单次触发采集完成的时间（秒）
+SINGLE_CAPTURE_TIMEOUT = 5.0
+
+_BINARY_DTYPES = {
+    "BYTE": np.dtype("u1"),
+    "WORD": np.dtype("<u2"),
+}
+
+
+class WaveformPreamble(NamedTuple):
+    """Parsed reply of `:WAVeform:PREamble?`."""
+
+    format: int
+    type: int
+    points: int
+    count: int
+    x_increment: float
+    x_origin: float
+    x_reference: float
+    y_increment: float
+    y_origin: float
+    y_reference: float
+
+    @classmethod
+    def parse(cls, reply: str) -> "WaveformPreamble":
+        fields = [f for f in reply.strip().split(",") if f]
+        if len(fields) < 10:
+            raise ValueError(f"Malformed waveform preamble: {reply!r}")
+        values = [float(f) for f in fields[:10]]
+        return cls(
+            int(values[0]),
+            int(values[1]),
+            int(values[2]),
+            int(values[3]),
+            *values[4:],
+        )
+
+    def time_axis(self, n_points: int) -> np.ndarray:
+        index = np.arange(n_points) - self.x_reference
+        return index * self.x_increment + self.x_origin
+
+    def scale(self, raw: np.ndarray) -> np.ndarray:
+        offset = self.y_origin + self.y_reference
+        return (raw.astype(np.float64) - offset) * self.y_increment
+
+
+def _header_complete(raw: bytes) -> bool:
+    start = raw.find(b"#")
+    if start < 0 or start + 2 > len(raw):
+        return False
+    digits = raw[start + 1 : start + 2]
+    return not digits.isdigit() or len(raw) >= start + 2 + int(digits)
+
+
+def _block_extent(raw: bytes) -> Tuple[int, int]:
+    start = raw.find(b"#")
+    if start < 0 or start + 2 > len(raw):
+        raise ValueError("Missing IEEE 488.2 block header")
+    n_digits = int(raw[start + 1 : start + 2])
+    if n_digits == 0:
+        raise ValueError("Indefinite-length blocks are not supported")
+    header_end = start + 2 + n_digits
+    if header_end > len(raw):
+        raise ValueError("Truncated IEEE 488.2 block header")
+    return header_end, int(raw[start + 2 : header_end])
+
+
+def parse_block(raw: bytes) -> memoryview:
+    """Strip an IEEE 488.2 definite-length block header (`#<n><len><data>`)."""
+    header_end, length = _block_extent(raw)
+    if header_end + length > len(raw):
+        raise ValueError(
+            f"Truncated block: expected {length} bytes, got {len(raw) - header_end}"
+        )
+    return memoryview(raw)[header_end : header_end + length]
+
+
+def read_block(inst) -> memoryview:
+    """Read a complete definite-length block, even if it spans several reads."""
+    raw = bytearray(inst.read_raw())
+    # 第一次读取可能连块头都不完整
+    while not _header_complete(raw):
+        chunk = inst.read_raw()
+        if not chunk:
+            break
+        raw += chunk
+    header_end, length = _block_extent(raw)
+    while len(raw) < header_end + length:
+        chunk = inst.read_raw()
+        if not chunk:
+            break
+        raw += chunk
+    return parse_block(bytes(raw))
+
+
+def read_preamble(inst) -> WaveformPreamble:
+    return WaveformPreamble.parse(inst.query(":WAVeform:PREamble?"))
+
+
+def _read_binary_source(inst, channel: str, dtype: np.dtype):
+    inst.write(f":WAVeform:SOURce {channel}")
+    preamble = read_preamble(inst)
+    inst.write(":WAVeform:DATA?")
+    block = read_block(inst)
+    raw = np.frombuffer(block, dtype=dtype, count=len(block) // dtype.itemsize)
+    return preamble, raw
+
+
+def read_binary_waveform(
+    inst, channel: str, data_format: str = "BYTE"
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Read one channel as a binary block and scale it to volts."""
+    inst.write(":WAVeform:MODE NORMal")
+    inst.write(f":WAVeform:FORMat {data_format}")
+    preamble, raw = _read_binary_source(inst, channel, _BINARY_DTYPES[data_format])
+    return preamble.time_axis(raw.size), preamble.scale(raw)
+
+
+def wait_single_acquisition(inst, timeout: float, interval: float = 0.1) -> bool:
+    """Poll the trigger status until a single-shot acquisition has stopped.
+
+    `*OPC?` is waited for first so that `:SINGle` has been processed; until
+    then the status may still read the STOP left by the previous capture.
+    """
+    deadline = time.monotonic() + timeout
+    if not inst.wait_complete(timeout):
+        return False
+    while time.monotonic() < deadline:
+        if inst.query(":TRIGger:STATus?").strip().upper() == "STOP":
+            return True
+        time.sleep(interval)
+    return False
+
+
+def _resume_command(inst) -> Optional[str]:
+    """The command that resumes the current acquisition after `:STOP`, or None.
+
+    A stopped scope stays stopped, so the record on screen is kept; one armed
+    for a single shot is re-armed rather than put into continuous run.
+    """
+    if inst.query(":TRIGger:STATus?").strip().upper() == "STOP":
+        return None
+    sweep = inst.query(":TRIGger:SWEEp?").strip().upper()
+    return ":SINGle" if sweep.startswith("SING") else ":RUN"
+
+
+def arm_single(inst) -> None:
+    """Send `:SINGle`, which also switches the trigger sweep to SINGle.
+
+    The shadow state does not see that switch, so its trigger sweep entry is
+    dropped; a later write of the previous sweep mode is then not skipped.
+    """
+    inst.write(":SINGle")
+    if getattr(inst, "shadow", None) is not None:
+        inst.shadow.forget(":TRIGger:SWEEp")
+
+
+@contextmanager
+def single_shot(inst) -> Iterator[None]:
+    """Block that takes single-shot acquisitions with `arm_single`.
+
+    The trigger sweep mode and the run state from before the block are
+    restored on exit.
+    """
+    sweep = inst.query(":TRIGger:SWEEp?").strip()
+    resume = _resume_command(inst)
+    try:
+        yield
+    finally:
+        if sweep:
+            inst.write(f":TRIGger:SWEEp {sweep}")
+        if resume is not None:
+            inst.write(resume)
+
+
+def enabled_channels(inst) -> List[str]:
+    return [
+        channel
+        for channel in SCOPE_CHANNELS
+        if inst.query(f":{channel}:DISPlay?").strip().upper() in ("1", "ON")
+    ]
+
+
+def capture_channels(
+    inst, channels: Optional[Sequence[str]] = None, data_format: str = "BYTE"
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Read several channels of the same acquisition in binary.
+
+    The acquisition is stopped while the channels are transferred, so every
+    row comes from the same trigger, and resumed afterwards only if it was
+    running. Returns `(t, data)` where `data` has the
+    shape `(n_channels, n_points)` and `t` is the shared time axis.
+    """
+    if channels is None:
+        channels = enabled_channels(inst)
+    dtype = _BINARY_DTYPES[data_format]
+    resume = _resume_command(inst)
+    inst.write(":STOP")
+    try:
+        inst.write(":WAVeform:MODE NORMal")
+        inst.write(f":WAVeform:FORMat {data_format}")
+        captures = [_read_binary_source(inst, ch, dtype) for ch in channels]
+    finally:
+        if resume is not None:
+            inst.write(resume)
+
+    n_points = min(raw.size for _, raw in captures)
+    data = np.empty((len(captures), n_points))
+    for row, (preamble, raw) in zip(data, captures):
+        row[:] = preamble.scale(raw[:n_points])
+    return captures[0][0].time_axis(n_points), data
+
+
+def capture_single(
+    inst,
+    channels: Optional[Sequence[str]] = None,
+    timeout: float = SINGLE_CAPTURE_TIMEOUT,
+    data_format: str = "BYTE",
+) -> Tuple[np.ndarray, np.ndarray]:
+    """`capture_channels` on a fresh single-shot acquisition.
+
+    Settings changed just before are guaranteed to apply to the record read.
+    Raises ValueError if the scope does not trigger within `timeout` s.
+    """
+    arm_single(inst)
+    if not wait_single_acquisition(inst, timeout):
+        raise ValueError(f"Single-shot acquisition did not complete in {timeout:g} s")
+    return capture_channels(inst, channels, data_format)
+
+
+class DeepCapture(NamedTuple):
+    """A deep-memory record stored on disk, with statistics of its samples."""
+
+    path: str
+    channel: str
+    points: int
+    x_increment: float
+    x_origin: float
+    minimum: float
+    maximum: float
+    mean: float
+    rms: float
+
+    def load(self) -> np.memmap:
+        """Map the samples (float32 volts) without reading them into memory."""
+        return np.memmap(self.path, dtype=np.float32, mode="r", shape=(self.points,))
+
+    def time_axis(self, start: int = 0, stop: Optional[int] = None) -> np.ndarray:
+        stop = self.points if stop is None else stop
+        return np.arange(start, stop) * self.x_increment + self.x_origin
+
+    def summary(self) -> str:
+        duration = self.points * self.x_increment
+        rate = 1 / self.x_increment if self.x_increment else 0.0
+        return (
+            f"通道: {self.channel}\n"
+            f"采样点数: {self.points}\n"
+            f"采样率: {rate:.6g} Sa/s\n"
+            f"记录时长: {duration:.6g} s\n"
+            f"最小值: {self.minimum:.6g} V\n"
+            f"最大值: {self.maximum:.6g} V\n"
+            f"峰峰值: {self.maximum - self.minimum:.6g} V\n"
+            f"平均值: {self.mean:.6g} V\n"
+            f"有效值: {self.rms:.6g} V\n"
+            f"数据文件: {self.path}\n"
+        )
+
+
+def _capture_path(channel: str) -> str:
+    os.makedirs(CAPTURE_DIR, exist_ok=True)
+    stamp = datetime.now().strftime("%Y%m%d_%H%M%S_%f")
+    return os.path.join(CAPTURE_DIR, f"{channel}_{stamp}.f32")
+
+
+def capture_deep_memory(
+    inst,
+    channel: str = "CHAN1",
+    path: Optional[str] = None,
+    points: Optional[int] = None,
+    mode: str = "RAW",
+    data_format: str = "BYTE",
+    chunk_points: int = DEEP_MEMORY_CHUNK,
+) -> DeepCapture:
+    """Read a channel's acquisition memory in windows into a memory-mapped file.
+
+    The record is fetched `chunk_points` at a time with `:WAVeform:STARt` /
+    `:WAVeform:STOP`, scaled, and written straight into a float32 `np.memmap`,
+    so a multi-million point record never has to fit in Python memory. The
+    transfer range is restored afterwards, and the acquisition is resumed
+    only if it was running.
+    """
+    dtype = _BINARY_DTYPES[data_format]
+    path = path or _capture_path(channel)
+    window = None
+    resume = _resume_command(inst)
+    inst.write(":STOP")
+    try:
+        inst.write(f":WAVeform:SOURce {channel}")
+        window = (
+            inst.query(":WAVeform:STARt?").strip(),
+            inst.query(":WAVeform:STOP?").strip(),
+        )
+        inst.write(f":WAVeform:MODE {mode}")
+        inst.write(f":WAVeform:FORMat {data_format}")
+        if points:
+            inst.write(f":WAVeform:POINts {points}")
+        preamble = read_preamble(inst)
+        total = preamble.points
+        samples = np.memmap(path, dtype=np.float32, mode="w+", shape=(total,))
+        minimum, maximum = np.inf, -np.inf
+        total_sum = total_sumsq = 0.0
+        filled = 0
+        # 仪器的起止点序号从 1 开始
+        for start in range(1, total + 1, chunk_points):
+            stop = min(start + chunk_points - 1, total)
+            inst.write(f":WAVeform:STARt {start}")
+            inst.write(f":WAVeform:STOP {stop}")
+            inst.write(":WAVeform:DATA?")
+            block = read_block(inst)
+            raw = np.frombuffer(block, dtype=dtype, count=len(block) // dtype.itemsize)
+            chunk = preamble.scale(raw[: total - filled])
+            samples[filled : filled + chunk.size] = chunk
+            filled += chunk.size
+            if chunk.size:
+                minimum = min(minimum, float(chunk.min()))
+                maximum = max(maximum, float(chunk.max()))
+                total_sum += float(chunk.sum())
+                total_sumsq += float(np.dot(chunk, chunk))
+        samples.flush()
+        del samples
+    finally:
+        if window is not None:
+            # 恢复读取前的范围，之后的 NORMal 模式读取不会再设置 STARt/STOP
+            inst.write(f":WAVeform:STARt {window[0]}")
+            inst.write(f":WAVeform:STOP {window[1]}")
+        if resume is not None:
+            inst.write(resume)
+
+    n = max(filled, 1)
+    return DeepCapture(
+        path=path,
+        channel=channel,
+        points=filled,
+        x_increment=preamble.x_increment,
+        x_origin=preamble.x_origin,
+        minimum=minimum if filled else 0.0,
+        maximum=maximum if filled else 0.0,
+        mean=total_sum / n,
+        rms=float(np.sqrt(total_sumsq / n)),
+    )
+
+
+def read_ascii_waveform(inst, channel: str) -> Tuple[np.ndarray, np.ndarray]:
+    """Fixed-width ASCII transfer, kept for instruments without binary support."""
+    inst.write(f":WAVeform:SOURce {channel}")
+    inst.write(":WAVeform:MODE NORMal")
+    inst.write(":WAVeform:FORMat ASCII")
+    inst.write(":WAVeform:DATA?")
+    x = inst.read().strip().replace("\r", "")
+
+    y = np.zeros(ASCII_POINTS)
+    for i in range(ASCII_POINTS):
+        start = ASCII_FIELD_WIDTH * i + ASCII_FIELD_OFFSET
+        try:
+            y[i] = float(x[start : start + ASCII_FIELD_WIDTH - 1])
+        except ValueError as e:
+            print(f"ValueError at index {i}: {e}")
+    return np.arange(ASCII_POINTS, dtype=np.float64), y
+
+
+def read_waveform(
+    inst, channel: str = "CHAN1", data_format: str = "BYTE"
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Read a channel in binary, falling back to ASCII if the transfer fails.
+
+    Returns `(t, y)`: the time axis in seconds and the samples in volts. The
+    ASCII fallback has no preamble, so its time axis is the sample index.
+    """
+    try:
+        return read_binary_waveform(inst, channel, data_format)
+    except (VisaIOError, ValueError) as e:
+        print(f"二进制波形读取失败，改用 ASCII 模式: {e}")
+        return read_ascii_waveform(inst, channel)